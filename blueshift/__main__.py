@@ -32,6 +32,8 @@ from blueshift.utils.types import (HashKeyType,
                                    TimezoneType,
                                    DateType)
 from blueshift.utils.run import BlueShiftEnvironment, run_algo
+from blueshift.utils.sweep import (parse_param_grid, parse_date_ranges,
+                                   make_jobs, run_sweep)
 from blueshift.utils.helpers import list_to_args_kwargs
 from blueshift.utils.exceptions import BlueShiftException
 
@@ -69,6 +71,7 @@ def main(ctx, api_key, config_file):
         Usage:\n
             blueshift config > ~/blushift_config.json\n
             blueshift run --mode backtest [--data-frequency 5m --initial-capital 1000] --algo-file 'myalgo.py'\n
+            blueshift sweep [-p lookback=10,20,50 -p leverage=1,2 -d 2018-01-01:2018-12-31 --processes 8] --algo-file 'myalgo.py' --output results.csv\n
             blueshift query [--api-key your-blueshift-api-key] --algo your-unique-backtest-or-livetrade-ID --command query-command\n
             blueshift --help
     '''
@@ -214,11 +217,16 @@ def config(ctx, root, timezone, broker, broker_id, broker_key,
     '--publish/--no-publish',
     default=False,
     help='Turn on/ off streaming results. [publish/no-publish')
+@click.option(
+    '--sparse/--no-sparse',
+    default=False,
+    help='Skip bars with no scheduled or order events in backtest.'\
+            ' [sparse/no-sparse]')
 @click.argument('arglist', nargs=-1, type=click.STRING)
 @click.pass_context
 def run(ctx, start_date, end_date, initial_capital, 
         algo_file, run_mode, broker, name, platform, output, show_progress, 
-        publish, arglist):
+        publish, sparse, arglist):
     '''
         Set up the context and trigger the run.
     '''
@@ -235,7 +243,120 @@ def run(ctx, start_date, end_date, initial_capital,
         
         run_algo(
                 output, show_progress, publish, 
-                trading_environment=trading_environment, *args, **kwargs)
+                trading_environment=trading_environment, sparse=sparse,
+                *args, **kwargs)
+    except BlueShiftException as e:
+        click.secho(str(e), fg="red")
+        sys_exit(1)
+        os_exit(1)
+
+@main.command(context_settings=CONTEXT_SETTINGS)
+@click.option(
+    '-s',
+    '--start-date',
+    default=None,
+    type=DateType(),
+    help='start date for backtests.',
+    )
+@click.option(
+    '-e',
+    '--end-date',
+    default=None,
+    type=DateType(),
+    help='end date for backtests.',
+    )
+@click.option(
+    '-c',
+    '--initial-capital',
+    default=10000,
+    type=click.FLOAT,
+    help='Initial capital for backtests.',
+    )
+@click.option(
+    '-a',
+    '--algo-file',
+    default=None,
+    type=click.Path(file_okay=True, writable=True),
+    help='Algo script file or module path.',
+    )
+@click.option(
+    '-p',
+    '--param',
+    multiple=True,
+    type=click.STRING,
+    help='Algo parameter values to sweep, as name=v1,v2,... The name'\
+            ' must be a module level variable in the algo. Repeat for'\
+            ' multiple parameters.',
+    )
+@click.option(
+    '-d',
+    '--dates',
+    multiple=True,
+    type=click.STRING,
+    help='Backtest date range to sweep, as start:end. Repeat for'\
+            ' multiple ranges. The start and end date options add one'\
+            ' more range.',
+    )
+@click.option(
+    '-n',
+    '--processes',
+    default=None,
+    type=click.INT,
+    help='Number of worker processes. Defaults to the cpu count.',
+    )
+@click.option(
+    '--broker',
+    default=None,
+    type=click.STRING,
+    help='Choose the broker to run this strategy.',
+    )
+@click.option(
+    '--name',
+    default=None,
+    help='Name prefix of the runs',
+    )
+@click.option(
+    '--output',
+    default=None,
+    type=click.Path(file_okay=True, writable=True),
+    help='Output file to write the stacked performance to',
+    )
+@click.option(
+    '--show-progress/--no-progress',
+    default=False,
+    help='Turn on/ off the progress bar. [show-progress/no-progress')
+@click.option(
+    '--sparse/--no-sparse',
+    default=False,
+    help='Skip bars with no scheduled or order events in backtest.'\
+            ' [sparse/no-sparse]')
+@click.argument('arglist', nargs=-1, type=click.STRING)
+@click.pass_context
+def sweep(ctx, start_date, end_date, initial_capital, algo_file, param, 
+          dates, processes, broker, name, output, show_progress, sparse, 
+          arglist):
+    '''
+        Run backtests of an algo for all combinations of the supplied
+        parameter values and date ranges, in parallel.
+    '''
+    try:
+        args, kwargs = list_to_args_kwargs(arglist)
+        
+        configfile = os_path.expanduser(ctx.obj['config'])
+        grid = parse_param_grid(param)
+        ranges = parse_date_ranges(dates)
+        if start_date is not None or end_date is not None or not ranges:
+            ranges = [(start_date, end_date)] + ranges
+        jobs = make_jobs(algo_file, grid, ranges, name)
+        
+        results = run_sweep(
+                jobs, processes, output, show_progress, 
+                config_file=configfile, initial_capital=initial_capital,
+                broker=broker, sparse=sparse, **kwargs)
+        
+        for job_name, error in results.errors.items():
+            click.secho(f"{job_name}: {error}", fg="red")
+        click.echo(results.summary().to_string())
     except BlueShiftException as e:
         click.secho(str(e), fg="red")
         sys_exit(1)
@@ -17,6 +17,7 @@ Created on Mon Oct  8 11:49:54 2018
 @author: prodipta
 """
 from os import path as os_path
+import numpy as np
 import pandas as pd
 from functools import partial
 import asyncio
@@ -179,6 +180,13 @@ class TradingAlgorithm(AlgoStateMachine):
         code = compile(self.algo, algo_file, 'exec')
         exec(code, self.namespace)
         
+        # override module level parameters of the algo, if supplied.
+        params = kwargs.get("params", None) or {}
+        for k in params:
+            if k not in self.namespace:
+                raise InitializationError(msg=f"unknown algo parameter {k}.")
+            self.namespace[k] = params[k]
+        
         # bind the API methods to this instance. This is one time
         # binding, rather than fetching the instance at every call
         for k in self.namespace:
@@ -201,6 +209,13 @@ class TradingAlgorithm(AlgoStateMachine):
         self._loop = None
         self._queue = None
         
+        # in backtest, walk the materialized clock arrays and create 
+        # timestamps for trading bars only on demand
+        self._array_clock = kwargs.get("array_clock", True)
+        # in sparse backtest mode, skip trading bars where nothing can
+        # happen. Only effective if the algo has no `handle_data`.
+        self._sparse = kwargs.get("sparse", False)
+        
         # create the bars dispatch dictionaries
         self._USER_FUNC_DISPATCH = {}
         self._BROKER_FUNC_DISPATCH = {}
@@ -220,7 +235,8 @@ class TradingAlgorithm(AlgoStateMachine):
         self._blotter = Blotter(
                 self.mode, self.context.asset_finder,
                 self.context.data_portal, self.context.broker,
-                self._logger)
+                self._logger, 
+                blotter_root=kwargs.get("blotter_root", None))
 
     def __str__(self):
         return "Blueshift Algorithm [name:%s, broker:%s]" % (self.name,
@@ -286,7 +302,7 @@ class TradingAlgorithm(AlgoStateMachine):
         # run scheduled tasks first
         self._scheduler.trigger_events(self.context, 
                                        self.context.data_portal, 
-                                       timestamp.value)
+                                       self.context.nano)
         
         # followed by user defined handle_data
         self._handle_data(self.context, self.context.data_portal)
@@ -347,15 +363,37 @@ class TradingAlgorithm(AlgoStateMachine):
             
         self._make_broker_dispatch() # only useful for backtest
         
-        for t, bar in self.context.clock:
+        sparse = self._sparse
+        if sparse and self._handle_data is not noop:
+            self.log_warning("sparse mode is not possible with "
+                             "handle_data, will run all bars.")
+            sparse = False
+        
+        array_clock = self._array_clock or sparse
+        if sparse:
+            nanos, bars = self.context.clock.to_arrays()
+            events = self._sparse_events(nanos, bars)
+        elif array_clock:
+            nanos, bars = self.context.clock.to_arrays()
+            events = zip(nanos.tolist(), bars.tolist())
+        else:
+            events = self.context.clock
+        
+        tz = self.context.trading_calendar.tz
+        for t, bar in events:
             try:
-                ts = pd.Timestamp(t,unit='ns',
-                                  tz=self.context.trading_calendar.tz)
-                
-                if bar == BARS.ALGO_START:
-                    self.context.set_up(timestamp=ts)
+                if array_clock and bar == BARS.TRADING_BAR:
+                    # the broker and the user functions get the nano
+                    # here, the context creates the timestamp if asked.
+                    ts = t
+                    self.context.set_nano(t)
+                else:
+                    ts = pd.Timestamp(t,unit='ns',tz=tz)
+                    if bar == BARS.ALGO_START:
+                        self.context.set_up(timestamp=ts)
+                    self.context.set_timestamp(ts)
                     
-                self.context.set_timestamp(ts)
+                self.context.data_portal.set_timestamp(t)
                 self._BROKER_FUNC_DISPATCH.get(bar,self._bar_noop)(ts)
                 
                 if bar == BARS.TRADING_BAR:
@@ -365,9 +403,7 @@ class TradingAlgorithm(AlgoStateMachine):
                 if bar == BARS.AFTER_TRADING_HOURS:
                     #self.context.BAR_update(ts)
                     self.context.EOD_update(ts)
-                    perf = self.context.performance
-                    perf['timestamp'] = str(self.context.timestamp)
-                    yield perf
+                    yield self.context.performance
                     
                 self._USER_FUNC_DISPATCH.get(bar,self._bar_noop)(ts)
         
@@ -381,12 +417,40 @@ class TradingAlgorithm(AlgoStateMachine):
                                                timestamp=timestamp)
                     continue
     
+    def _sparse_events(self, nanos, bars):
+        """
+            Walk the clock arrays, but jump over trading bars where 
+            nothing can happen, i.e. there are no open orders to fill
+            and no scheduled function is due. We land on the earlier of
+            the next scheduled trigger and the next session event. This
+            is evaluated only after the previous event is processed.
+        """
+        boundaries = np.flatnonzero(bars != BARS.TRADING_BAR)
+        n = len(nanos)
+        i = 0
+        
+        while i < n:
+            yield int(nanos[i]), int(bars[i])
+            i = i + 1
+            
+            if i >= n or bars[i] != BARS.TRADING_BAR:
+                continue
+            if self.context.broker.open_orders:
+                continue
+            
+            # the last event is always algo end, a boundary.
+            j = boundaries[np.searchsorted(boundaries, i)]
+            next_dt = self._scheduler.next_trigger
+            if next_dt is not None:
+                j = min(j, np.searchsorted(nanos, next_dt))
+            i = max(i, int(j))
+    
     def back_test_run(self, alert_manager=None, publish_packets=False,
                       show_progress=False):
         
         runner = self._back_test_generator(alert_manager=alert_manager)
         length = len(self.context.clock.session_nanos)
-        perfs = []
+        sessions = 0
         
         if not alert_manager:
             publish_packets = False
@@ -400,14 +464,16 @@ class TradingAlgorithm(AlgoStateMachine):
             MessageBrokerCtxManager(publisher_handle,
                                     enabled=publish_packets) as\
                                 publisher:
-            for packet in performance:
-                perfs.append(packet)
+            for perf in performance:
+                sessions = sessions + 1
                 if publish_packets:
+                    packet = perf.to_dict()
+                    packet['timestamp'] = str(self.context.timestamp)
                     publisher.send(json.dumps(packet))
-                    
-        idx = pd.to_datetime([p['timestamp'] for p in perfs])
-        perfs = pd.DataFrame(perfs, idx)
-        return perfs
+        
+        # the daily metrics, one row per session, straight from the 
+        # performance tracker arrays.
+        return self.context.past_performance(sessions)
     
     def _get_event_loop(self):
         """
@@ -463,12 +529,12 @@ class TradingAlgorithm(AlgoStateMachine):
                 
                 if bar == BARS.TRADING_BAR:    
                     self.context.BAR_update(ts)
-                    yield {'bar':self.context.pnls}
+                    yield {'bar':self.context.pnls.to_dict()}
                 
                 if bar == BARS.AFTER_TRADING_HOURS:
                     self.context.BAR_update(ts)
                     self.context.EOD_update(ts)
-                    yield {'daily':self.context.performance}
+                    yield {'daily':self.context.performance.to_dict()}
                     
                 if self.is_running():       # NOT PAUSED!!
                     self._USER_FUNC_DISPATCH.get(bar,self._bar_noop)(ts)
@@ -1206,6 +1272,32 @@ class TradingAlgorithm(AlgoStateMachine):
             assets = [assets]
         control = TCWhiteList(assets, on_fail)
         self.register_trading_controls(control)
+        
+    @api_method
+    def set_slippage(self, model):
+        """
+            Set the slippage model for backtest fills. This has no 
+            effect in live mode.
+            
+            Note:
+                See also :mod:`blueshift.execution.models`
+        """
+        if self.mode != MODE.BACKTEST:
+            return
+        self.context.broker.set_slippage(model)
+        
+    @api_method
+    def set_commission(self, model):
+        """
+            Set the commission model for backtest fills. This has no 
+            effect in live mode.
+            
+            Note:
+                See also :meth:`.set_slippage`
+        """
+        if self.mode != MODE.BACKTEST:
+            return
+        self.context.broker.set_commission(model)
     
     # TODO: cythonize the creation of order
     @api_method
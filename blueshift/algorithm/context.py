@@ -14,13 +14,13 @@
 """
 
 """
-import numpy as np
 import pandas as pd
 
 
 from blueshift.blotter._perf import (Performance, 
                                      BASE_METRICS, 
                                      DAILY_METRICS)
+from blueshift.blotter.recorder import Recorder
 from blueshift.utils.exceptions import (InitializationError,
                                         ValidationError,
                                         RecordVarError,
@@ -61,7 +61,12 @@ class AlgoContext(object):
         # this will be used to tag orders where supported
         self._name = kwargs.get("name",blueshift_run_get_name())
         self.__timestamp = None
-        self.__recored_vars = pd.DataFrame()
+        self.__nano = None
+        self.__recored_vars = Recorder()
+        # the current record session and its nano bounds
+        self.__record_session = None
+        self.__record_start = 0
+        self.__record_end = 0
         
         # get the broker object and mark initialize
         self.__broker_initialized = False
@@ -140,9 +145,7 @@ class AlgoContext(object):
     @property
     def performance(self):
         """ return the current performance object. See API documentation for details """
-        perf = self.__performance.get_last_perf()
-        return {DAILY_METRICS[index[0]]:value for index, value in 
-                np.ndenumerate(perf)}
+        return self.__performance.last_perf()
     
     @property
     def trading_calendar(self):
@@ -152,19 +155,34 @@ class AlgoContext(object):
     @property
     def pnls(self):
         """ return the current profit or loss numbers. See API documentation for details """
-        pnl = self.__performance.get_last_pnl()
-        return {BASE_METRICS[index[0]]:value for index, value in 
-                np.ndenumerate(pnl)}
+        return self.__performance.last_pnl()
         
     @property
     def timestamp(self):
         """ return the current timestamp. Use API `get_datetime` instead of
         directly using this attribute. """
+        if self.__timestamp is None and self.__nano is not None:
+            self.__timestamp = pd.Timestamp(self.__nano, 
+                                            tz=self.__calendar.tz)
         return self.__timestamp
     
+    @property
+    def nano(self):
+        """ the current timestamp as nanos since epoch. """
+        return self.__nano
+    
     def set_timestamp(self, timestamp):
         # no validation check for the sake of speed!
         self.__timestamp = timestamp
+        self.__nano = timestamp.value
+        
+    def set_nano(self, nano):
+        '''
+            Set the current time as nanos. The timestamp is created 
+            only if asked for.
+        '''
+        self.__nano = nano
+        self.__timestamp = None
     
     @property
     def asset_finder(self):
@@ -185,27 +203,25 @@ class AlgoContext(object):
     def recored_vars(self):
         """ the recorded var object. This stores the values recored using the 
         API function ``record``. """
-        return self.__recored_vars
+        return self.__recored_vars.to_frame()
     
-    def past_performance(self, lookback):
-        idx, values = self.__performance.get_past_perfs(lookback)
-        perf = pd.DataFrame(values,columns=DAILY_METRICS,
-                            index=idx)
-        
-        perf.index = pd.to_datetime(perf.index).\
+    def _metrics_frame(self, idx, values, columns):
+        '''
+            Wrap the performance arrays in a dataframe without copying.
+        '''
+        index = pd.DatetimeIndex(idx.view('datetime64[ns]')).\
                 tz_localize('Etc/UTC').\
                 tz_convert(self.__calendar.tz)
-        return perf
+        return pd.DataFrame(values, index=index, columns=columns,
+                            copy=False)
+    
+    def past_performance(self, lookback):
+        idx, values = self.__performance.get_past_perfs(lookback)
+        return self._metrics_frame(idx, values, DAILY_METRICS)
     
     def past_pnls(self, lookback):
         idx, values = self.__performance.get_past_pnls(lookback)
-        pnls = pd.DataFrame(values,columns=BASE_METRICS,
-                            index=idx)
-        
-        pnls.index = pd.to_datetime(pnls.index).\
-                tz_localize('Etc/UTC').\
-                tz_convert(self.__calendar.tz)
-        return pnls
+        return self._metrics_frame(idx, values, BASE_METRICS)
         
     def save(self, strpath):
         # TODO: finalize serialization
@@ -306,7 +322,7 @@ class AlgoContext(object):
                 raise InitializationError(msg="accounts still not "
                                           "initialized")
             
-            self.__performance = Performance(self.__account,
+            self.__performance = Performance(self._perf_account(),
                                              self.__timestamp.value)
             
         if not isinstance(self.__performance, Performance):
@@ -334,6 +350,7 @@ class AlgoContext(object):
             raise ValidationError(msg="timestamp must be of type"
                                   " Timestamp")
         self.__timestamp = timestamp
+        self.__nano = timestamp.value
 
         self._reset_performance(*args, **kwargs)
             
@@ -346,8 +363,9 @@ class AlgoContext(object):
         '''
         self.__account = self.__broker_api.account
         self.__portfolio = self.__broker_api.positions
-        self.__performance.update_perfs(self.__account,timestamp.value)
-        self.__performance.update_pnls(self.__account,timestamp.value)
+        account = self._perf_account()
+        self.__performance.update_perfs(account,timestamp.value)
+        self.__performance.update_pnls(account,timestamp.value)
         
     def BAR_update(self, timestamp):
         '''
@@ -355,7 +373,16 @@ class AlgoContext(object):
         '''
         self.__account = self.__broker_api.account
         self.__portfolio = self.__broker_api.positions
-        self.__performance.update_pnls(self.__account,timestamp.value)
+        self.__performance.update_pnls(self._perf_account(),
+                                       timestamp.value)
+        
+    def _perf_account(self):
+        # the typed account where the broker exposes one (backtester),
+        # else the dict form.
+        account = getattr(self.__broker_api, "typed_account", None)
+        if account is None:
+            return self.__account
+        return account
         
     def SOB_update(self, timestamp):
         '''
@@ -363,20 +390,35 @@ class AlgoContext(object):
         '''
         pass
     
+    def _set_record_session(self, nano):
+        '''
+            Records are keyed by the (local) date. Cache the bounds of
+            the date so that the timestamp is converted once a day.
+        '''
+        tz = self.__calendar.tz if self.__calendar else None
+        start = pd.Timestamp(nano, tz=tz).normalize()
+        end = start + pd.Timedelta(days=1)
+        self.__record_session = start.tz_localize(None).value
+        self.__record_start = start.value
+        self.__record_end = end.value
+    
     def record_var(self, varname, value):
         '''
             Record individual variables. If called before timestamp is 
             initialized, return silently.
         '''
-        dt = self.__timestamp
-        if not dt:
+        nano = self.__nano
+        if nano is None:
             return
         
+        if not self.__record_start <= nano < self.__record_end:
+            self._set_record_session(nano)
+        
         try:
             varname = str(varname)
             value = float(value)
-            self.__recored_vars.loc[pd.to_datetime(dt.date()),varname] =\
-                    value
+            self.__recored_vars.record(self.__record_session, varname,
+                                       value)
         except (TypeError, ValueError):
             msg = "recored variable names must be string-like "
             msg = msg + "and values float-like"
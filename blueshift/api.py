@@ -21,6 +21,16 @@ injected at run-time.
 """
 
 from blueshift.utils.scheduler import date_rules, time_rules
+from blueshift.execution.models import (NoSlippage, FixedSlippage,
+                                        VolumeShareSlippage, NoCommission,
+                                        PerShareCommission, 
+                                        PerDollarCommission)
 
 __all__ = [date_rules,
-           time_rules]
\ No newline at end of file
+           time_rules,
+           NoSlippage,
+           FixedSlippage,
+           VolumeShareSlippage,
+           NoCommission,
+           PerShareCommission,
+           PerDollarCommission]
\ No newline at end of file
@@ -19,6 +19,7 @@ Created on Mon Oct  8 09:28:57 2018
 
 cimport cython
 from blueshift.trades._trade cimport Trade
+from blueshift.trades._position cimport Position
 from cpython cimport bool
     
 cdef class Account:
@@ -32,6 +33,7 @@ cdef class Account:
     cdef readonly float net_exposure
     cdef readonly float cash
     cdef readonly float mtm
+    cdef readonly float holdings
     cdef readonly float liquid_value
     cdef readonly float commissions
     
@@ -40,10 +42,17 @@ cdef class Account:
     cpdef update_account(self, float cash, float margin, 
                          dict positions)
     cdef update_from_positions(self, dict positions)
+    cpdef mark_to_market(self, float net_exposure, float gross_exposure,
+                         float mtm, float holdings)
+    cdef tuple _contribution(self, Position position)
+    cdef _revalue(self)
     cpdef cashflow(self, float cash, float margin)
     
 cdef class BacktestAccount(Account):
+    cdef tuple _contribution(self, Position position)
     cpdef settle_trade(self, Trade t)
+    cpdef settle_trades(self, float cash_flow, float margin, 
+                        float commission)
     cpdef fund_transfer(self, float amount)
     cpdef block_margin(self, float amount)
     cpdef release_margin(self, float amount)
@@ -20,6 +20,7 @@ cimport cython
 from cpython cimport bool
 from blueshift.trades._trade cimport Trade
 from blueshift.trades._position cimport Position
+from blueshift.assets._assets cimport InstrumentType
 from blueshift.utils.exceptions import InsufficientFund
 
 cdef class Account:
@@ -35,6 +36,7 @@ cdef class Account:
                  float gross_exposure=0,    # existing exposure
                  float net_exposure=0,      # existing exposure
                  float mtm=0,               # unrealized position value
+                 float holdings=0,          # cash positions at cost
                  float commissions=0,       # cumulative commissions
                  object currency='local'):
         
@@ -44,10 +46,11 @@ cdef class Account:
         self.net_exposure = net_exposure
         self.margin = margin
         self.mtm = mtm
+        self.holdings = holdings
         self.currency = currency
         self.commissions = commissions
         
-        self.liquid_value = self.cash + self.margin
+        self.liquid_value = self.cash + self.margin + self.holdings
         self.net = self.mtm + self.liquid_value
         if self.liquid_value > 0:
             self.gross_leverage = round(self.gross_exposure/self.liquid_value,2)
@@ -67,6 +70,7 @@ cdef class Account:
                 'net_exposure':self.net_exposure,
                 'cash':self.cash,
                 'mtm':self.mtm,
+                'holdings':self.holdings,
                 'liquid_value':self.liquid_value,
                 'commissions':self.commissions}
         
@@ -100,7 +104,7 @@ cdef class Account:
         # run all updates in series
         self.cash = cash
         self.margin = margin
-        self.liquid_value = self.cash + self.margin
+        self.liquid_value = self.cash + self.margin + self.holdings
         
         self.update_from_positions(positions)
         
@@ -108,7 +112,7 @@ cdef class Account:
         # update cash and margins
         self.cash = self.cash + cash
         self.margin = self.margin + margin
-        self.liquid_value = self.cash + self.margin
+        self.liquid_value = self.cash + self.margin + self.holdings
         
         if self.liquid_value > 0:
             self.gross_leverage = self.gross_exposure/self.liquid_value
@@ -117,35 +121,74 @@ cdef class Account:
         self.net = self.mtm + self.liquid_value
     
     cdef update_from_positions(self, dict positions):
-        if not positions:
-            return
-        
-        net_exposure = 0
-        gross_exposure = 0
-        mtm = 0
-        for pos in positions:
-            position = positions[pos]
-            if position.if_closed():
-                continue
-            net_exposure = net_exposure + (position.buy_quantity - \
-                            position.sell_quantity)*position.last_price
-            gross_exposure = position.quantity*position.last_price +\
-                                gross_exposure
-            mtm = position.unrealized_pnl + mtm
+        '''
+            Full rescan of the positions.
+        '''
+        cdef float net_exposure = 0
+        cdef float gross_exposure = 0
+        cdef float mtm = 0
+        cdef float holdings = 0
         
-        if self.liquid_value > 0:
-            self.gross_leverage = gross_exposure/self.liquid_value
-            self.net_leverage = net_exposure/self.liquid_value
+        for asset in positions:
+            contribution = self._contribution(positions[asset])
+            if contribution is None:
+                continue
+            net_exposure = net_exposure + contribution[0]
+            gross_exposure = gross_exposure + contribution[1]
+            mtm = mtm + contribution[2]
+            holdings = holdings + contribution[3]
         
         self.gross_exposure = gross_exposure
         self.net_exposure = net_exposure
         self.mtm = mtm
+        self.holdings = holdings
+        self._revalue()
+        
+    cpdef mark_to_market(self, float net_exposure, float gross_exposure,
+                         float mtm, float holdings):
+        '''
+            Set the exposures, mtm and holdings from an external 
+            revaluation of the whole book.
+        '''
+        self.net_exposure = net_exposure
+        self.gross_exposure = gross_exposure
+        self.mtm = mtm
+        self.holdings = holdings
+        self._revalue()
+        
+    cdef tuple _contribution(self, Position position):
+        # net exposure, gross exposure, mtm and holdings of a position
+        if position.if_closed():
+            return None
+        return ((position.buy_quantity - position.sell_quantity)*\
+                    position.last_price,
+                position.quantity*position.last_price,
+                position.unrealized_pnl,
+                0)
+        
+    cdef _revalue(self):
+        self.liquid_value = self.cash + self.margin + self.holdings
+        if self.liquid_value > 0:
+            self.gross_leverage = self.gross_exposure/self.liquid_value
+            self.net_leverage = self.net_exposure/self.liquid_value
         self.net = self.mtm + self.liquid_value
-    
+        
 cdef class BacktestAccount(Account):
     '''
-        back-testing account.
+        back-testing account. Trades in cash instruments pay the full
+        traded value, and those positions are carried at cost in the 
+        holdings (part of the liquid value), with the mtm holding only 
+        the unrealized pnl.
     '''
+    cdef tuple _contribution(self, Position position):
+        contribution = Account._contribution(self, position)
+        if contribution is None or \
+                position.asset.instrument_type != InstrumentType.SPOT:
+            return contribution
+        
+        net_exposure, gross_exposure, mtm, _ = contribution
+        return (net_exposure, gross_exposure, mtm, net_exposure - mtm)
+    
     cpdef fund_transfer(self, float amount):
         if amount + self.cash < 0:
             raise InsufficientFund()
@@ -170,6 +213,25 @@ cdef class BacktestAccount(Account):
         self.liquid_value = self.liquid_value - t.commission
         self.commissions = self.commissions + t.commission
         
+    cpdef settle_trades(self, float cash_flow, float margin, 
+                        float commission):
+        '''
+            settle the net cash flow, margin and commissions of a batch
+            of trades in one go.
+        '''
+        if cash_flow + margin + commission > self.cash:
+            raise InsufficientFund()
+        
+        self.cash = self.cash - cash_flow - commission
+        if margin > 0:
+            self.block_margin(margin)
+        else:
+            self.release_margin(-margin)
+        
+        self.commissions = self.commissions + commission
+        self.liquid_value = self.cash + self.margin + self.holdings
+        self.net = self.mtm + self.liquid_value
+        
     cpdef release_margin(self, float amount):
         if self.margin < amount:
             amount = self.margin
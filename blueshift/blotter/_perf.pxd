@@ -19,20 +19,42 @@ Created on Mon Oct  8 09:28:57 2018
 
 cimport cython
 cimport numpy as np
+
+cdef class MetricsView:
+    cdef readonly tuple metrics
+    cdef readonly np.ndarray row
+    
+    cpdef to_dict(self)
+    
+cdef class MetricsBuffer:
+    cdef readonly tuple metrics
+    cdef readonly np.ndarray codes
+    cdef readonly np.ndarray index
+    cdef readonly np.ndarray values
+    cdef readonly np.int64_t size
+    cdef readonly np.int64_t maxlen
+    cdef np.int64_t head
+    
+    cdef _grow(self)
+    cdef np.int64_t _next_row(self, np.int64_t timestamp)
+    cpdef append(self, object account, np.int64_t timestamp)
+    cdef np.int64_t _end(self)
+    cpdef last(self)
+    cpdef last_view(self)
+    cpdef last_timestamp(self)
+    cpdef window(self, long count)
     
 cdef class Performance:
     cdef readonly np.int64_t last_updated      
     cdef readonly object currency         
-    cdef readonly np.ndarray pnls
-    cdef readonly np.ndarray perfs
-    cdef readonly np.ndarray index_pnls
-    cdef readonly np.ndarray index_perfs
-    cdef readonly np.int64_t pos_pnls
-    cdef readonly np.int64_t pos_perfs
+    cdef readonly MetricsBuffer pnls
+    cdef readonly MetricsBuffer perfs
     
-    cpdef update_perfs(self, dict account, np.int64_t timestamp)
-    cpdef update_pnls(self, dict account, np.int64_t timestamp)
+    cpdef update_perfs(self, object account, np.int64_t timestamp)
+    cpdef update_pnls(self, object account, np.int64_t timestamp)
     cpdef get_last_perf(self)
     cpdef get_last_pnl(self)
+    cpdef last_perf(self)
+    cpdef last_pnl(self)
     cpdef get_past_perfs(self, long count)
     cpdef get_past_pnls(self, long count)
\ No newline at end of file
@@ -20,7 +20,8 @@ Created on Mon Oct  8 09:28:57 2018
 cimport cython
 cimport numpy as np
 import numpy as np
-import blueshift.blotter._perf
+from collections.abc import Mapping
+from blueshift.blotter._accounts cimport Account
 
 cdef int CHUNK_SIZE = 4096
 BASE_METRICS = ['net','cash']
@@ -36,76 +37,259 @@ DAILY_METRICS = ['net',
                  'commissions'
                  ]
 
-cdef class Performance:
-    def __init__(self, dict account, np.int64_t timestamp):
-        self.last_updated = timestamp
-        self.currency = account["currency"]
+cdef class MetricsView:
+    '''
+        Read-only named view on a row of metrics. This is a mapping
+        from metric names to values, the values are not copied. Note 
+        in case of a bounded (ring) buffer, the row is eventually 
+        overwritten.
+    '''
+    def __init__(self, tuple metrics, np.ndarray row):
+        self.metrics = metrics
+        self.row = row
         
-        self.pnls = np.zeros((CHUNK_SIZE, len(BASE_METRICS)))
-        self.perfs = np.zeros((CHUNK_SIZE, len(DAILY_METRICS)))
-        self.index_pnls = np.zeros(CHUNK_SIZE)
-        self.index_perfs = np.zeros(CHUNK_SIZE)
-        self.pos_pnls = 0
-        self.pos_perfs = 0
+    def __getitem__(self, key):
+        try:
+            return self.row[self.metrics.index(key)]
+        except ValueError:
+            raise KeyError(key)
+            
+    def __getattr__(self, name):
+        try:
+            return self.row[self.metrics.index(name)]
+        except ValueError:
+            raise AttributeError(name)
+    
+    def __contains__(self, key):
+        return key in self.metrics
+    
+    def __iter__(self):
+        return iter(self.metrics)
+    
+    def __len__(self):
+        return len(self.metrics)
+    
+    def keys(self):
+        return self.metrics
+    
+    def values(self):
+        return self.row
+    
+    def items(self):
+        return zip(self.metrics, self.row.tolist())
+    
+    def get(self, key, default=None):
+        if key in self.metrics:
+            return self[key]
+        return default
+    
+    cpdef to_dict(self):
+        return dict(zip(self.metrics, self.row.tolist()))
+    
+    def __str__(self):
+        return 'Metrics[%s]' % ', '.join(
+                '%s:%f' % (k, v) for k, v in self.items())
+    
+    def __repr__(self):
+        return self.__str__()
         
-        self.pnls[self.pos_pnls,] = [account.get(k,0) for k in BASE_METRICS]
-        self.perfs[self.pos_perfs,] = [account.get(k,0) for k in DAILY_METRICS]
-        self.index_pnls[self.pos_pnls] = timestamp
-        self.index_perfs[self.pos_perfs] = timestamp
+Mapping.register(MetricsView)
+    
+cdef class MetricsBuffer:
+    '''
+        Preallocated storage for a time series of metrics, with int64
+        (nano) timestamps. If `maxlen` is 0, the capacity doubles when
+        full. Else this is a ring buffer keeping the last `maxlen` rows.
+        Every row of the ring is written twice (at i and i+maxlen) so
+        that the latest rows are always a contiguous slice and can be
+        returned as views without copying.
+    '''
+    def __init__(self, tuple metrics, np.int64_t capacity=CHUNK_SIZE,
+                 np.int64_t maxlen=0):
+        self.metrics = metrics
+        self.codes = np.array([_metric_code(m) for m in metrics], 
+                              dtype=np.int32)
+        self.maxlen = maxlen
+        self.size = 0
+        self.head = 0
         
-        self.pos_pnls = self.pos_pnls + 1
-        self.pos_perfs = self.pos_perfs + 1
-                   
-    
-    cpdef update_perfs(self, dict account, np.int64_t timestamp):
-        if self.pos_perfs >= len(self.index_perfs):
-            # resize the array
-            perfs = np.zeros((CHUNK_SIZE, len(DAILY_METRICS)))
-            index_perfs = np.zeros(CHUNK_SIZE)
-            self.perfs = np.concatenate((self.perfs,perfs))
-            self.index_perfs = np.concatenate((self.index_perfs,index_perfs))
+        if maxlen > 0:
+            capacity = 2*maxlen
+        elif capacity < 1:
+            capacity = CHUNK_SIZE
+            
+        self.index = np.zeros(capacity, dtype=np.int64)
+        self.values = np.zeros((capacity, len(metrics)), dtype=np.float64)
         
-        self.perfs[self.pos_perfs,] = [account.get(k,0) for k in DAILY_METRICS]
-        self.index_perfs[self.pos_perfs] = timestamp
-        self.pos_perfs = self.pos_perfs + 1
-    
-    cpdef update_pnls(self, dict account, np.int64_t timestamp):
-        if self.pos_pnls >= len(self.index_pnls):
-            # resize the array
-            pnls = np.zeros((CHUNK_SIZE, len(BASE_METRICS)))
-            index_pnls = np.zeros(CHUNK_SIZE)
-            self.pnls = np.concatenate((self.pnls,pnls))
-            self.index_pnls = np.concatenate((self.index_pnls,index_pnls))
+    cdef _grow(self):
+        cdef np.int64_t capacity = 2*len(self.index)
+        index = np.zeros(capacity, dtype=np.int64)
+        values = np.zeros((capacity, len(self.metrics)), dtype=np.float64)
+        index[:self.size] = self.index[:self.size]
+        values[:self.size] = self.values[:self.size]
+        self.index = index
+        self.values = values
         
-        self.pnls[self.pos_pnls,] = [account.get(k,0) for k in BASE_METRICS]
-        self.index_pnls[self.pos_pnls] = timestamp
-        self.pos_pnls = self.pos_pnls + 1
+    cdef np.int64_t _next_row(self, np.int64_t timestamp):
+        cdef np.int64_t row = self.head
+        
+        if self.maxlen > 0:
+            self.index[row] = timestamp
+            self.index[row + self.maxlen] = timestamp
+            self.head = (row + 1) % self.maxlen
+            if self.size < self.maxlen:
+                self.size = self.size + 1
+        else:
+            if row >= len(self.index):
+                self._grow()
+            self.index[row] = timestamp
+            self.head = row + 1
+            self.size = self.head
+            
+        return row
     
-    cpdef get_last_perf(self):
-        return self.perfs[(self.pos_perfs - 1),]
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cpdef append(self, object account, np.int64_t timestamp):
+        '''
+            Add a row from an account object (typed field reads, as 
+            fed by the backtester) or its dict form (as returned by 
+            the broker API).
+        '''
+        cdef np.int64_t row = self._next_row(timestamp)
+        cdef double[:,:] values = self.values
+        cdef int[:] codes = self.codes
+        cdef Py_ssize_t i
+        cdef Py_ssize_t n = len(self.metrics)
+        cdef Account acct
+        
+        if isinstance(account, Account):
+            acct = account
+            for i in range(n):
+                values[row, i] = _account_metric(acct, codes[i])
+        else:
+            for i in range(n):
+                values[row, i] = account.get(self.metrics[i],0)
+        
+        if self.maxlen > 0:
+            values[row + self.maxlen, :] = values[row, :]
+            
+    cdef np.int64_t _end(self):
+        if self.maxlen > 0 and self.size == self.maxlen:
+            return self.head + self.maxlen
+        return self.head
     
-    cpdef get_last_pnl(self):
-        return self.pnls[(self.pos_pnls - 1),]
+    cpdef last(self):
+        return self.values[self._end()-1,]
     
-    cpdef get_past_perfs(self, long count):
-        cdef long start_idx = 0
-        if count > self.pos_perfs:
-            count = self.pos_perfs
-        start_idx = self.pos_perfs - count
-        return self.index_perfs[start_idx:self.pos_perfs],self.perfs[start_idx:self.pos_perfs,]
+    cpdef last_view(self):
+        return MetricsView(self.metrics, self.values[self._end()-1,])
     
-    cpdef get_past_pnls(self, long count):
-        cdef long start_idx = 0
-        if count > self.pos_pnls:
-            count = self.pos_pnls
+    cpdef last_timestamp(self):
+        return self.index[self._end()-1]
+    
+    cpdef window(self, long count):
+        '''
+            The last `count` timestamps and rows, as views.
+        '''
+        cdef np.int64_t end = self._end()
+        if count > self.size:
+            count = self.size
+        if count < 0:
+            count = 0
+        return self.index[end-count:end], self.values[end-count:end,]
+    
+    def __len__(self):
+        return self.size
+    
+    
+cdef int _metric_code(object metric):
+    try:
+        return DAILY_METRICS.index(metric)
+    except ValueError:
+        return -1
+
+cdef double _account_metric(Account account, int code):
+    # typed read of the account fields, codes are positions in 
+    # DAILY_METRICS
+    if code == 0:
+        return account.net
+    elif code == 1:
+        return account.cash
+    elif code == 2:
+        return account.margin
+    elif code == 3:
+        return account.gross_leverage
+    elif code == 4:
+        return account.net_leverage
+    elif code == 5:
+        return account.gross_exposure
+    elif code == 6:
+        return account.net_exposure
+    elif code == 7:
+        return account.mtm
+    elif code == 8:
+        return account.liquid_value
+    elif code == 9:
+        return account.commissions
+    return 0
+
+cdef class Performance:
+    '''
+        Tracks the account metrics. The `perfs` are the daily metrics
+        (updated end of day) and `pnls` are the intraday (updated every
+        bar). The intraday history can be bounded by `maxlen` rows.
+    '''
+    def __init__(self, object account, np.int64_t timestamp, 
+                 np.int64_t capacity=CHUNK_SIZE, np.int64_t maxlen=0):
+        self.last_updated = timestamp
+        if isinstance(account, Account):
+            self.currency = account.currency
+        else:
+            self.currency = account["currency"]
+        
+        self.pnls = MetricsBuffer(tuple(BASE_METRICS), capacity, maxlen)
+        self.perfs = MetricsBuffer(tuple(DAILY_METRICS), capacity)
         
-        start_idx = self.pos_pnls - count
-        return self.index_pnls[start_idx:self.pos_pnls],self.pnls[start_idx:self.pos_pnls,]
+        self.pnls.append(account, timestamp)
+        self.perfs.append(account, timestamp)
     
+    @property
+    def pos_pnls(self):
+        return self.pnls.size
     
+    @property
+    def pos_perfs(self):
+        return self.perfs.size
     
+    cpdef update_perfs(self, object account, np.int64_t timestamp):
+        self.perfs.append(account, timestamp)
+        self.last_updated = timestamp
     
+    cpdef update_pnls(self, object account, np.int64_t timestamp):
+        self.pnls.append(account, timestamp)
+        self.last_updated = timestamp
     
+    cpdef get_last_perf(self):
+        return self.perfs.last()
+    
+    cpdef get_last_pnl(self):
+        return self.pnls.last()
     
+    cpdef last_perf(self):
+        '''
+            Named view of the latest daily metrics.
+        '''
+        return self.perfs.last_view()
     
-    
\ No newline at end of file
+    cpdef last_pnl(self):
+        '''
+            Named view of the latest intraday metrics.
+        '''
+        return self.pnls.last_view()
+    
+    cpdef get_past_perfs(self, long count):
+        return self.perfs.window(count)
+    
+    cpdef get_past_pnls(self, long count):
+        return self.pnls.window(count)
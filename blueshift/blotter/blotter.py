@@ -236,9 +236,13 @@ class Blotter(object):
     PERFORMANCE_FILE = 'performance.json'
     RISKS_FILE = 'risk_metrics.json'
     
-    def __init__(self, mode, asset_finder, data_portal, broker_api,
-                 logger=None, blotter_root=None, account_net=None, 
-                 starting_positions={}, timestamp=None, alert_manager=None):
+    def __init__(self, *args, **kwargs):
+        self._create(*args, **kwargs)
+        
+    def _create(self, mode, asset_finder, data_portal, broker_api,
+                logger=None, blotter_root=None, account_net=None, 
+                starting_positions=None, timestamp=None, 
+                alert_manager=None):
         # initialize the start positions and historical records of 
         # transactions. If a start position is suppplied, that will 
         # overwrite the saved positions.
@@ -258,7 +262,7 @@ class Blotter(object):
             alert_manager.register_callback(self.save)
         
     
-    def reset(self, timestamp, account_net=None, starting_positions={}):
+    def reset(self, timestamp, account_net=None, starting_positions=None):
         self._current_pos = {}
         self._unprocessed_orders = {}
         self._known_orders = set()
@@ -281,9 +285,9 @@ class Blotter(object):
     def _init_positions_transactions(self, positions):
         pos = self._read_positions_transactions()
         if positions:
-            positions = {**pos, **positions}
-        
-        self._current_pos = positions
+            self._current_pos = {**pos, **positions}
+        else:
+            self._current_pos = {}
             
     def _read_positions_transactions(self, timestamp=None):
         positions = {}
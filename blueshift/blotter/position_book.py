@@ -0,0 +1,186 @@
+# Copyright 2018 QuantInsti Quantitative Learnings Pvt Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Created on Thu Feb 14 16:05:22 2019
+
+@author: prodipta
+"""
+import numpy as np
+
+from blueshift.assets._assets import InstrumentType
+
+CHUNK_SIZE = 64
+
+class PositionBook(object):
+    '''
+        Array mirror of the position objects. Each asset gets a slot
+        (kept after the position is closed, to be reused if it opens
+        again) holding the quantities, average prices and last price,
+        and a flag for cash instruments (carried at cost), along with
+        its contribution to the account (see VALUES). The running totals
+        of the contributions are updated per traded position in O(1),
+        and recomputed when the whole book is revalued in one pass from
+        a price vector. The position objects are marked only when they
+        are asked for.
+    '''
+    VALUES = ['net_exposure','gross_exposure','mtm','holdings']
+    FIELDS = ['quantity','buy_quantity','buy_price','sell_quantity',
+              'sell_price','last_price','spot'] + VALUES
+
+    def __init__(self, capacity=CHUNK_SIZE):
+        self._capacity = max(int(capacity), 1)
+        self._slots = {}
+        self._assets = []
+        self._arrays = {field:np.zeros(self._capacity) for field in \
+                        self.FIELDS}
+        self._active = None
+        self._active_assets = []
+        self._marked = True
+        self._totals = np.zeros(len(self.VALUES))
+
+    def __len__(self):
+        return len(self._assets)
+
+    def __getattr__(self, name):
+        if name in self.FIELDS:
+            return self._arrays[name][:len(self._assets)]
+        raise AttributeError(name)
+
+    def _grow(self):
+        capacity = 2*self._capacity
+        for field in self.FIELDS:
+            values = np.zeros(capacity)
+            values[:self._capacity] = self._arrays[field]
+            self._arrays[field] = values
+        self._capacity = capacity
+
+    def _slot(self, asset):
+        slot = self._slots.get(asset, None)
+        if slot is None:
+            slot = len(self._assets)
+            if slot == self._capacity:
+                self._grow()
+            self._slots[asset] = slot
+            self._assets.append(asset)
+        return slot
+
+    def update(self, position):
+        '''
+            Copy the state of a (traded) position to its slot.
+        '''
+        slot = self._slot(position.asset)
+        arrays = self._arrays
+        was_open = arrays['quantity'][slot] != 0
+
+        arrays['quantity'][slot] = position.quantity
+        arrays['buy_quantity'][slot] = position.buy_quantity
+        arrays['buy_price'][slot] = position.buy_price
+        arrays['sell_quantity'][slot] = position.sell_quantity
+        arrays['sell_price'][slot] = position.sell_price
+        arrays['last_price'][slot] = position.last_price
+        arrays['spot'][slot] = position.asset.instrument_type == \
+                                    InstrumentType.SPOT
+
+        if was_open != (position.quantity != 0):
+            # the set of open positions changed
+            self._active = None
+
+        # swap the old contribution of the slot for the new one
+        contribution = self._contribution(position)
+        for i, field in enumerate(self.VALUES):
+            self._totals[i] += contribution[i] - arrays[field][slot]
+            arrays[field][slot] = contribution[i]
+
+    @staticmethod
+    def _contribution(position):
+        # in the order of VALUES
+        if position.if_closed():
+            return 0, 0, 0, 0
+        net_exposure = (position.buy_quantity - position.sell_quantity)*\
+                            position.last_price
+        mtm = position.unrealized_pnl
+        holdings = 0
+        if position.asset.instrument_type == InstrumentType.SPOT:
+            holdings = net_exposure - mtm
+        return (net_exposure, position.quantity*position.last_price, mtm,
+                holdings)
+
+    def totals(self):
+        '''
+            The net exposure, gross exposure, mtm and the holdings (the
+            cash instruments at cost) of the book, at the last known
+            prices.
+        '''
+        return tuple(float(value) for value in self._totals)
+
+    def _refresh_active(self):
+        if self._active is None:
+            self._active = np.flatnonzero(self.quantity != 0)
+            self._active_assets = [self._assets[i] for i in self._active]
+        return self._active, self._active_assets
+
+    def revalue(self, data_portal):
+        '''
+            Mark all open positions to the latest close from the data
+            portal. Missing prices keep the last known price. Returns
+            the net exposure, gross exposure, mtm and the holdings (the
+            cash instruments at cost) of the book.
+        '''
+        active, assets = self._refresh_active()
+        if len(active) == 0:
+            self._totals[:] = 0
+            return self.totals()
+
+        prices = data_portal.current(assets, 'close')
+        prices = np.asarray(prices, dtype=np.float64)
+        last = self._arrays['last_price']
+        prices = np.where(np.isnan(prices), last[active], prices)
+        last[active] = prices
+        self._marked = False
+
+        quantity = self._arrays['quantity'][active]
+        buy_qty = self._arrays['buy_quantity'][active]
+        sell_qty = self._arrays['sell_quantity'][active]
+        net_qty = buy_qty - sell_qty
+
+        unrealized = np.where(
+                buy_qty > sell_qty,
+                net_qty*(prices - self._arrays['buy_price'][active]),
+                -net_qty*(self._arrays['sell_price'][active] - prices))
+
+        spot = self._arrays['spot'][active]
+        values = {'net_exposure':net_qty*prices,
+                  'gross_exposure':quantity*prices,
+                  'mtm':unrealized,
+                  'holdings':spot*(net_qty*prices - unrealized)}
+        # the closed slots have no contribution, recompute the totals
+        for i, field in enumerate(self.VALUES):
+            self._arrays[field][active] = values[field]
+            self._totals[i] = values[field].sum()
+
+        return self.totals()
+
+    def mark_positions(self, positions, timestamp=None):
+        '''
+            Mark the position objects to the last revalued prices.
+        '''
+        if self._marked:
+            return
+
+        last = self._arrays['last_price']
+        for asset, position in positions.items():
+            slot = self._slots.get(asset, None)
+            if slot is not None:
+                position.mark_to_market(last[slot], timestamp)
+        self._marked = True
@@ -0,0 +1,108 @@
+# Copyright 2018 QuantInsti Quantitative Learnings Pvt Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Created on Wed Feb 13 11:42:10 2019
+
+@author: prodipta
+"""
+import numpy as np
+import pandas as pd
+
+CHUNK_SIZE = 256
+
+class Recorder(object):
+    '''
+        Append-only columnar store for recorded variables. Each variable
+        is a float64 array aligned to an int64 session index (nanos of
+        the session date). A row is added on the first record of a new
+        session and a later record of the same variable in a session
+        overwrites the earlier one. Storage grows by doubling and the
+        dataframe is built only when asked for.
+    '''
+    def __init__(self, capacity=CHUNK_SIZE):
+        self._capacity = max(int(capacity), 1)
+        self._index = np.zeros(self._capacity, dtype=np.int64)
+        self._columns = {}
+        self._size = 0
+        self._frame = None
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def names(self):
+        return list(self._columns.keys())
+
+    def _grow(self):
+        capacity = 2*self._capacity
+        index = np.zeros(capacity, dtype=np.int64)
+        index[:self._size] = self._index[:self._size]
+        self._index = index
+
+        for name in self._columns:
+            column = np.full(capacity, np.nan)
+            column[:self._size] = self._columns[name][:self._size]
+            self._columns[name] = column
+
+        self._capacity = capacity
+
+    def _row(self, session):
+        size = self._size
+        if size > 0:
+            last = self._index[size-1]
+            if session == last:
+                return size-1
+            if session < last:
+                # out of order record, look for the session
+                pos = np.searchsorted(self._index[:size], session)
+                if pos < size and self._index[pos] == session:
+                    return pos
+
+        if size == self._capacity:
+            self._grow()
+        self._index[size] = session
+        self._size = size + 1
+        return size
+
+    def record(self, session, name, value):
+        '''
+            Record a value (float) for a variable at a session (nanos).
+        '''
+        row = self._row(session)
+
+        column = self._columns.get(name, None)
+        if column is None:
+            column = np.full(self._capacity, np.nan)
+            self._columns[name] = column
+
+        column[row] = value
+        self._frame = None
+
+    def to_frame(self):
+        '''
+            The recorded variables as a dataframe indexed by sessions.
+        '''
+        if self._frame is not None:
+            return self._frame
+
+        size = self._size
+        index = pd.to_datetime(self._index[:size])
+        data = {name:column[:size] for name, column in
+                self._columns.items()}
+        frame = pd.DataFrame(data, index=index, columns=self.names)
+        if not index.is_monotonic_increasing:
+            frame = frame.sort_index()
+
+        self._frame = frame
+        return frame
@@ -48,14 +48,23 @@ def make_broker_pack(*args, **kwargs):
     clock = SimulationClock(trading_calendar,frequency,start_date,
                             end_date)
     
-    asset_db_config = AssetDBConfiguration()
-    asset_db_query_engine = AssetDBQueryEngineCSV(asset_db_config)
-    asset_finder = DBAssetFinder(asset_db_query_engine)
+    # an existing asset finder and data portal can be shared
+    asset_finder = kwargs.pop("asset_finder", None)
+    if asset_finder is None:
+        asset_db_config = AssetDBConfiguration()
+        asset_db_query_engine = AssetDBQueryEngineCSV(asset_db_config)
+        asset_finder = DBAssetFinder(asset_db_query_engine)
     
-    data_portal = DBDataPortal(*args, **kwargs)
+    data_portal = kwargs.pop("data_portal", None)
+    if data_portal is None:
+        data_portal = DBDataPortal(*args, asset_finder=asset_finder, 
+                                   **kwargs)
     
     broker = BackTesterAPI('blueshift',BrokerType.BACKTESTER, 
-                           trading_calendar, initial_capital)  
+                           trading_calendar, initial_capital,
+                           data_portal=data_portal,
+                           execution_model=kwargs.get("execution_model",
+                                                      None))
     
     return auth, asset_finder, data_portal, broker, clock
 
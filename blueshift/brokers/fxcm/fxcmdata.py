@@ -24,6 +24,7 @@ from requests.exceptions import RequestException
 from fxcmpy.fxcmpy import ServerError
 
 from blueshift.data.rest_data import RESTDataPortal
+from blueshift.data.bar_cache import BarCache
 from blueshift.utils.types import OHLCV_FIELDS
 from blueshift.utils.exceptions import (AuthenticationError, 
                                         ExceptionHandling,
@@ -36,6 +37,10 @@ from blueshift.utils.decorators import api_rate_limit, singleton, blueprint
 from blueshift.brokers.fxcm.fxcmassets import FXCMAssetFinder
 
 LRU_CACHE_SIZE = 512
+# max candles in a single request.
+MAX_CANDLES = 10000
+# price scaling for the bar cache (five decimals).
+CACHE_PRICE_SCALE = 100000
 
 
 @singleton
@@ -81,6 +86,14 @@ class FXCMRestData(RESTDataPortal):
         self._minute_per_day = int((self._trading_calendar._close_nano - 
                                     self._trading_calendar._open_nano)/(60*1E9))
         
+        # past bars can be served from an on-disk cache (opt-in). Pass
+        # True for the default location, or a BarCache instance.
+        self._cache = kwargs.pop("history_cache", False)
+        if self._cache is True:
+            self._cache = BarCache(name='fxcm', scale=CACHE_PRICE_SCALE)
+        elif not self._cache:
+            self._cache = None
+        
     def current(self, assets, fields):
         '''
             Fetch the current bar for the given assets and fields.
@@ -139,14 +152,14 @@ class FXCMRestData(RESTDataPortal):
             
         # cap the max period length
         nbar = int(nbar)
-        if nbar > 10000:
-            nbar = 10000
+        if nbar > MAX_CANDLES:
+            nbar = MAX_CANDLES
         
         data = {}
         try:
             for asset in assets:
-                df = self._get_candles(asset, fields, nbar=nbar, 
-                                       period=period)
+                df = self._cached_candles(asset, fields, nbar, frequency,
+                                          period)
                 if len(assets) == 1: 
                     return df             
                 data[asset] = df
@@ -161,9 +174,37 @@ class FXCMRestData(RESTDataPortal):
             handling = ExceptionHandling.WARN
             raise BrokerAPIError(msg=msg, handling=handling)
     
+    def _cached_candles(self, asset, fields, nbar, frequency, period):
+        '''
+            Historical candles served from the cache, topped up with
+            the candles since the last cached one.
+        '''
+        if self._cache is None:
+            return self._get_candles(asset, fields, nbar=nbar, 
+                                     period=period)
+        
+        def fetch(start):
+            if start is None:
+                return self._get_candles(asset, OHLCV_FIELDS, nbar=nbar,
+                                         period=period)
+            return self._get_candles(asset, OHLCV_FIELDS, 
+                                     nbar=MAX_CANDLES, period=period, 
+                                     start=start)
+        
+        df = self._cache.history(asset.symbol, frequency, nbar, fetch)
+        valid_fields = [f for f in fields if f in OHLCV_FIELDS]
+        return df.loc[:, valid_fields]
+    
     @api_rate_limit
-    def _get_candles(self, asset, fields, nbar=1, period='m1'):
-        df = self._api.get_candles(asset.symbol, period=period, number=nbar)
+    def _get_candles(self, asset, fields, nbar=1, period='m1', start=None):
+        if start is None:
+            df = self._api.get_candles(asset.symbol, period=period, 
+                                       number=nbar)
+        else:
+            # candle timestamps are naive UTC
+            end = pd.Timestamp.now(tz='UTC').tz_localize(None)
+            df = self._api.get_candles(asset.symbol, period=period, 
+                                       number=nbar, start=start, end=end)
         return self._compute_ohlc(df, fields)
     
     @classmethod        
@@ -20,6 +20,7 @@ Created on Mon Oct 29 16:36:06 2018
 from .kiteauth import KiteAuth
 from .kiteassets import KiteAssetFinder
 from .kitedata import KiteRestData
+from .kitestream import KiteStreamingData
 from .kitebroker import KiteBroker
 from blueshift.utils.types import Broker
 from blueshift.execution.clock import RealtimeClock
@@ -30,7 +31,14 @@ def make_broker_pack(*args, **kwargs):
     auth = KiteAuth(name = name, *args, **kwargs)
     auth.login(*args, **kwargs)
     asset_finder = KiteAssetFinder(auth=auth, *args, **kwargs)
+    streaming = kwargs.pop("streaming", False)
     data_portal = KiteRestData(name=name, auth=auth, *args, **kwargs)
+    if streaming:
+        # live prices from the ticker, REST only for long history
+        data_portal = KiteStreamingData(name=name, auth=auth, 
+                                        asset_finder=asset_finder,
+                                        rest_data=data_portal, 
+                                        *args, **kwargs)
     broker = KiteBroker(name=name, auth = auth, asset_finder=asset_finder)
     clock = RealtimeClock(auth._trading_calendar,frequency)
     
@@ -47,6 +55,7 @@ def Zerodha(*args, **kwargs):
 __all__ = [KiteAuth,
            KiteAssetFinder,
            KiteRestData,
+           KiteStreamingData,
            KiteBroker,
            Zerodha,
            RealtimeClock]
\ No newline at end of file
@@ -18,7 +18,12 @@ Created on Mon Oct 29 16:27:26 2018
 """
 
 import pandas as pd
-from functools import lru_cache
+from time import time_ns
+from os import path as os_path
+from os import replace as os_replace
+from os import remove as os_remove
+from glob import glob
+from pickle import PicklingError, UnpicklingError
 from requests.exceptions import RequestException
 
 from kiteconnect.exceptions import KiteException
@@ -29,16 +34,54 @@ from blueshift.utils.exceptions import (AuthenticationError,
                                         ExceptionHandling,
                                         APIException,
                                         SymbolNotFound,
-                                        ValidationError)
+                                        ValidationError,
+                                        BlueShiftPathException)
 
 from blueshift.utils.decorators import singleton, api_retry, blueprint
+from blueshift.alerts import get_logger
+from blueshift.configs.defaults import blueshift_saved_objs_path
 from blueshift.assets import BrokerAssetFinder
 
 # pylint: disable=no-name-in-module
 from blueshift.assets._assets import (Equity, EquityFutures, Forex,
                                       EquityOption, OptionType)
 
-LRU_CACHE_SIZE = 512
+SNAPSHOT_PREFIX = 'kite_instruments_'
+
+class KiteInstrumentsIndex(object):
+    '''
+        Hash indexes on a (processed) instruments list - trading
+        symbol, instrument token and (underlying, expiry month, 
+        instrument type) to the row (as dict). On duplicates, the 
+        first row wins, same as a search on the list.
+    '''
+    def __init__(self, instruments_list):
+        rows = instruments_list.to_dict('records')
+        self._rows = rows
+        
+        # build in reverse so that the first occurrence is kept
+        self._symbols = {}
+        self._tokens = {}
+        self._futures = {}
+        for row in reversed(rows):
+            self._symbols[row['tradingsymbol']] = row
+            self._tokens[row['instrument_token']] = row
+            if 'underlying' in row and 'exp' in row:
+                key = (row['underlying'], row['exp'], 
+                       row['instrument_type'])
+                self._futures[key] = row
+    
+    def __len__(self):
+        return len(self._rows)
+    
+    def by_symbol(self, tradingsymbol):
+        return self._symbols.get(tradingsymbol, None)
+    
+    def by_token(self, instrument_token):
+        return self._tokens.get(instrument_token, None)
+    
+    def by_expiry(self, underlying, exp, instrument_type='FUT'):
+        return self._futures.get((underlying, exp, instrument_type), None)
 
 @singleton
 @blueprint
@@ -87,6 +130,13 @@ class KiteAssetFinder(BrokerAssetFinder):
         self.expiries = None
         self.cds_expiries = None
         
+        # lookup indexes and the assets already created, valid till
+        # the instruments list is valid.
+        self._index = None
+        self._valid_till_nano = 0
+        self._symbol_cache = {}
+        self._id_cache = {}
+        
         instruments_list = kwargs.get("instruments_list",None)
         self.update_instruments_list(instruments_list)
     
@@ -126,12 +176,17 @@ class KiteAssetFinder(BrokerAssetFinder):
             else:
                 t = pd.Timestamp.now(tz=self.tz) + pd.Timedelta(days=1)
                 self._instruments_list_valid_till = t.normalize()
+            self._build_index()
         
         if self._instruments_list is not None:
             t = pd.Timestamp.now(tz=self.tz)
             if t < self._instruments_list_valid_till:
                 return
         
+        if self._read_snapshot():
+            self._build_index()
+            return
+        
         try:
             self._instruments_list = pd.DataFrame(self._api.\
                                             instruments())
@@ -139,6 +194,8 @@ class KiteAssetFinder(BrokerAssetFinder):
             self._extract_expiries_underlyings()
             t = pd.Timestamp.now(tz=self.tz) + pd.Timedelta(days=1)
             self._instruments_list_valid_till = t.normalize()
+            self._build_index()
+            self._write_snapshot()
         except KiteException as e:
             msg = str(e)
             handling = ExceptionHandling.TERMINATE
@@ -148,7 +205,92 @@ class KiteAssetFinder(BrokerAssetFinder):
             handling = ExceptionHandling.TERMINATE
             raise APIException(msg=msg, handling=handling)
         
+    def _snapshot_file(self, date=None):
+        '''
+            The day's snapshot of the processed instruments list.
+        '''
+        if date is None:
+            date = pd.Timestamp.now(tz=self.tz)
+        fname = SNAPSHOT_PREFIX + date.strftime('%Y%m%d') + '.pkl'
+        return os_path.join(blueshift_saved_objs_path(), fname)
+        
+    def _read_snapshot(self):
+        '''
+            Load the processed instruments list of the day, if saved
+            by an earlier run. Returns False if none is available.
+        '''
+        try:
+            fname = self._snapshot_file()
+            if not os_path.exists(fname):
+                return False
+            snapshot = pd.read_pickle(fname)
+            valid_till = snapshot['valid_till']
+            if pd.Timestamp.now(tz=self.tz) >= valid_till:
+                return False
+        except (OSError, EOFError, KeyError, ValueError,
+                UnpicklingError, BlueShiftPathException) as e:
+            # a bad snapshot is no worse than no snapshot
+            self._log_snapshot_error("read", e)
+            return False
+        
+        self._instruments_list = snapshot['instruments_list']
+        self.expiries = snapshot['expiries']
+        self.cds_expiries = snapshot['cds_expiries']
+        self._instruments_list_valid_till = valid_till
+        return True
+        
+    def _write_snapshot(self):
+        '''
+            Save the processed instruments list of the day and remove
+            the older snapshots. Failure to save is not an error.
+        '''
+        snapshot = {'instruments_list':self._instruments_list,
+                    'expiries':self.expiries,
+                    'cds_expiries':self.cds_expiries,
+                    'valid_till':self._instruments_list_valid_till}
+        try:
+            fname = self._snapshot_file()
+            tmp_fname = fname + '.tmp'
+            pd.to_pickle(snapshot, tmp_fname)
+            os_replace(tmp_fname, fname)
+            
+            pattern = os_path.join(os_path.dirname(fname),
+                                   SNAPSHOT_PREFIX + '*.pkl')
+            for old_fname in glob(pattern):
+                if old_fname != fname:
+                    os_remove(old_fname)
+        except (OSError, PicklingError, BlueShiftPathException) as e:
+            self._log_snapshot_error("write", e)
+        
+    def _log_snapshot_error(self, action, e):
+        logger = get_logger()
+        if logger:
+            msg = f"failed to {action} instruments snapshot:{str(e)}"
+            logger.warning(msg, "assets")
+        
+    def _build_index(self):
+        '''
+            Rebuild the lookup indexes from the current list and drop
+            the cached assets. The new index is swapped in with a 
+            single assignment, so a lookup never sees a partial one.
+        '''
+        index = KiteInstrumentsIndex(self._instruments_list)
+        valid_till = pd.Timestamp(self._instruments_list_valid_till)
+        if valid_till.tz is None:
+            valid_till = valid_till.tz_localize(self.tz)
         
+        self._symbol_cache = {}
+        self._id_cache = {}
+        self._index = index
+        self._valid_till_nano = valid_till.value
+        
+    def _ensure_valid(self):
+        '''
+            Refresh the instruments list (and the indexes) once it
+            expires.
+        '''
+        if self._index is None or time_ns() >= self._valid_till_nano:
+            self.update_instruments_list()
         
     def _filter_instruments_list(self):
         '''
@@ -157,115 +299,81 @@ class KiteAssetFinder(BrokerAssetFinder):
             indices which are not tradeable. We also drop expiries 
             more than next three monthly ones.
         '''
-        self._instruments_list.dropna(inplace=True)
+        instruments = self._instruments_list.dropna()
+        symbols = instruments.tradingsymbol.astype(str)
+        segments = instruments.segment
+        exchanges = instruments.exchange
+        
         # drop exchanges we do not want
-        self._instruments_list = self._instruments_list.loc[
-            self._instruments_list.exchange.isin(self.__class__.EXCHANGES)]
+        keep = exchanges.isin(self.__class__.EXCHANGES)
         
         # drop the indices, these are not tradeable. We also remove
         # VIX, NIFTYIT and NIFTYMID futures and currency options.
-        self._instruments_list = self._instruments_list[
-                self._instruments_list.segment != "NSE-INDICES"]
-        self._instruments_list = self._instruments_list[
-                self._instruments_list.segment != "INDICES"]
-        self._instruments_list = self._instruments_list[
-                self._instruments_list.tradingsymbol.str.\
-                    contains('INDIAVIX')==False]
-        self._instruments_list = self._instruments_list[
-                self._instruments_list.tradingsymbol.str.\
-                    contains('NIFTYIT')==False]
-        self._instruments_list = self._instruments_list[
-                self._instruments_list.tradingsymbol.str.\
-                    contains('NIFTYMID50')==False]
-        self._instruments_list = self._instruments_list[
-                self._instruments_list.segment != "CDS-OPT"]
-        
-        # drop esoteric market segments tickers
-        def flag(s):
-            splits = s.split("-")
-            if len(splits[-1])==2 and splits[-1] != splits[0]:
-                return False
-            return True
-        keep = [flag(s) for s in self._instruments_list.tradingsymbol]
-        self._instruments_list = self._instruments_list[keep]
-        
-        # drop non NIFTY/ BANK
-        def single_stock_options(s,t):
-            if t == 'NFO-OPT':
-                if 'NIFTY' in s:
-                    return True
-                return False
-            return True
-        keep = [single_stock_options(r['tradingsymbol'],r['segment']) \
-                for i, r in self._instruments_list.iterrows()]
-        self._instruments_list = self._instruments_list[keep]
+        keep &= ~segments.isin(["NSE-INDICES", "INDICES", "CDS-OPT"])
+        keep &= ~symbols.str.contains('INDIAVIX|NIFTYIT|NIFTYMID50')
+        
+        # drop esoteric market segments tickers, with a two letter
+        # suffix (e.g. -BE) different from the symbol
+        first = symbols.str.split("-", n=1).str[0]
+        last = symbols.str.rsplit("-", n=1).str[-1]
+        keep &= ~((last.str.len()==2) & (last != first))
+        
+        # drop non NIFTY/ BANK options
+        keep &= ~((segments == 'NFO-OPT') & \
+                  ~symbols.str.contains('NIFTY', regex=False))
         
         # remove bond futures
-        def bond_futures(s, t):
-            if t == 'CDS' and s[0].isdigit():
-                return False
-            return True
-        keep = [bond_futures(r['tradingsymbol'],r['exchange']) \
-                for i, r in self._instruments_list.iterrows()]
-        self._instruments_list = self._instruments_list[keep]
+        keep &= ~((exchanges == 'CDS') & symbols.str[:1].str.isdigit())
+        
+        instruments = instruments[keep].copy()
         
         # keep the first three monthly expiries, remove all else
         today = pd.Timestamp.now().normalize()
-        self._instruments_list.dropna(inplace=True)
-        self._instruments_list['expiry'] = pd.to_datetime(
-                self._instruments_list.expiry)
-        self._instruments_list.loc[pd.isnull(
-                self._instruments_list.expiry),"expiry"] \
-                    = today
-        
-        self.expiries = set(self._instruments_list.expiry[
-                (self._instruments_list['exchange']=="NFO") &\
-                (self._instruments_list["instrument_type"]=="FUT")])
+        instruments['expiry'] = pd.to_datetime(instruments.expiry, 
+                                               errors='coerce')
+        instruments['expiry'] = instruments.expiry.fillna(today)
         
-        self.cds_expiries = set(self._instruments_list.expiry[
-                (self._instruments_list['exchange']=="CDS") &\
-                (self._instruments_list["instrument_type"]=="FUT")])
+        futures = instruments["instrument_type"]=="FUT"
+        self.expiries = sorted(set(instruments.expiry[
+                (instruments['exchange']=="NFO") & futures]))[:3]
+        self.cds_expiries = sorted(set(instruments.expiry[
+                (instruments['exchange']=="CDS") & futures]))[:3]
         
-        self.expiries = sorted(list(self.expiries))[:3]
-        self.cds_expiries = sorted(list(self.cds_expiries))[:3]
-        
-        self._instruments_list = self._instruments_list[
-                self._instruments_list.expiry.isin(set([*self.expiries,
-                                                  *self.cds_expiries,
-                                                  today]))]
+        self._instruments_list = instruments[
+                instruments.expiry.isin(set([*self.expiries,
+                                             *self.cds_expiries,
+                                             today]))]
         
     def _extract_expiries_underlyings(self):
         '''
             Separates underlyings and and expiry month number to 
             enable searching either NIFTY18DECFUT or NIFTY-II.
         '''
-        def underlying(s,e):
-            s = s.split(e.strftime('%y%b').upper())
-            return s[0]
-        underlyings = [underlying(r['tradingsymbol'],r['expiry']) \
-                for i, r in self._instruments_list.iterrows()]
-        self._instruments_list['underlying'] = underlyings
+        instruments = self._instruments_list.copy()
+        symbols = instruments.tradingsymbol
+        
+        # the underlying is the part before the expiry tag (18DEC),
+        # there are only a handful of distinct expiries.
+        tags = instruments.expiry.dt.strftime('%y%b').str.upper()
+        underlyings = symbols.copy()
+        for tag in tags.unique():
+            rows = tags == tag
+            underlyings[rows] = symbols[rows].str.split(
+                    tag, n=1, regex=False).str[0]
+        instruments['underlying'] = underlyings
         
         exp1_dict = dict(zip(self.expiries,['I',"II","III"]))
         exp2_dict = dict(zip(self.cds_expiries,['I',"II","III"]))
         
-        def expiry_month(e,i,s, d1, d2):
-            if i != "FUT":
-                return ""
-            
-            if s == "NFO":
-                return d1.get(e,"")
-            
-            if s == "CDS":
-                return d2.get(e,"")
-            
-            return ""
+        futures = instruments["instrument_type"] == "FUT"
+        nfo = futures & (instruments["exchange"] == "NFO")
+        cds = futures & (instruments["exchange"] == "CDS")
+        exp = pd.Series("", index=instruments.index)
+        exp[nfo] = instruments.expiry[nfo].map(exp1_dict).fillna("")
+        exp[cds] = instruments.expiry[cds].map(exp2_dict).fillna("")
+        instruments['exp'] = exp
         
-        exp = [expiry_month(r["expiry"],
-                                r["instrument_type"],
-                                r["exchange"],exp1_dict,exp2_dict)\
-            for i, r in self._instruments_list.iterrows()]
-        self._instruments_list['exp'] = exp
+        self._instruments_list = instruments
         
     def _asset_from_row(self, row):
         '''
@@ -323,7 +431,6 @@ class KiteAssetFinder(BrokerAssetFinder):
         instruments_list = kwargs.get("instruments_list",None)
         self.update_instruments_list(instruments_list)
     
-    @lru_cache(maxsize=LRU_CACHE_SIZE,typed=False)
     def symbol_to_asset(self, tradingsymbol, as_of_date=None):
         '''
             Asset finder that first looks at the provided asset
@@ -335,6 +442,17 @@ class KiteAssetFinder(BrokerAssetFinder):
             symbol stored, if not matched in our databse, is always
             the tradeable symbol.
         '''
+        self._ensure_valid()
+        key = (tradingsymbol, as_of_date)
+        asset = self._symbol_cache.get(key, None)
+        if asset is not None:
+            return asset
+        
+        asset = self._symbol_to_asset(tradingsymbol, as_of_date)
+        self._symbol_cache[key] = asset
+        return asset
+    
+    def _symbol_to_asset(self, tradingsymbol, as_of_date=None):
         if self._asset_finder is not None:
             try:
                 asset = self._asset_finder.lookup_symbol(tradingsymbol,
@@ -350,64 +468,60 @@ class KiteAssetFinder(BrokerAssetFinder):
         if bases[0] != sym:
             if len(bases)>1 and bases[-1] in ['','I','II']:
                 exp = bases[-1]+'I'
-                row = self._instruments_list.loc[
-                        (self._instruments_list.underlying==bases[0]) &\
-                        (self._instruments_list.exp == exp) &\
-                        (self._instruments_list.instrument_type=='FUT'),]
+                row = self._index.by_expiry(bases[0], exp, 'FUT')
             else:
-                row = self._instruments_list.loc[
-                        self._instruments_list.tradingsymbol==sym,]
+                row = self._index.by_symbol(sym)
         else:
-            row = self._instruments_list.loc[
-                    self._instruments_list.tradingsymbol==sym,]
+            row = self._index.by_symbol(sym)
         
-        if row.empty:
+        if row is None:
             # no match found. Refuse to trade the symbol
             # default handling is to log
             raise SymbolNotFound(msg=tradingsymbol)
         
-        row = row.iloc[0].to_dict()
         return self._asset_from_row(row)
                 
-    @lru_cache(maxsize=LRU_CACHE_SIZE,typed=False)
     def id_to_asset(self, instrument_id):
         '''
             create an asset from the instrument id. First extract
             the matching row and search for the asset in our own
             database. If no match found, create an asset and return.
         '''
-        row = self._instruments_list[self._instruments_list.\
-                                     instrument_token==instrument_id]
-        if row.empty:
+        self._ensure_valid()
+        asset = self._id_cache.get(instrument_id, None)
+        if asset is not None:
+            return asset
+        
+        row = self._index.by_token(instrument_id)
+        if row is None:
             raise SymbolNotFound(msg=f"no asset found for {instrument_id}")
-            
-        row = row.iloc[0].to_dict()
         
+        asset = None
         if self._asset_finder is not None:
             try:
                 asset = self._asset_finder.lookup_symbol(row['tradingsymbol'])
-                return asset
             except SymbolNotFound:
                 pass
         
-        return self._asset_from_row(row)
+        if asset is None:
+            asset = self._asset_from_row(row)
+        self._id_cache[instrument_id] = asset
+        return asset
         
     def asset_to_symbol(self, asset):
         return asset.symbol
     
-    @lru_cache(maxsize=LRU_CACHE_SIZE,typed=False)
     def asset_to_id(self, asset):
         '''
             Given an asset retrieve the instrument id. Instrument ID
             is required for placing trades or querying hisotrical
             data.
         '''
-        row = self._instruments_list[self._instruments_list.\
-                                     tradingsymbol==asset.symbol] 
-        if row.empty:
+        self._ensure_valid()
+        row = self._index.by_symbol(asset.symbol)
+        if row is None:
             raise SymbolNotFound(msg=f"no id found for {asset.symbol}")
         
-        row = row.iloc[0].to_dict()
         return row['instrument_token']
     
     def lookup_symbol(self, sym, as_of_date=None):
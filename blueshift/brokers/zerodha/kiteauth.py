@@ -29,7 +29,7 @@ from blueshift.utils.exceptions import (AuthenticationError,
                                         ExceptionHandling,
                                         ValidationError)
 from blueshift.utils.decorators import singleton, blueprint
-from blueshift.utils.mixins import APIRateLimitMixin
+from blueshift.utils.mixins import APIRateLimitMixin, TokenBucket
 
 # pylint: disable=invalid-name, missing-docstring
 kite_calendar = TradingCalendar('NSE',tz='Asia/Calcutta',opens=(9,15,0), 
@@ -78,6 +78,14 @@ class KiteConnect3(APIRateLimitMixin, KiteConnect):
         if not self._max_instruments:
             # max allowed is 500 for current, and one for history
             self._max_instruments = 50
+        
+        # historical data has its own limit of 3 per sec, shared by
+        # all threads fetching history.
+        history_rate_limit = kwargs.pop("history_rate_limit",None)
+        if not history_rate_limit:
+            history_rate_limit = 3
+        self._history_limiter = TokenBucket(history_rate_limit, 
+                                            self._rate_period)
             
         # we reset this value on first call
         self._rate_limit_since = None 
@@ -85,6 +93,10 @@ class KiteConnect3(APIRateLimitMixin, KiteConnect):
         if not self._trading_calendar:
             raise ValidationError(msg="missing calendar")
     
+    @property
+    def history_limiter(self):
+        return self._history_limiter
+    
     def __str__(self):
         return "Kite Connect API v3.0"
     
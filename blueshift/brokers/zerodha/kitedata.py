@@ -20,11 +20,13 @@ import json
 import pandas as pd
 import numpy as np
 from math import ceil
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from requests.exceptions import RequestException
 
 from kiteconnect.exceptions import KiteException
 
 from blueshift.data.rest_data import RESTDataPortal
+from blueshift.data.bar_cache import BarCache
 from blueshift.utils.types import OHLCV_FIELDS
 from blueshift.utils.exceptions import (AuthenticationError, 
                                         ExceptionHandling,
@@ -36,6 +38,10 @@ from blueshift.utils.decorators import api_rate_limit, singleton, blueprint
 from blueshift.brokers.zerodha.kiteassets import KiteAssetFinder
 
 LRU_CACHE_SIZE = 512
+# concurrent history requests, the rate limiter sets the pace.
+HISTORY_WORKERS = 4
+# price scaling for the bar cache, enough for currency derivatives.
+CACHE_PRICE_SCALE = 10000
 
 
 @singleton
@@ -81,6 +87,18 @@ class KiteRestData(RESTDataPortal):
         self._minute_per_day = int((self._trading_calendar._close_nano - 
                                     self._trading_calendar._open_nano)/(60*1E9))
         
+        self._history_workers = kwargs.pop("history_workers", 
+                                           HISTORY_WORKERS)
+        
+        # past bars can be served from an on-disk cache (opt-in). Pass
+        # True for the default location, or a BarCache instance.
+        self._cache = kwargs.pop("history_cache", False)
+        if self._cache is True:
+            self._cache = BarCache(name='zerodha', 
+                                   scale=CACHE_PRICE_SCALE)
+        elif not self._cache:
+            self._cache = None
+    
     
     @api_rate_limit
     def current(self, assets, fields):
@@ -104,10 +122,64 @@ class KiteRestData(RESTDataPortal):
             raise MissingDataError(msg=msg, handling=handling)
         
     def history(self, assets, fields, nbar, frequency):
+        '''
+            Historical bars for the assets, as a dataframe with asset 
+            and timestamp as index, in the order of the assets. The 
+            requests are made concurrently.
+        '''
+        data = dict(self.history_as_completed(assets, fields, nbar, 
+                                              frequency))
+        if not data:
+            return
+        
+        return pd.concat({asset:data[asset] for asset in assets \
+                          if asset in data})
+    
+    def history_as_completed(self, assets, fields, nbar, frequency):
+        '''
+            Generator of (asset, dataframe) tuples, yielded as the
+            history requests complete. Kite serves history one 
+            instrument per request, so the requests are issued from a
+            thread pool, paced by the history rate limiter of the API.
+            Assets not found are skipped. Any other error cancels the 
+            pending requests and raises MissingDataError.
+        '''
         # prune the list if we exceed max instruments
         if len(assets) > self._api._max_instruments:
             assets = assets[:self._api._max_instruments]
             
+        dates = self._history_dates(nbar, frequency)
+        if dates is None:
+            return
+        from_date, to_date, interval = dates
+        
+        instruments = {}
+        for asset in assets:
+            try:
+                instruments[asset] = self._asset_finder.asset_to_id(asset)
+            except SymbolNotFound:
+                pass
+        
+        if not instruments:
+            return
+        
+        workers = max(1, min(self._history_workers, len(instruments)))
+        executor = ThreadPoolExecutor(max_workers=workers)
+        futures = {}
+        try:
+            futures = {executor.submit(self._fetch_history, instrument,
+                                       from_date, to_date, interval, 
+                                       nbar, fields):asset \
+                        for asset, instrument in instruments.items()}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            # on error (or early exit) do not wait for the queue
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+    
+    def _history_dates(self, nbar, frequency):
         frequency = frequency.lower()
         
         if frequency not in ['1m','1d']:
@@ -131,36 +203,54 @@ class KiteRestData(RESTDataPortal):
         to_date = valid_sessions[-1]
         from_date = valid_sessions[0]
         
-        data = {}
-        for asset in assets:
-            try:
-                instrument = self._asset_finder.asset_to_id(asset)
-                data[asset] = self._history(instrument, 
-                                from_date,to_date, interval, nbar,
-                                fields)
-            except SymbolNotFound:
-                pass
-            except KiteException as e:
-                msg = str(e)
-                handling = ExceptionHandling.WARN
-                raise MissingDataError(msg=msg, handling=handling)
-            except RequestException as e:
-                msg = str(e)
-                handling = ExceptionHandling.WARN
-                raise MissingDataError(msg=msg, handling=handling)
+        return from_date, to_date, interval
             
-        return pd.concat(data)
+    def _fetch_history(self, instrument_id, from_date, to_date, interval, 
+                       nbar, fields):
+        '''
+            Single instrument history request, called from the worker
+            threads. Blocks only the calling thread till the limiter
+            allows the request. With the cache, only the bars since the
+            last cached one are requested.
+        '''
+        if self._cache is None:
+            self._api.history_limiter.acquire()
+            return self._history(instrument_id, from_date, to_date, 
+                                 interval, nbar, fields)
         
-    @api_rate_limit
+        def fetch(start):
+            if start is None:
+                start = from_date
+            elif start < from_date:
+                # the cache is older than the lookback, rebuild it
+                return
+            if interval == 'day':
+                start = start.normalize()
+            self._api.history_limiter.acquire()
+            return self._get_bars(instrument_id, start, to_date, 
+                                  interval)
+        
+        frequency = '1m' if interval == 'minute' else '1d'
+        data = self._cache.history(instrument_id, frequency, nbar, fetch,
+                                   tz=self.tz)
+        valid_fields = [f for f in fields if f in OHLCV_FIELDS]
+        return data.loc[:, valid_fields]
+    
     def _history(self, instrument_id, from_date, to_date, interval, 
                  nbar, fields):
         valid_fields = [f for f in fields if f in OHLCV_FIELDS]
+        data = self._get_bars(instrument_id, from_date, to_date, interval)
+        nbar = min(nbar,len(data))
+        data = data[-nbar:]
+        return data.loc[:, valid_fields]
+    
+    def _get_bars(self, instrument_id, from_date, to_date, interval):
         try:
-            data = self._api.historical_data(instrument_id,from_date.date(),
-                                             to_date.date(), interval)
-            nbar = min(nbar,len(data))
-            data = self._list_to_df(data)[-nbar:]
-            return data.loc[:, valid_fields]
+            data = self._api.historical_data(instrument_id,
+                                             self._to_kite_date(from_date),
+                                             self._to_kite_date(to_date), 
+                                             interval)
+            return self._list_to_df(data)
         except KiteException as e:
             msg = str(e)
             handling = ExceptionHandling.WARN
@@ -170,6 +260,13 @@ class KiteRestData(RESTDataPortal):
                 handling = ExceptionHandling.WARN
                 raise MissingDataError(msg=msg, handling=handling)
             
+    @classmethod
+    def _to_kite_date(cls, dt):
+        # sessions go as dates, intraday timestamps as local datetime
+        if dt == dt.normalize():
+            return dt.date()
+        return dt.tz_localize(None).to_pydatetime()
+    
     def _list_to_df(self, data):
         t, o, h, l, c, v = [], [], [], [], [], []
         for e in data:
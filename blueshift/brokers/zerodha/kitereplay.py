@@ -0,0 +1,315 @@
+# Copyright 2018 QuantInsti Quantitative Learnings Pvt Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Created on Thu Feb 28 14:05:51 2019
+
+@author: prodipta
+
+recording of Kite ticks and a local websocket server to replay them
+in the Kite binary format, as a stand-in for the Kite ticker.
+
+"""
+import csv
+import json
+import struct
+from os import path as os_path
+from threading import Lock, Thread
+from time import time_ns
+import numpy as np
+import pandas as pd
+
+from autobahn.twisted.websocket import (WebSocketServerProtocol,
+                                        WebSocketServerFactory,
+                                        listenWS)
+from twisted.internet import reactor
+
+from blueshift.configs.defaults import ensure_directory
+from blueshift.utils.exceptions import MissingDataError
+from blueshift.utils.types import NANO_SECOND
+
+TICK_COLUMNS = ['timestamp', 'instrument_token', 'last_price',
+                'last_traded_quantity', 'average_traded_price',
+                'volume_traded', 'total_buy_quantity',
+                'total_sell_quantity', 'open', 'high', 'low', 'close',
+                'oi']
+OHLC_COLUMNS = ['open', 'high', 'low', 'close']
+
+DEFAULT_REPLAY_PORT = 8765
+
+# Kite segments (last byte of the instrument token) and price divisors.
+SEGMENT_CDS = 3
+SEGMENT_BCD = 6
+SEGMENT_INDICES = 9
+SEGMENT_NCO = 12
+
+def tick_nano(tick, default=None):
+    '''
+        Timestamp of a parsed tick in nanos since epoch. The Kite
+        ticker parses the exchange timestamp as a naive local datetime,
+        which the posix timestamp reverses. Ticks without one (ltp and
+        quote modes) get the `default`.
+    '''
+    dt = tick.get('exchange_timestamp') or tick.get('last_trade_time')
+    if dt is None:
+        return default
+    return int(round(dt.timestamp()*NANO_SECOND))
+
+class TickRecorder(object):
+    '''
+        Append parsed Kite ticks to a csv file, one row per tick, that
+        the replay server can play back.
+    '''
+    def __init__(self, path):
+        self._path = path
+        ensure_directory(os_path.dirname(os_path.abspath(path)))
+        exists = os_path.exists(path) and os_path.getsize(path) > 0
+        self._fp = open(path, 'a', newline='')
+        self._writer = csv.writer(self._fp)
+        self._lock = Lock()
+        if not exists:
+            self._writer.writerow(TICK_COLUMNS)
+    
+    @property
+    def path(self):
+        return self._path
+    
+    def write(self, ticks, default=None):
+        default = default or time_ns()
+        rows = []
+        for tick in ticks:
+            ohlc = tick.get('ohlc', {})
+            rows.append([tick_nano(tick, default),
+                         tick['instrument_token'],
+                         tick.get('last_price', 0),
+                         tick.get('last_traded_quantity', 0),
+                         tick.get('average_traded_price', 0),
+                         tick.get('volume_traded', 0),
+                         tick.get('total_buy_quantity', 0),
+                         tick.get('total_sell_quantity', 0),
+                         *[ohlc.get(c, 0) for c in OHLC_COLUMNS],
+                         tick.get('oi', 0)])
+        
+        with self._lock:
+            self._writer.writerows(rows)
+            self._fp.flush()
+    
+    def close(self):
+        with self._lock:
+            self._fp.close()
+
+def read_ticks(path):
+    '''
+        Read a recorded tick file, sorted by timestamp.
+    '''
+    if not os_path.exists(path):
+        raise MissingDataError(msg=f"tick file {path} not found.")
+    
+    df = pd.read_csv(path)
+    for col in TICK_COLUMNS:
+        if col not in df.columns:
+            df[col] = 0
+    df = df[TICK_COLUMNS].fillna(0)
+    return df.sort_values('timestamp', kind='stable').reset_index(drop=True)
+
+def price_divisor(token):
+    segment = int(token) & 0xff
+    if segment == SEGMENT_CDS:
+        return 10000000
+    elif segment in (SEGMENT_BCD, SEGMENT_NCO):
+        return 10000
+    return 100
+
+def encode_packet(tick, mode, timestamp):
+    '''
+        Encode a tick (a row of the tick file) as a Kite binary packet
+        in `ltp`, `quote` or `full` mode. Market depth is sent empty.
+    '''
+    token = int(tick['instrument_token'])
+    divisor = price_divisor(token)
+    price = lambda x: int(round(float(x)*divisor))
+    qty = lambda x: int(x)
+    secs = int(timestamp//NANO_SECOND)
+    
+    if mode == 'ltp':
+        return struct.pack('>II', token, price(tick['last_price']))
+    
+    if (token & 0xff) == SEGMENT_INDICES:
+        values = [token, price(tick['last_price']), price(tick['high']),
+                  price(tick['low']), price(tick['open']),
+                  price(tick['close']), 0]
+        if mode == 'full':
+            values.append(secs)
+        return struct.pack('>'+'I'*len(values), *values)
+    
+    values = [token, price(tick['last_price']),
+              qty(tick['last_traded_quantity']),
+              price(tick['average_traded_price']),
+              qty(tick['volume_traded']), qty(tick['total_buy_quantity']),
+              qty(tick['total_sell_quantity']), price(tick['open']),
+              price(tick['high']), price(tick['low']), price(tick['close'])]
+    if mode != 'full':
+        return struct.pack('>'+'I'*len(values), *values)
+    
+    values.extend([secs, qty(tick['oi']), 0, 0, secs])
+    return struct.pack('>'+'I'*len(values), *values) + bytes(120)
+
+def encode_message(packets):
+    '''
+        Frame the packets in a single Kite binary message.
+    '''
+    parts = [struct.pack('>H', len(packets))]
+    for packet in packets:
+        parts.append(struct.pack('>H', len(packet)))
+        parts.append(packet)
+    return b''.join(parts)
+
+class KiteReplayProtocol(WebSocketServerProtocol):
+    '''
+        One client connection. Handles the subscribe, unsubscribe and
+        mode messages of the Kite ticker and plays back the recorded
+        ticks of the subscribed tokens from the start of the file.
+    '''
+    def onOpen(self):
+        self._modes = {}
+        self._position = 0
+        self._offset = 0
+        self._call = None
+        self._closed = False
+    
+    def onMessage(self, payload, is_binary):
+        if is_binary:
+            return
+        try:
+            msg = json.loads(payload.decode('utf-8'))
+            action, value = msg['a'], msg['v']
+        except (ValueError, KeyError, UnicodeDecodeError):
+            return
+        
+        if action == 'subscribe':
+            new = [int(t) for t in value if int(t) not in self._modes]
+            for token in new:
+                self._modes[token] = 'quote'
+            self._send_snapshot(new)
+        elif action == 'unsubscribe':
+            for token in value:
+                self._modes.pop(int(token), None)
+        elif action == 'mode':
+            mode, tokens = value
+            for token in tokens:
+                self._modes[int(token)] = mode
+        
+        if self._call is None and self._modes:
+            self._start()
+    
+    def onClose(self, was_clean, code, reason):
+        self._closed = True
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+    
+    def _send_snapshot(self, tokens):
+        '''
+            Like Kite, send the latest tick of a new subscription if the
+            replay is under way.
+        '''
+        if self._call is None or not tokens:
+            return
+        
+        factory = self.factory
+        seen = factory.tokens[:self._position]
+        packets = []
+        for token in tokens:
+            idx = np.flatnonzero(seen == token)
+            if len(idx):
+                i = int(idx[-1])
+                packets.append(encode_packet(factory.ticks[i], 'quote',
+                                             factory.times[i] + 
+                                             self._offset))
+        if packets:
+            self.sendMessage(encode_message(packets), isBinary=True)
+    
+    def _start(self):
+        times = self.factory.times
+        if not len(times):
+            return
+        if self.factory.shift_time:
+            self._offset = time_ns() - int(times[0])
+        self._call = reactor.callLater(0, self._step)
+    
+    def _step(self):
+        if self._closed:
+            return
+        
+        factory = self.factory
+        times, ticks = factory.times, factory.ticks
+        start = self._position
+        end = int(np.searchsorted(times, times[start], side='right'))
+        self._position = end
+        
+        timestamp = int(times[start]) + self._offset
+        packets = [encode_packet(ticks[i], self._modes[token], timestamp) \
+                   for i, token in zip(range(start, end),
+                                       factory.tokens[start:end]) \
+                   if token in self._modes]
+        if packets:
+            self.sendMessage(encode_message(packets), isBinary=True)
+        
+        if end < len(times):
+            delay = (int(times[end]) - int(times[start]))/NANO_SECOND
+            self._call = reactor.callLater(delay/factory.speed, self._step)
+
+class KiteReplayServer(WebSocketServerFactory):
+    '''
+        Local websocket server replaying recorded ticks (see
+        `TickRecorder`) in the Kite binary format. Point the Kite ticker
+        (or the streaming data portal) to it with `root`. The ticks are
+        played at `speed` times the recorded pace, and are shifted to
+        start now if `shift_time` is set.
+    '''
+    protocol = KiteReplayProtocol
+    
+    def __init__(self, path, port=DEFAULT_REPLAY_PORT, host='127.0.0.1',
+                 speed=1.0, shift_time=True):
+        super(KiteReplayServer, self).__init__(f"ws://{host}:{port}")
+        self.port = port
+        self.speed = float(speed)
+        self.shift_time = shift_time
+        
+        df = read_ticks(path) if isinstance(path, str) else path
+        self.times = df['timestamp'].values.astype(np.int64)
+        self.tokens = df['instrument_token'].values.astype(np.int64)
+        self.ticks = df.to_dict('records')
+    
+    def start(self, threaded=False):
+        '''
+            Start listening. The twisted reactor is started (in a
+            daemon thread if `threaded`) unless it is already running.
+        '''
+        if reactor.running:
+            reactor.callFromThread(listenWS, self)
+            return
+        
+        listenWS(self)
+        if threaded:
+            thread = Thread(target=reactor.run,
+                            kwargs={'installSignalHandlers':False})
+            thread.daemon = True
+            thread.start()
+        else:
+            reactor.run()
+    
+    def __str__(self):
+        return f"Blueshift Kite Replay Server [{self.url}]"
+    
+    def __repr__(self):
+        return self.__str__()
@@ -0,0 +1,367 @@
+# Copyright 2018 QuantInsti Quantitative Learnings Pvt Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Created on Wed Feb 27 11:32:18 2019
+
+@author: prodipta
+"""
+import json
+from threading import Condition
+from time import time_ns, monotonic
+import numpy as np
+import pandas as pd
+
+from kiteconnect import KiteTicker
+from twisted.internet import reactor
+
+from blueshift.data.rest_data import RESTDataPortal
+from blueshift.utils.types import OHLCV_FIELDS, NANO_SECOND, listlike
+from blueshift.utils.exceptions import (AuthenticationError,
+                                        ExceptionHandling,
+                                        MissingDataError,
+                                        UnsupportedFrequency)
+from blueshift.utils.decorators import singleton, blueprint
+
+from blueshift.brokers.zerodha.kiteassets import KiteAssetFinder
+from blueshift.brokers.zerodha.kitereplay import TickRecorder, tick_nano
+
+MINUTE_NANO = 60*NANO_SECOND
+# minute bars kept in memory per instrument, a full NSE session.
+MAX_BARS = 375
+INITIAL_TOKEN_CAPACITY = 64
+# wait for the first tick after a new subscription, in seconds.
+FIRST_TICK_TIMEOUT = 2
+
+
+@singleton
+@blueprint
+class KiteStreamingData(RESTDataPortal):
+    '''
+        Live data portal on the Kite ticker (websocket) feed. Assets are
+        subscribed on first request. The ticks are rolled into minute
+        bars in preallocated ring buffers, one row per instrument, and
+        `current` and minute `history` up to `max_bars` are served from
+        memory without any REST calls. Longer (or daily) history goes
+        to the REST data portal, if supplied.
+    '''
+    def __init__(self, *args, **kwargs):
+        self._create(*args, **kwargs)
+    
+    def _create(self, *args, **kwargs):
+        config = None
+        config_file = kwargs.pop('config',None)
+        if config_file:
+            try:
+                with open(config_file) as fp:
+                    config = json.load(fp)
+            except:
+                pass
+        
+        if config:
+            kwargs = {**config, **kwargs}
+        
+        super(self.__class__, self).__init__(*args, **kwargs)
+        
+        if not self._api:
+            if not self._auth:
+                msg = "authentication and API missing"
+                handling = ExceptionHandling.TERMINATE
+                raise AuthenticationError(msg=msg, handling=handling)
+            self._api = self._auth._api
+        
+        if not self._trading_calendar:
+            self._trading_calendar = self._auth._trading_calendar
+        
+        self._asset_finder = kwargs.pop("asset_finder", None)
+        if self._asset_finder is None:
+            self._asset_finder = KiteAssetFinder(auth=self._auth)
+        
+        # fall back for history not in memory
+        self._rest_data = kwargs.pop("rest_data", None)
+        self._max_bars = int(kwargs.pop("max_bars", MAX_BARS))
+        self._timeout = kwargs.pop("timeout", FIRST_TICK_TIMEOUT)
+        self._mode = kwargs.pop("mode", KiteTicker.MODE_FULL)
+        
+        record = kwargs.pop("record", None)
+        self._recorder = TickRecorder(record) if record else None
+        
+        self._ticker = kwargs.pop("ticker", None)
+        if self._ticker is None:
+            self._ticker = KiteTicker(self._api.api_key,
+                                      self._api.access_token,
+                                      root=kwargs.pop("root", None))
+        self._ticker.on_ticks = self._on_ticks
+        self._ticker.on_connect = self._on_connect
+        
+        # tick updates come on the reactor thread.
+        self._ticked = Condition()
+        self._rows = {}
+        self._tokens = []
+        self._fields = list(OHLCV_FIELDS)
+        self._field_idx = dict(zip(self._fields,range(len(self._fields))))
+        self._allocate(INITIAL_TOKEN_CAPACITY)
+        
+        if kwargs.pop("connect", True):
+            self.connect()
+    
+    def _allocate(self, capacity):
+        '''
+            (Re-)allocate the buffers for `capacity` instruments,
+            keeping the existing rows.
+        '''
+        n = len(self._tokens)
+        bars = np.full((len(self._fields), capacity, self._max_bars),
+                       np.nan)
+        bar_nanos = np.zeros((capacity, self._max_bars), dtype=np.int64)
+        counts = np.zeros(capacity, dtype=np.int64)
+        last_price = np.full(capacity, np.nan)
+        last_nano = np.zeros(capacity, dtype=np.int64)
+        cum_volume = np.full(capacity, np.nan)
+        
+        if n > 0:
+            bars[:,:n,:] = self._bars[:,:n,:]
+            bar_nanos[:n] = self._bar_nanos[:n]
+            counts[:n] = self._counts[:n]
+            last_price[:n] = self._last_price[:n]
+            last_nano[:n] = self._last_nano[:n]
+            cum_volume[:n] = self._cum_volume[:n]
+        
+        self._bars = bars
+        self._bar_nanos = bar_nanos
+        self._counts = counts
+        self._last_price = last_price
+        self._last_nano = last_nano
+        self._cum_volume = cum_volume
+    
+    @property
+    def ticker(self):
+        return self._ticker
+    
+    @property
+    def max_bars(self):
+        return self._max_bars
+    
+    def connect(self):
+        self._ticker.connect(threaded=True)
+    
+    def close(self):
+        self._ticker.close()
+        if self._recorder:
+            self._recorder.close()
+    
+    def _on_connect(self, ws, response):
+        # (re-)subscribe whatever is asked for so far.
+        with self._ticked:
+            tokens = list(self._tokens)
+        if tokens:
+            ws.subscribe(tokens)
+            ws.set_mode(self._mode, tokens)
+    
+    def _send(self, func, *args):
+        # websocket writes belong to the reactor thread.
+        if reactor.running:
+            reactor.callFromThread(func, *args)
+        else:
+            func(*args)
+    
+    def subscribe(self, assets):
+        '''
+            Subscribe to the ticks of the assets (if not already) and
+            return their rows in the buffers.
+        '''
+        # the asset finder may go to the network, resolve the tokens
+        # before blocking the tick updates.
+        ids = [int(self._asset_finder.asset_to_id(asset)) \
+               for asset in assets]
+        
+        rows, tokens = [], []
+        with self._ticked:
+            for token in ids:
+                row = self._rows.get(token)
+                if row is None:
+                    row = len(self._tokens)
+                    if row == len(self._counts):
+                        self._allocate(2*len(self._counts))
+                    self._rows[token] = row
+                    self._tokens.append(token)
+                    tokens.append(token)
+                rows.append(row)
+        
+        if tokens and self._ticker.is_connected():
+            self._send(self._ticker.subscribe, tokens)
+            self._send(self._ticker.set_mode, self._mode, tokens)
+        
+        return rows
+    
+    def _wait_for_ticks(self, rows):
+        '''
+            Wait (up to the timeout) for the first tick of the rows. Kite
+            sends a snapshot tick on subscription.
+        '''
+        deadline = monotonic() + self._timeout
+        with self._ticked:
+            while not np.all(self._counts[rows] > 0):
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                self._ticked.wait(remaining)
+    
+    def _on_ticks(self, ws, ticks):
+        now = time_ns()
+        with self._ticked:
+            for tick in ticks:
+                row = self._rows.get(tick.get('instrument_token'))
+                if row is not None:
+                    self._update(row, tick, now)
+            self._ticked.notify_all()
+        
+        if self._recorder:
+            self._recorder.write(ticks, now)
+    
+    def _update(self, row, tick, now):
+        '''
+            Roll a tick in the minute bar of its timestamp. The volume
+            is the change in the cumulative day volume.
+        '''
+        price = tick.get('last_price')
+        if price is None:
+            return
+        nano = tick_nano(tick, now)
+        
+        delta = 0
+        volume = tick.get('volume_traded')
+        if volume is not None:
+            last = self._cum_volume[row]
+            if last == last and volume >= last:
+                delta = volume - last
+            self._cum_volume[row] = volume
+        
+        bar_nano = nano - nano % MINUTE_NANO
+        n = self._counts[row]
+        pos = (n - 1) % self._max_bars
+        bars = self._bars
+        
+        if n == 0 or bar_nano > self._bar_nanos[row, pos]:
+            pos = n % self._max_bars
+            self._bar_nanos[row, pos] = bar_nano
+            bars[0:4, row, pos] = price
+            bars[4, row, pos] = delta
+            self._counts[row] = n + 1
+        else:
+            if price > bars[1, row, pos]:
+                bars[1, row, pos] = price
+            if price < bars[2, row, pos]:
+                bars[2, row, pos] = price
+            bars[3, row, pos] = price
+            bars[4, row, pos] += delta
+        
+        self._last_price[row] = price
+        self._last_nano[row] = nano
+    
+    def _field_indices(self, fields):
+        try:
+            return [self._field_idx['close' if f == 'last' else f] \
+                    for f in fields]
+        except KeyError as e:
+            raise MissingDataError(msg=f"unknown field {str(e)}")
+    
+    def current(self, assets, fields):
+        single_asset = not listlike(assets)
+        single_field = not listlike(fields)
+        assets = [assets] if single_asset else list(assets)
+        fields = [fields] if single_field else list(fields)
+        
+        fidx = self._field_indices(fields)
+        rows = self.subscribe(assets)
+        self._wait_for_ticks(rows)
+        
+        rows = np.asarray(rows)
+        with self._ticked:
+            counts = self._counts[rows]
+            pos = (counts - 1) % self._max_bars
+            values = self._bars[np.asarray(fidx)[:,None], rows, pos]
+        values[:, counts == 0] = np.nan
+        
+        if single_asset and single_field:
+            return values[0,0]
+        elif single_field:
+            return pd.Series(values[0], index=assets, name=fields[0])
+        elif single_asset:
+            return pd.Series(values[:,0], index=fields, name=assets[0])
+        return pd.DataFrame(values.T, index=assets, columns=fields)
+    
+    def _read_bars(self, row, fidx, fields, nbar):
+        n = self._counts[row]
+        pos = np.arange(n - nbar, n) % self._max_bars
+        idx = pd.to_datetime(self._bar_nanos[row, pos])
+        idx = idx.tz_localize('Etc/UTC').tz_convert(self.tz)
+        values = self._bars[np.asarray(fidx)[:,None], row, pos]
+        return pd.DataFrame(values.T, index=idx, columns=fields)
+    
+    def history(self, assets, fields, nbar, frequency):
+        single_asset = not listlike(assets)
+        single_field = not listlike(fields)
+        assets = [assets] if single_asset else list(assets)
+        fields = [fields] if single_field else list(fields)
+        
+        fidx = self._field_indices(fields)
+        frequency = frequency.lower()
+        if frequency not in ['1m','1d']:
+            raise UnsupportedFrequency(msg=frequency)
+        
+        nbar = int(nbar)
+        rows = self.subscribe(assets)
+        data = None
+        if frequency == '1m' and nbar <= self._max_bars:
+            self._wait_for_ticks(rows)
+            with self._ticked:
+                if np.all(self._counts[rows] >= nbar):
+                    data = {asset:self._read_bars(row, fidx, fields, nbar) \
+                            for asset, row in zip(assets, rows)}
+        
+        if data is None:
+            data = self._rest_history(assets, fields, nbar, frequency)
+        
+        if single_asset:
+            df = data[assets[0]]
+            return df[fields[0]] if single_field else df
+        elif single_field:
+            return pd.DataFrame({asset:data[asset][fields[0]] \
+                                 for asset in assets})
+        return pd.concat(data)
+    
+    def _rest_history(self, assets, fields, nbar, frequency):
+        if self._rest_data is None:
+            msg = f"{nbar} bars of {frequency} history not in memory."
+            raise MissingDataError(msg=msg)
+        
+        names = ['close' if f == 'last' else f for f in fields]
+        df = self._rest_data.history(assets, names, nbar, frequency)
+        if df is None:
+            raise MissingDataError(msg="no history data.")
+        
+        data = {}
+        for asset in assets:
+            try:
+                data[asset] = df.loc[asset].loc[:, names]
+            except KeyError:
+                raise MissingDataError(msg=f"no history for {asset}.")
+            data[asset].columns = fields
+        return data
+    
+    def __str__(self):
+        return "Blueshift Kite Streaming Data [name:%s]" % self.name
+    
+    def __repr__(self):
+        return self.__str__()
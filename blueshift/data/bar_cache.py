@@ -0,0 +1,267 @@
+# Copyright 2018 QuantInsti Quantitative Learnings Pvt Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Created on Tue Feb 26 10:41:12 2019
+
+@author: prodipta
+
+on-disk cache of historical bars fetched from broker REST APIs.
+
+"""
+import re
+from os import path as os_path
+from shutil import rmtree
+from threading import Lock
+import numpy as np
+import pandas as pd
+
+from blueshift.alerts import get_logger
+from blueshift.configs.defaults import blueshift_data_path
+from blueshift.data.interfaces.bcolzio import (BcolzSchema, BColzWriter,
+                                               BColzReader)
+from blueshift.utils.types import OHLCV_FIELDS
+from blueshift.utils.exceptions import (UnsupportedFrequency,
+                                        MissingDataError)
+
+INT32_MAX = np.iinfo(np.int32).max
+BAR_PERIODS = {'1m':pd.Timedelta(minutes=1), '1d':pd.Timedelta(days=1)}
+
+class BarCache(object):
+    '''
+        Persistent cache of OHLCV bars per instrument and frequency, on
+        the bcolz store. Past bars are read from disk and only the tail
+        since the last cached bar is fetched from the broker. Only the
+        completed bars are written, the tail fetch always supplies the
+        latest (still forming) bar.
+        
+        The tail fetch starts at the last cached bar. If that bar does
+        not come back unchanged (adjustment for a corporate action, or
+        a gap in the tail), the entry is rebuilt from a full fetch. The
+        prices are stored as int32 scaled by `scale`; an instrument that
+        overflows is not cached.
+    '''
+    KEY_PATTERN = re.compile(r'[^0-9A-Za-z]')
+    
+    def __init__(self, root=None, name='broker', scale=100, **kwargs):
+        if root is None:
+            root = os_path.join(blueshift_data_path(), 'cache', name)
+        self._root = root
+        self._scale = scale
+        self._cparams = kwargs.pop("cparams", None)
+        self._lock = Lock()
+        
+        self._prefixes = {'1m':'minute', '1d':'daily'}
+        self._schemas = {}
+        self._readers = {}
+        self._writers = {}
+        for frequency, prefix in self._prefixes.items():
+            schema = BcolzSchema(root, prefixes=[prefix], max_assets=10,
+                                 sid_splits=[2,2,2])
+            self._schemas[frequency] = schema
+            self._readers[frequency] = BColzReader(schema)
+            self._writers[frequency] = self._make_writer(schema)
+        
+        logger = get_logger()
+        if logger:
+            logger.info(f"caching history bars in {root}", "data")
+    
+    @property
+    def root(self):
+        return self._root
+    
+    @property
+    def scale(self):
+        return self._scale
+    
+    def _make_writer(self, schema):
+        meta_data = {BColzWriter.SCALE_KEY:self._scale,
+                     BColzWriter.NOSCALE_KEY:['volume']}
+        kwargs = {'schema':schema}
+        if self._cparams:
+            kwargs['cparams'] = self._cparams
+        return BColzWriter(len(OHLCV_FIELDS), list(OHLCV_FIELDS),
+                           meta_data, **kwargs)
+    
+    def _key(self, key):
+        # instrument ids or symbols, made safe for the path.
+        return self.KEY_PATTERN.sub('_', str(key))
+    
+    def _check_frequency(self, frequency):
+        if frequency not in self._schemas:
+            raise UnsupportedFrequency(msg=frequency)
+    
+    def read(self, key, frequency, nbar=None, tz=None):
+        '''
+            Return the last `nbar` cached bars (all if None) as a
+            dataframe with the index in `tz` (naive UTC if None). The
+            dataframe is empty if nothing is cached.
+        '''
+        self._check_frequency(frequency)
+        try:
+            df = self._readers[frequency].read_dataframe(
+                    self._key(key), list(OHLCV_FIELDS), nbars=nbar)
+        except MissingDataError:
+            return pd.DataFrame(columns=list(OHLCV_FIELDS),
+                                index=pd.DatetimeIndex([], tz=tz))
+        
+        df.index.name = None
+        df.index = df.index.tz_localize('UTC')
+        if tz is None:
+            df.index = df.index.tz_localize(None)
+        else:
+            df.index = df.index.tz_convert(tz)
+        return df
+    
+    def length(self, key, frequency):
+        '''
+            Number of bars cached for an instrument.
+        '''
+        self._check_frequency(frequency)
+        try:
+            ct, _, _ = self._readers[frequency].read_ctable(self._key(key))
+        except MissingDataError:
+            return 0
+        return len(ct)
+    
+    def write(self, key, frequency, df, now=None):
+        '''
+            Append the completed bars of the dataframe newer than the
+            last cached bar. Returns False if the data cannot be stored.
+        '''
+        self._check_frequency(frequency)
+        df = self._completed(df, frequency, now)
+        if len(df) == 0:
+            return True
+        
+        data = self._to_int32(df)
+        if data is None:
+            return False
+        
+        with self._lock:
+            self._writers[frequency].write_dataframe(self._key(key), data)
+        return True
+    
+    def clear(self, key=None, frequency=None):
+        '''
+            Remove the cached bars of an instrument (or everything).
+        '''
+        frequencies = [frequency] if frequency else list(self._schemas)
+        with self._lock:
+            for freq in frequencies:
+                self._check_frequency(freq)
+                if key is None:
+                    target = os_path.join(self._root, self._prefixes[freq])
+                else:
+                    target = self._schemas[freq].map_sid_to_path(
+                            self._key(key))
+                if os_path.exists(target):
+                    rmtree(target)
+    
+    def history(self, key, frequency, nbar, fetch, tz=None, now=None):
+        '''
+            Last `nbar` bars of an instrument, served from the cache and
+            topped up by calling `fetch(start)`. The fetch must return
+            an OHLCV dataframe from `start` (a timestamp in `tz`) to the
+            latest bar, or the full lookback of `nbar` bars if `start`
+            is None. It can return None for a start it cannot serve, and
+            the entry is then rebuilt.
+        '''
+        self._check_frequency(frequency)
+        nbar = int(nbar)
+        
+        if self.length(key, frequency) > 0:
+            cached = self.read(key, frequency, nbar, tz)
+            last = cached.index[-1]
+            tail = fetch(last)
+            
+            if self._is_continuation(cached, tail, last):
+                tail = tail[tail.index > last]
+                self.write(key, frequency, tail, now)
+                df = pd.concat([cached, tail.loc[:, cached.columns]])
+                if len(df) >= nbar:
+                    return df.iloc[-nbar:]
+        
+        # nothing usable cached (or too short), rebuild the entry from
+        # a full fetch
+        df = fetch(None)
+        if df is None:
+            return df
+        
+        self.clear(key, frequency)
+        if not self.write(key, frequency, df, now):
+            self.clear(key, frequency)
+        
+        return df.iloc[-nbar:]
+    
+    def _is_continuation(self, cached, tail, last):
+        if tail is None or last not in tail.index:
+            return False
+        
+        # the overlapping bar must match to the stored precision
+        old = cached.loc[last, list(OHLCV_FIELDS)].values.astype(float)
+        new = tail.loc[last, list(OHLCV_FIELDS)]
+        if isinstance(new, pd.DataFrame):
+            new = new.iloc[-1]
+        new = new.values.astype(float)
+        tol = np.full(len(old), 1.0/self._scale)
+        tol[list(OHLCV_FIELDS).index('volume')] = 1
+        return bool(np.all(np.abs(old - new) <= tol))
+    
+    def _completed(self, df, frequency, now=None):
+        '''
+            Drop the bars that are still forming as of `now`.
+        '''
+        if df is None or len(df) == 0:
+            return pd.DataFrame(columns=list(OHLCV_FIELDS))
+        
+        if now is None:
+            now = pd.Timestamp.now(tz='UTC')
+        now = pd.Timestamp(now)
+        
+        index = df.index
+        if index.tz is None:
+            if now.tz is not None:
+                now = now.tz_convert('UTC').tz_localize(None)
+        elif now.tz is None:
+            now = now.tz_localize(index.tz)
+        
+        return df[index + BAR_PERIODS[frequency] <= now]
+    
+    def _to_int32(self, df):
+        index = df.index
+        if index.tz is not None:
+            index = index.tz_convert('UTC').tz_localize(None)
+        
+        out = {}
+        for field in OHLCV_FIELDS:
+            values = df[field].values.astype(np.float64)
+            if field != 'volume':
+                values = np.round(values*self._scale)
+            if np.any(np.isnan(values)) or \
+                            np.any(np.abs(values) > INT32_MAX):
+                return None
+            out[field] = values.astype(np.int32)
+        
+        # in seconds, whatever the resolution of the index
+        secs = np.asarray(index).astype('datetime64[s]').astype(np.int64)
+        if secs.max() > INT32_MAX:
+            return None
+        
+        return pd.DataFrame(out, index=index, columns=list(OHLCV_FIELDS))
+    
+    def __str__(self):
+        return f"Blueshift Bar Cache [{self._root}]"
+    
+    def __repr__(self):
+        return self.__str__()
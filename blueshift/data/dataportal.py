@@ -17,11 +17,20 @@ Created on Fri Oct 19 01:28:32 2018
 @author: prodi
 """
 from abc import ABC, abstractmethod, abstractproperty
+import numpy as np
+import pandas as pd
 
+from blueshift.data.interfaces.bcolzio import BcolzSchema, BColzReader
+from blueshift.configs.defaults import blueshift_data_path
 from blueshift.utils.decorators import blueprint
-from blueshift.utils.types import DataPortalFlag, OHLCV_FIELDS
+from blueshift.utils.exceptions import (MissingDataError,
+                                        UnsupportedFrequency)
+from blueshift.utils.types import (DataPortalFlag, OHLCV_FIELDS, 
+                                   NANO_SECOND, listlike)
 from blueshift.configs.runtime import blueshift_run_get_name
 
+INITIAL_SID_CAPACITY = 64
+
 
 class DataPortal(ABC):
     '''
@@ -95,16 +104,107 @@ class DataPortal(ABC):
         """
         raise NotImplementedError
         
+    def set_timestamp(self, timestamp):
+        '''
+            Update the current simulation time (nanos since epoch). 
+            Portals serving live data follow the wall clock and can 
+            ignore this.
+        '''
+        pass
+        
+class _SidData(object):
+    '''
+        Cached read handle for a sid. Keeps the ctable open (carrays 
+        on disk) along with its scaling details, and the offset and 
+        the tick-wise row positions of the currently loaded session.
+    '''
+    def __init__(self, reader, sid, ct=None, scale=1, no_scale_cols=[]):
+        self.reader = reader
+        self.sid = sid
+        self.ct = ct
+        self.scale = scale
+        self.no_scale_cols = no_scale_cols
+        self.nrows = len(ct) if ct is not None else 0
+        # rows before cursor are never searched again
+        self.cursor = 0
+        # first row loaded for the session and the row position of
+        # each tick relative to it (-1 if no data yet).
+        self.offset = 0
+        self.positions = None
+        
+    def read(self, field, start, end):
+        '''
+            read and rescale a slice of a column.
+        '''
+        return self.reader._read_field(self.ct, field, start, end, 
+                                       self.scale, self.no_scale_cols).values
+    
+    def read_timestamps(self, start, end):
+        '''
+            read a slice of the timestamp column as int64 seconds.
+        '''
+        return self.ct[BColzReader.INDEX_NAME][start:end].astype(np.int64)
+        
 @blueprint
 class DBDataPortal(DataPortal):
     '''
-        Abstract class for handling all the data needs for an algo. This
-        encapsulates database reader for backtester portal and db + 
-        broker RESTful API + websockets for live trading
+        Backtest data portal on the bcolz store written by 
+        ``BColzWriter``. The ctable for each sid is opened once on first
+        request and its carrays stay on disk. At every session roll, we
+        decompress only the rows covering the session, compute the row
+        position of every clock tick with a single ``searchsorted`` per
+        sid and gather the fields in a dense (fields x sids x ticks) 
+        block. After that, ``current`` for any number of assets is a 
+        single fancy-indexing on this block. ``history`` slices the
+        carrays directly from the current row position.
     '''
     
     def __init__(self, *args, **kwargs):
         self._name = kwargs.get("name",blueshift_run_get_name())
+        self._trading_calendar = kwargs.get("trading_calendar",None)
+        self._asset_finder = kwargs.get("asset_finder",None)
+        self._frequency = int(kwargs.get("frequency",1))
+        self._data_frequency = kwargs.get("data_frequency","1m").lower()
+        
+        if self._data_frequency not in ['1m','1d']:
+            raise UnsupportedFrequency(msg=self._data_frequency)
+        
+        self._reader = kwargs.get("reader",None)
+        if self._reader is None:
+            prefix = 'minute' if self._data_frequency == '1m' else 'daily'
+            root = kwargs.get("root",None) or blueshift_data_path()
+            schema = BcolzSchema(root, prefixes=[prefix])
+            self._reader = BColzReader(schema)
+        
+        self._fields = list(OHLCV_FIELDS)
+        self._field_idx = dict(zip(self._fields,range(len(self._fields))))
+        self._field_idx['last'] = self._field_idx['close']
+        self._volume_idx = self._field_idx['volume']
+        
+        # intraday tick offsets, same as the simulation clock
+        self._grid = None
+        self._intraday_nanos = np.zeros(1, dtype=np.int64)
+        if self._trading_calendar is not None:
+            self._grid = self._trading_calendar.minute_grid(
+                    self._frequency)
+            self._intraday_nanos = self._make_intraday_nanos()
+        
+        # open sids and their rows in the session block. The first
+        # tick column is for queries before the open of the session.
+        self._data = {}
+        self._rows = {}
+        self._block = np.full((len(self._fields), INITIAL_SID_CAPACITY,
+                               len(self._intraday_nanos)+1), np.nan)
+        
+        # the current clock state.
+        self._timestamp = None
+        self._session_idx = -1
+        self._session_nano = None
+        self._next_session_nano = None
+        self._bar_nanos = None
+        self._bar_secs = None
+        self._bar_idx = -1
+        self._last_updated = None
     
     @property
     def name(self):
@@ -112,22 +212,246 @@ class DBDataPortal(DataPortal):
     
     @property
     def tz(self):
-        raise NotImplementedError
+        return self._trading_calendar.tz
     
     @property
     def asset_finder(self):
-        raise NotImplementedError
+        return self._asset_finder
     
     @property
     def auth(self):
         return None
     
+    def _make_intraday_nanos(self):
+        '''
+            tick offsets from midnight, matching the simulation clock.
+        '''
+        if self._data_frequency == '1d':
+            return np.array([self._trading_calendar._close_nano], 
+                            dtype=np.int64)
+        return self._grid.offsets
+    
+    def set_timestamp(self, timestamp):
+        '''
+            Mark the current simulation time. This is called on every
+            tick, so we only store it here. The session roll and tick
+            index are resolved lazily on the next data request.
+        '''
+        self._timestamp = timestamp
+        
+    def _update_bar(self):
+        '''
+            Resolve the current timestamp to a session and the index of
+            the tick within the session.
+        '''
+        nano = self._timestamp
+        if nano is None:
+            raise MissingDataError(msg="data requested before algo start")
+        if nano == self._last_updated:
+            return
+        
+        if self._session_nano is None or nano < self._session_nano or\
+            nano >= self._next_session_nano:
+            self._roll_session(self._grid.session_index(nano))
+        
+        # column 0 of the session block is the pre-open tick
+        if self._data_frequency == '1d':
+            idx = int(nano >= self._bar_nanos[-1])
+        else:
+            idx = self._grid.bar_index(nano, self._session_idx) + 1
+        self._bar_idx = max(idx,0)
+        self._last_updated = nano
+        
+    def _roll_session(self, session_idx):
+        '''
+            Load the session block for all sids requested so far.
+        '''
+        sessions = self._grid.sessions
+        if session_idx < 0:
+            raise MissingDataError(msg="data requested before first session")
+        session_nano = int(sessions[session_idx])
+        self._session_idx = session_idx
+        self._session_nano = session_nano
+        if session_idx + 1 < len(sessions):
+            self._next_session_nano = int(sessions[session_idx+1])
+        else:
+            self._next_session_nano = np.iinfo(np.int64).max
+        self._bar_nanos = np.concatenate(
+                ([session_nano], session_nano + self._intraday_nanos))
+        # the pre-open tick must not see bars stamped at midnight
+        self._bar_secs = self._bar_nanos//NANO_SECOND
+        self._bar_secs[0] -= 1
+        
+        for sid, row in self._rows.items():
+            self._load_session(self._data[sid], row)
+            
+    def _load_session(self, data, row):
+        '''
+            Binary search the (compressed) timestamp carray for the rows
+            of the current session, and fill the session block row with
+            the values as of each tick. Price fields are carried forward
+            from the last available bar, volume is zero for ticks 
+            without a bar.
+        '''
+        secs = self._bar_secs
+        self._block[:,row,:] = np.nan
+        
+        if data.nrows == 0:
+            data.positions = np.full(len(secs), -1, dtype=np.int64)
+            return
+        
+        ts = data.ct[BColzReader.INDEX_NAME]
+        start, end = self._reader.search_range(ts, secs[0], secs[-1], 
+                                               lo=data.cursor)
+        # include the last row before the session to carry forward
+        lo = max(start - 1, 0)
+        
+        ts_block = data.read_timestamps(lo, end)
+        pos = np.searchsorted(ts_block, secs, side='right') - 1
+        data.offset = lo
+        data.positions = pos
+        data.cursor = lo
+        
+        valid = pos >= 0
+        if not valid.any():
+            return
+        
+        exact = np.zeros(len(secs), dtype=bool)
+        exact[valid] = ts_block[pos[valid]] == secs[valid]
+        
+        for i, field in enumerate(self._fields):
+            values = data.read(field, lo, end)
+            self._block[i,row,valid] = values[pos[valid]]
+            
+        self._block[self._volume_idx,row,~exact] = 0
+        
+    def _ensure_sids(self, assets):
+        '''
+            Return the block rows for the assets, opening the sids and
+            loading the current session for any first time request.
+        '''
+        rows = self._rows
+        for asset in assets:
+            sid = asset.sid
+            if sid in rows:
+                continue
+            
+            try:
+                ct, scale, no_scale_cols = self._reader.read_ctable(sid)
+                data = _SidData(self._reader, sid, ct, scale, no_scale_cols)
+            except MissingDataError:
+                data = _SidData(self._reader, sid)
+            
+            row = len(rows)
+            if row >= self._block.shape[1]:
+                # grow the block, doubling the capacity
+                block = np.full((self._block.shape[0], 2*row, 
+                                 self._block.shape[2]), np.nan)
+                block[:,:row,:] = self._block
+                self._block = block
+                
+            self._data[sid] = data
+            rows[sid] = row
+            if self._session_nano is not None:
+                self._load_session(data, row)
+        
+        return [rows[asset.sid] for asset in assets]
+    
     def current(self, assets, fields):
-        return 50
-        raise NotImplementedError
+        self._update_bar()
         
-    def history(self, assets, fields, bars, frequency):
-        raise NotImplementedError
+        single_asset = not listlike(assets)
+        single_field = not listlike(fields)
+        assets = [assets] if single_asset else list(assets)
+        fields = [fields] if single_field else list(fields)
+        
+        try:
+            fidx = [self._field_idx[f] for f in fields]
+        except KeyError as e:
+            raise MissingDataError(msg=f"unknown field {str(e)}")
+        
+        rows = self._ensure_sids(assets)
+        values = self._block[np.ix_(fidx, rows, [self._bar_idx])][:,:,0]
+        
+        if single_asset and single_field:
+            return values[0,0]
+        elif single_field:
+            return pd.Series(values[0], index=assets, name=fields[0])
+        elif single_asset:
+            return pd.Series(values[:,0], index=fields, name=assets[0])
+        return pd.DataFrame(values.T, index=assets, columns=fields)
+        
+    def _read_history(self, data, fields, nrows):
+        '''
+            read the last nrows till the current tick for a sid.
+        '''
+        end = 0
+        if data.positions is not None:
+            end = data.offset + data.positions[self._bar_idx] + 1
+        start = max(end - nrows, 0)
+        
+        if end <= start:
+            # no data (or a missing sid) till the current tick
+            out = {field:np.array([], dtype=np.float64) for field in fields}
+            idx = pd.DatetimeIndex([], tz=self.tz)
+            return pd.DataFrame(out, index=idx, columns=fields)
+        
+        idx = pd.to_datetime(data.read_timestamps(start, end)*NANO_SECOND)
+        idx = idx.tz_localize('Etc/UTC').tz_convert(self.tz)
+        out = {}
+        for field in fields:
+            name = 'close' if field == 'last' else field
+            out[field] = data.read(name, start, end)
+        
+        return pd.DataFrame(out, index=idx, columns=fields)
+    
+    def history(self, assets, fields, nbar, frequency):
+        self._update_bar()
+        
+        single_asset = not listlike(assets)
+        single_field = not listlike(fields)
+        assets = [assets] if single_asset else list(assets)
+        fields = [fields] if single_field else list(fields)
+        
+        for field in fields:
+            if field not in self._field_idx:
+                raise MissingDataError(msg=f"unknown field {field}")
+        
+        frequency = frequency.lower()
+        if frequency not in ['1m','1d']:
+            raise UnsupportedFrequency(msg=frequency)
+        if frequency == '1m' and self._data_frequency == '1d':
+            raise UnsupportedFrequency(msg=frequency)
+        
+        nbar = int(nbar)
+        resample = frequency == '1d' and self._data_frequency == '1m'
+        nrows = nbar*len(self._intraday_nanos) if resample else nbar
+        
+        self._ensure_sids(assets)
+        data = {}
+        for asset in assets:
+            df = self._read_history(self._data[asset.sid], fields, nrows)
+            if resample:
+                df = self._to_daily(df, fields)[-nbar:]
+            data[asset] = df
+        
+        if single_asset:
+            df = data[assets[0]]
+            return df[fields[0]] if single_field else df
+        elif single_field:
+            return pd.DataFrame({asset:data[asset][fields[0]] \
+                                 for asset in assets})
+        return pd.concat(data)
+    
+    @classmethod
+    def _to_daily(cls, df, fields):
+        '''
+            resample minute bars to daily bars.
+        '''
+        how = {'open':'first','high':'max','low':'min','close':'last',
+               'last':'last','volume':'sum'}
+        agg = {field:how[field] for field in fields}
+        return df.groupby(df.index.normalize()).agg(agg)
     
     def __str__(self):
         return "Blueshift Data Portal [name:%s]" % self.name
@@ -20,17 +20,25 @@ import pandas as pd
 import numpy as np
 from collections import namedtuple
 from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
 
 from blueshift.assets._assets import MktDataType
-from blueshift.utils.types import NANO_SECOND
+from blueshift.configs.defaults import blueshift_data_path
+from blueshift.data.interfaces.bcolzio import BcolzSchema, BColzWriter
+from blueshift.data.interfaces.utils import is_vectorized
+from blueshift.utils.exceptions import ValidationError
 
 '''
     Transformation defines a structure to apply a transformation column
     wise to input data. The `func` specifies the function to be applied,
     and the `arg_cols` list the name of the columns in the dataframe to
-    be used as input to this `func`.
+    be used as input to this `func`. If `vectorized` is True (or the
+    `func` is marked so), `func` gets the whole columns in a single
+    call, else it is applied element-wise.
 '''
-DataTransform = namedtuple('DataTransform',["func", "arg_cols"])
+DataTransform = namedtuple('DataTransform',["func", "arg_cols", 
+                                            "vectorized"], 
+                           defaults=[False])
 
 class Ingestor(ABC):
     '''
@@ -50,23 +58,23 @@ class Ingestor(ABC):
     
     @property
     def source(self):
-        self._source_root
+        return self._source_root
         
     @property
     def dest(self):
-        self._dest_root
+        return self._dest_root
         
     @property
     def source_type(self):
-        self._source_type
+        return self._source_type
         
     @property
     def dest_type(self):
-        self._dest_type
+        return self._dest_type
         
     @property
     def data_type(self):
-        self._data_type
+        return self._data_type
         
     @abstractmethod
     def ingest(self, *args, **kwargs):
@@ -88,6 +96,8 @@ class OHLCVCSVtoBColzIngestor(Ingestor):
         
         self._split_col = kwargs.pop("symbol_col","symbol")
         self._index_col = kwargs.pop("index_col",None)
+        # timezone of naive timestamps in the source, stored as UTC
+        self._tz = kwargs.pop("tz", None)
         self._ohlcva = ['open','high','low','close','volume','adj_ratio']
         
         for c in self._ohlcva:
@@ -98,6 +108,22 @@ class OHLCVCSVtoBColzIngestor(Ingestor):
         self._convert_dtypes = [np.float64, np.int32, np.int64]
         self.skip_scaling_cols = ["volume"]
         self._read_chunk = kwargs.pop("chunksize", 10000)
+        
+        # sid mapping, either a dict or looked up from the asset finder
+        self._sid_map = dict(kwargs.pop("sid_map", {}))
+        self._asset_finder = kwargs.pop("asset_finder", None)
+        
+        # rows buffered per sid before a write, and the write processes
+        self._flush_size = kwargs.pop("flush_size", 500000)
+        self._workers = kwargs.pop("workers", 1)
+        
+        self._dest_root = kwargs.pop("dest", None) or blueshift_data_path()
+        prefix = 'minute'
+        if str(self._frequency).lower() in ['1d','d','daily']:
+            prefix = 'daily'
+        self._schema = kwargs.pop("schema", None) or BcolzSchema(
+                self._dest_root, prefixes=[prefix])
+        self._cparams = kwargs.pop("cparams", {})
 
     def check_columns(self, df, cols):
         '''
@@ -118,25 +144,39 @@ class OHLCVCSVtoBColzIngestor(Ingestor):
     
     def transform_df(self, df):
         self.check_columns(df, self._expected_input_cols)
-        out_df = pd.DataFrame({})
+        out = {}
         for col in self._out_cols:
-            out_df[col] = self._apply_transformation(df, 
+            out[col] = self._apply_transformation(df, 
                   self._trans_dict[col])
-        return out_df
+        return pd.DataFrame(out, index=df.index, columns=self._out_cols)
+    
+    def _to_epoch_seconds(self, timestamps):
+        '''
+            Seconds since epoch (UTC) of the timestamps. Naive timestamps
+            are in the source timezone (UTC if not specified).
+        '''
+        timestamps = pd.to_datetime(timestamps)
+        if timestamps.dt.tz is None:
+            if self._tz:
+                timestamps = timestamps.dt.tz_localize(self._tz)
+            else:
+                timestamps = timestamps.dt.tz_localize('Etc/UTC')
+        
+        timestamps = timestamps.dt.tz_convert('Etc/UTC').dt.tz_localize(None)
+        return timestamps.values.astype('datetime64[s]').astype(np.int64)
     
     def integer_conversion(self, df):
         '''
             We convert all data to int32 for bcolz. Timestamps are converted
-            to nano and then to seconds since epoch and saved as int32. All
-            floats are multipleid by scale factor and saved as int32. If a
-            column is not convertable (like text) we leave it as is.
+            to UTC seconds since epoch and saved as int32. All floats are 
+            multipleid by scale factor and saved as int32. If a column is 
+            not convertable (like text) we leave it as is.
         '''
         scale_factor = self._scale_factor
         
         for c in df.columns:
             if c=='timestamp':
-                df.loc[:,c] = df[c].astype(np.int64)
-                df.loc[:,c] = (df[c]/NANO_SECOND).astype(np.int32)
+                df[c] = self._to_epoch_seconds(df[c]).astype(np.int32)
                 continue
             
             if df[c].dtype not in self._convert_dtypes:
@@ -147,18 +187,19 @@ class OHLCVCSVtoBColzIngestor(Ingestor):
             else:
                 scale_factor = self._scale_factor
             
-            df.loc[:,c] = (df[c]*scale_factor).astype(np.int32)
+            df[c] = (df[c]*scale_factor).astype(np.int32)
         return df
     
     def _generate_data(self, df):        
         df = self.transform_df(df)
         df = self.integer_conversion(df)
-        syms = set(df[self._split_col].tolist())
+        cols = [self._index_col, *self._ohlcva] if self._index_col \
+                    else self._ohlcva
+        self.check_columns(df, cols)
         
-        for sym in syms:
-            data = df.loc[df[self._split_col]==sym,:]
-            data = self.screen_columns(data, [self._index_col, 
-                                              *self._ohlcva])
+        # single pass split of the chunk by symbol
+        for sym, data in df.groupby(self._split_col, sort=False):
+            data = data[cols]
             if self._index_col:
                 data = data.set_index(self._index_col)
             yield sym, data, self._frequency
@@ -167,8 +208,16 @@ class OHLCVCSVtoBColzIngestor(Ingestor):
     def _apply_transformation(df, trans:DataTransform):
         args = []
         for a in trans.arg_cols:
-            args.append(df[a])
-        return np.vectorize(trans.func)(*args)
+            args.append(df[a].values)
+        
+        if trans.vectorized or is_vectorized(trans.func):
+            values = trans.func(*args)
+        else:
+            values = np.vectorize(trans.func)(*args)
+        
+        if np.ndim(values) == 0:
+            return np.full(len(df), values)
+        return np.asarray(values)
     
     def read_large_csv(self, source):
         chunks = pd.read_csv(source, chunksize=self._read_chunk)
@@ -178,9 +227,113 @@ class OHLCVCSVtoBColzIngestor(Ingestor):
                 yield sym, data, freq
                     
     def _get_sid(self, sym):
-        return 
+        '''
+            Map a symbol to its sid, from the supplied map if any, else
+            from the asset finder. Results are cached.
+        '''
+        try:
+            return self._sid_map[sym]
+        except KeyError:
+            pass
+        
+        if self._asset_finder is None:
+            raise ValueError(f"no sid mapping for symbol {sym}")
+            
+        sid = self._asset_finder.lookup_symbol(sym).sid
+        self._sid_map[sym] = sid
+        return sid
+    
+    def _writer_args(self):
+        cols = [c for c in self._ohlcva if c != self._index_col]
+        meta_data = {BColzWriter.SCALE_KEY: self._scale_factor,
+                     BColzWriter.NOSCALE_KEY: list(self.skip_scaling_cols)}
+        return (len(cols), cols, meta_data), {"schema":self._schema,
+                                              "cparams":self._cparams}
                 
-    def ingest(self, *args, **kwargs):
-        pass
+    def ingest(self, source, *args, **kwargs):
+        '''
+            Ingest one or more csv files. Each chunk is split by symbol
+            and the pieces are buffered per sid. A sid is written once
+            its buffer reaches ``flush_size`` rows, and all buffers are
+            flushed at the end. With more than one worker, the writes 
+            are fanned out to a process pool. Different sids write to
+            different directories, so they can go in parallel, but a 
+            new batch for a sid waits for the previous one to finish
+            to keep the appends in order. Returns the rows appended by
+            sid (rows already in the store are skipped).
+            
+            The input must be sorted by time for each symbol. Rows are
+            sorted within a batch, but the store is append only, so a 
+            batch can not go before the one already written for the 
+            sid. Such input raises ValidationError, unless it fits in 
+            a single batch (``flush_size``).
+        '''
+        sources = [source] if isinstance(source, str) else list(source)
+        self._source_root = sources
+        writer_args, writer_kwargs = self._writer_args()
+        
+        buffers = {}
+        counts = {}
+        pending = {}
+        written = {}
+        last = {}
+        pool = None
+        if self._workers > 1:
+            pool = ProcessPoolExecutor(max_workers=self._workers)
+        
+        def collect(sid, rows):
+            written[sid] = written.get(sid, 0) + rows
+        
+        def flush(sid):
+            data = pd.concat(buffers.pop(sid))
+            data = data.sort_index(kind='mergesort')
+            counts.pop(sid)
+            
+            if self._index_col and len(data) > 0:
+                if sid in last and data.index[0] <= last[sid]:
+                    msg = f"input for sid {sid} is not sorted by time,"
+                    msg = msg + " rows would be dropped."
+                    raise ValidationError(msg=msg)
+                last[sid] = data.index[-1]
+            
+            if pool is None:
+                collect(sid, _write_sid_data(writer_args, writer_kwargs, 
+                                             sid, data))
+                return
+            
+            if sid in pending:
+                collect(sid, pending.pop(sid).result())
+            pending[sid] = pool.submit(_write_sid_data, writer_args,
+                                       writer_kwargs, sid, data)
+        
+        try:
+            for src in sources:
+                for chunk in pd.read_csv(src, chunksize=self._read_chunk):
+                    for sym, data, _ in self._generate_data(chunk):
+                        sid = self._get_sid(sym)
+                        buffers.setdefault(sid, []).append(data)
+                        counts[sid] = counts.get(sid, 0) + len(data)
+                        if counts[sid] >= self._flush_size:
+                            flush(sid)
+            
+            for sid in list(buffers.keys()):
+                flush(sid)
+            
+            for sid in list(pending.keys()):
+                collect(sid, pending.pop(sid).result())
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=True)
+        
+        return written
+    
+    
+def _write_sid_data(writer_args, writer_kwargs, sid, data):
+    '''
+        Write a batch of data for a sid. This runs in a worker process
+        for parallel ingestion, so the writer is created here.
+    '''
+    writer = BColzWriter(*writer_args, **writer_kwargs)
+    return writer.write_dataframe(sid, data)
 
 
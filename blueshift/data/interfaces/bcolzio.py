@@ -18,14 +18,16 @@ Created on Thu Dec  6 09:50:26 2018
 """
 
 from os import path as os_path
+from bisect import bisect_left, bisect_right
 import numpy as np
 import pandas as pd
+from hashlib import md5
 import bcolz
 
 
 from blueshift.configs.defaults import ensure_directory
 from blueshift.data.interfaces.interface import DataWriter, DataReader
-from blueshift.data.interfaces.utils import dataframe_hash
+from blueshift.utils.exceptions import MissingDataError
 from blueshift.utils.types import NANO_SECOND
 
 '''
@@ -74,10 +76,19 @@ class BColzWriter(DataWriter):
     '''
         serialize data to bcolz. Data must be in the form of dataframe
         (or convertible to such) and integer (signed 32).
+        
+        In incremental mode (the default), only rows strictly newer than
+        the last stored timestamp are appended, so re-ingesting an
+        overlapping file is safe. An md5 checksum is kept for every
+        block of ``CHECKSUM_BLOCK`` rows in the ctable attributes. An 
+        append only rehashes the last (partial) block onwards.
     '''
     INDEX_NAME = 'timestamp'
     SCALE_KEY = 'scaling'
     NOSCALE_KEY = 'noscale'
+    HASH_KEY = 'hash'
+    CHECKSUMS_KEY = 'checksums'
+    CHECKSUM_BLOCK = 65536
     
     def __init__(self, ncols, names, meta_data={}, *args, **kwargs):
         self._type = 'BColz'
@@ -86,6 +97,7 @@ class BColzWriter(DataWriter):
         self._meta_data = meta_data
         self._cparams = kwargs.pop("cparams", bcolz.cparams())
         self._schema = kwargs.pop("schema", None)
+        self._incremental = kwargs.pop("incremental", True)
         
         if not isinstance(self._schema, BcolzSchema):
             raise ValueError("Illegal or no schema supplied.")
@@ -104,7 +116,7 @@ class BColzWriter(DataWriter):
         columns = [np.empty(0, np.int32)]*ncols
         
         ct = bcolz.ctable(rootdir = sid_path, columns = columns, 
-                          names=colnames, 
+                          names=colnames, cparams=self._cparams,
                           expectedlen=self._schema._expectedlen, mode='w')
         
         for key in self._meta_data:
@@ -121,25 +133,87 @@ class BColzWriter(DataWriter):
             
     def _update_meta_data(self, sid, meta_data):
         ct = self._ensure_ctable(sid)
-        for key in self._meta_data:
-            ct.attr[key] = self._meta_data[key]
+        for key in meta_data:
+            ct.attrs[key] = meta_data[key]
         ct.flush()
         
+    @classmethod
+    def _index_to_seconds(cls, index):
+        index = np.asarray(index)
+        if np.issubdtype(index.dtype, np.datetime64):
+            index = index.astype('datetime64[s]').astype(np.int64)
+        return index.astype(np.int32)
+        
     def write_dataframe(self, sid, df):
+        '''
+            Append the dataframe to the sid. Returns the number of rows
+            actually appended.
+        '''
         ct = self._ensure_ctable(sid)
-        current_hash = dataframe_hash(df)
-        try:
-            last_hash = ct.attrs['hash']
-            if current_hash  == last_hash:
-                return
-        except KeyError:
-            pass
-        dts = df.index
-        cols = [dts]+[df[name] for name in self._colnames]
-
+        dts = self._index_to_seconds(df.index)
+        nrows = len(ct)
+        
+        if self._incremental and nrows > 0:
+            last = ct[self.INDEX_NAME][nrows-1]
+            mask = dts > last
+            if not mask.any():
+                return 0
+            df = df.loc[mask]
+            dts = dts[mask]
+        
+        if len(df) == 0:
+            return 0
+        
+        cols = [dts]+[df[name].values for name in self._colnames]
         ct.append(cols)
-        ct.attrs['hash'] = current_hash
+        self._update_checksums(ct, nrows)
         ct.flush()
+        return len(df)
+        
+    def _block_checksum(self, ct, block):
+        start = block*self.CHECKSUM_BLOCK
+        rows = ct[start:start+self.CHECKSUM_BLOCK]
+        return md5(rows.tobytes()).hexdigest()
+    
+    def _update_checksums(self, ct, from_row):
+        '''
+            Rehash the blocks starting from the one containing the row
+            ``from_row``. Blocks before that are unchanged by an append.
+        '''
+        first = from_row//self.CHECKSUM_BLOCK
+        nblocks = -(-len(ct)//self.CHECKSUM_BLOCK)
+        try:
+            checksums = list(ct.attrs[self.CHECKSUMS_KEY])[:first]
+        except KeyError:
+            checksums = []
+            
+        for block in range(len(checksums), nblocks):
+            checksums.append(self._block_checksum(ct, block))
+            
+        ct.attrs[self.CHECKSUMS_KEY] = checksums
+        ct.attrs[self.HASH_KEY] = md5(''.join(checksums).encode()).\
+                                        hexdigest()
+        
+    def verify(self, sid):
+        '''
+            Recompute the block checksums for a sid and return the list
+            of blocks that do not match the stored ones (empty if the 
+            data is intact).
+        '''
+        sid_path = self._schema.map_sid_to_path(sid)
+        if not os_path.exists(sid_path):
+            raise MissingDataError(msg=f"{sid} could not be found.")
+        ct = bcolz.ctable(rootdir=sid_path, mode='r')
+        
+        try:
+            stored = list(ct.attrs[self.CHECKSUMS_KEY])
+        except KeyError:
+            stored = []
+        nblocks = -(-len(ct)//self.CHECKSUM_BLOCK)
+        stored = stored + [None]*(nblocks - len(stored))
+        
+        return [block for block in range(nblocks) if \
+                self._block_checksum(ct, block) != stored[block]]
         
 class BColzReader(DataReader):
     '''
@@ -154,41 +228,138 @@ class BColzReader(DataReader):
         self._type = 'BColz'
         self._schema = schema
         
-    def read_dataframe(self, sid):
+    def read_ctable(self, sid):
+        '''
+            Open the ctable for a sid in read mode and return it along
+            with the scaling factor and the list of unscaled columns.
+            Nothing is decompressed here, the carrays stay on disk.
+        '''
         sid_path = self._schema.map_sid_to_path(sid)
+        if not os_path.exists(sid_path):
+            raise MissingDataError(msg=f"{sid} could not be found.")
+        
+        ct = bcolz.ctable(rootdir=sid_path, mode='r')
         try:
-            ct = bcolz.ctable(rootdir=sid_path)
             scale = ct.attrs[self.SCALE_KEY]
-            try:
-                no_scale_cols = ct.attrs[self.NOSCALE_KEY]
-            except KeyError:
-                no_scale_cols = None
-            return self._to_dataframe(ct, scale, no_scale_cols)
-        except:
-            ValueError(f"{sid} could not be found.")
+        except KeyError:
+            scale = 1
+        try:
+            no_scale_cols = ct.attrs[self.NOSCALE_KEY]
+        except KeyError:
+            no_scale_cols = []
+            
+        return ct, scale, no_scale_cols
+        
+    def search_range(self, timestamps, start_dt=None, end_dt=None, 
+                     nbars=None, lo=0):
+        '''
+            Binary search the (compressed) timestamp carray for the rows
+            between ``start_dt`` and ``end_dt`` (both inclusive). Only 
+            the chunks we probe are decompressed. If ``nbars`` is given 
+            the range is restricted to the last ``nbars`` rows. Returns 
+            the [start, end) row positions.
+        '''
+        n = len(timestamps)
+        start = lo
+        if start_dt is not None:
+            start = bisect_left(timestamps, self._to_seconds(start_dt), 
+                                lo, n)
+        end = n
+        if end_dt is not None:
+            end = bisect_right(timestamps, self._to_seconds(end_dt), 
+                               start, n)
+        if nbars is not None:
+            start = max(start, end - int(nbars))
             
-    def _to_dataframe(self, ct, scale, no_scale_cols=None):
-        df = ct.todataframe()
-        df[self.INDEX_NAME] = pd.to_datetime(df[self.INDEX_NAME].\
-                                  astype(np.int64)*NANO_SECOND)
+        return start, end
+    
+    def read_range(self, sid, fields=None, start_dt=None, end_dt=None,
+                   nbars=None):
+        '''
+            Read the requested fields for a date range (or the last 
+            ``nbars``). Returns the timestamps (seconds since epoch) and
+            a dict of ``ScaledArray`` keyed by field names. Only the 
+            carrays for the fields are touched.
+        '''
+        ct, scale, no_scale_cols = self.read_ctable(sid)
+        if fields is None:
+            fields = [name for name in ct.names if name != self.INDEX_NAME]
         
-        df = df.set_index(self.INDEX_NAME)
+        timestamps = ct[self.INDEX_NAME]
+        start, end = self.search_range(timestamps, start_dt, end_dt, 
+                                       nbars)
+        index = timestamps[start:end].astype(np.int64)
+        data = {field:self._read_field(ct, field, start, end, scale,
+                                       no_scale_cols) for field in fields}
         
-        names = ct.names.copy()
-        names.remove(self.INDEX_NAME)
+        return index, data
         
-        for col in names:
-            if no_scale_cols:
-                if col in no_scale_cols:
-                    continue
-            df[col] = df[col]/scale
-            
-        return df
+    def read_dataframe(self, sid, fields=None, start_dt=None, end_dt=None,
+                       nbars=None):
+        index, data = self.read_range(sid, fields, start_dt, end_dt, nbars)
+        index = pd.to_datetime(index*NANO_SECOND)
+        index.name = self.INDEX_NAME
         
-    def _read_field(self, sid, field):
-        sid_path = self._schema.map_sid_to_path(sid)
-        ts_path = os_path.join(sid_path, self.INDEX_NAME)
-        f_path = os_path.join(sid_path, field)
+        return pd.DataFrame({field:data[field].values for field in data},
+                            index=index, columns=list(data.keys()))
+    
+    @classmethod
+    def _to_seconds(cls, dt):
+        if isinstance(dt, pd.Timestamp):
+            return dt.value//NANO_SECOND
+        return int(dt)
+    
+    def _read_field(self, ct, field, start=0, end=None, scale=1, 
+                    no_scale_cols=[]):
+        '''
+            Slice a single column. The int32 data is returned as is, 
+            wrapped along with the scale to convert on access.
+        '''
+        try:
+            raw = ct[field][start:end]
+        except KeyError:
+            raise MissingDataError(msg=f"no column named {field}.")
         
+        if field in no_scale_cols:
+            return ScaledArray(raw, 1)
+        return ScaledArray(raw, scale)
+    
+    
+class ScaledArray(object):
+    '''
+        Integer data read from a carray along with its scaling factor. 
+        The conversion to float happens only when the values are asked 
+        for, and only for the part asked.
+    '''
+    __slots__ = ['raw', 'scale']
+    
+    def __init__(self, raw, scale=1):
+        self.raw = raw
+        self.scale = scale
         
-        
\ No newline at end of file
+    def __len__(self):
+        return len(self.raw)
+    
+    def __getitem__(self, key):
+        return self._convert(self.raw[key])
+    
+    def __array__(self, dtype=None, copy=None):
+        values = self.values
+        if dtype is not None:
+            return values.astype(dtype)
+        return values
+    
+    @property
+    def values(self):
+        return self._convert(self.raw)
+    
+    def _convert(self, raw):
+        if self.scale == 1:
+            return np.asarray(raw, dtype=np.float64)
+        return raw/self.scale
+    
+    def __str__(self):
+        return f"ScaledArray(len={len(self.raw)}, scale={self.scale})"
+    
+    def __repr__(self):
+        return self.__str__()
@@ -17,24 +17,53 @@ Created on Thu Dec  6 09:20:52 2018
 @author: prodipta
 """
 import pandas as pd
+import numpy as np
 from hashlib import md5
 
-def merge_date_time(x:pd.Timestamp,y:pd.Timestamp):
+def vectorized(func):
+    '''
+        Mark a function as column vectorized, i.e. it takes whole
+        columns (series or arrays) as arguments and returns an array
+        (or a scalar to broadcast). Transformations not marked so are 
+        applied element-wise.
+    '''
+    func.vectorized = True
+    return func
+
+def is_vectorized(func):
+    return getattr(func, "vectorized", False)
+
+@vectorized
+def merge_date_time(x, y):
     '''
         This function takes in a date part (as naive timestamp) and a 
         time part (as Timestamp to today's date), and return a combined 
-        timestamp.
+        timestamp. Works on scalars as well as whole columns.
     '''
-    x = pd.Timestamp(x)
-    y = pd.Timestamp(y)
-    return pd.Timestamp(x.value + y.value - y.normalize().value)
+    if np.ndim(x) == 0 and np.ndim(y) == 0:
+        x = pd.Timestamp(x)
+        y = pd.Timestamp(y)
+        return pd.Timestamp(x.value + y.value - y.normalize().value)
+    
+    x = np.asarray(pd.to_datetime(np.asarray(x)), dtype='datetime64[ns]')
+    try:
+        # time part as plain time strings
+        offset = np.asarray(pd.to_timedelta(np.asarray(y)), 
+                            dtype='timedelta64[ns]')
+    except (ValueError, TypeError):
+        y = np.asarray(pd.to_datetime(np.asarray(y)), 
+                       dtype='datetime64[ns]')
+        offset = y - y.astype('datetime64[D]')
+    return x + offset
 
-def one():
+@vectorized
+def one(*args):
     '''
         This function returns a constant value.
     '''
     return 1
 
+@vectorized
 def no_change(value):
     '''
         A function to return a value unchanged.
@@ -29,9 +29,11 @@ cdef class TradingClock(object):
     cdef readonly np.int64_t before_trading_start_nano
     cdef readonly np.int64_t after_trading_hours_nano
     cdef readonly np.int64_t[:] intraday_nanos
+    cdef readonly object minute_grid
     cdef readonly generate_intraday_nanos(self)
     
 cdef class SimulationClock(TradingClock):
     cdef readonly np.int64_t start_nano
     cdef readonly np.int64_t end_nano
-    cdef readonly np.int64_t[:] session_nanos
\ No newline at end of file
+    cdef readonly np.int64_t[:] session_nanos
+    cpdef tuple to_arrays(self)
\ No newline at end of file
@@ -59,16 +59,10 @@ cdef class TradingClock(object):
         raise StopIteration
         
     cdef generate_intraday_nanos(self):
-        cdef int n
-        cdef np.int64_t period
-        
-        n= int((self.close_nano - self.open_nano)/NANO_SECOND/60/self.emit_frequency)
-        
-        period = self.emit_frequency*60*NANO_SECOND
-        self.intraday_nanos = np.asarray([self.open_nano + 
-                                          i*period for i in range(n+1)])
-        if self.intraday_nanos[-1] >= self.close_nano:
-            self.intraday_nanos = self.intraday_nanos[:-1]
+        # the bar offsets are shared with the calendar minute grid
+        self.minute_grid = self.trading_calendar.minute_grid(
+                self.emit_frequency)
+        self.intraday_nanos = self.minute_grid.offsets
         
 cdef class SimulationClock(TradingClock):
     
@@ -80,8 +74,8 @@ cdef class SimulationClock(TradingClock):
              emit_frequency)
         self.start_nano = start_dt.value
         self.end_nano = end_dt.value
-        sessions = trading_calendar.sessions(start_dt, end_dt)
-        self.session_nanos = np.asarray([s.value for s in sessions])
+        idx1, idx2 = trading_calendar.session_range(start_dt, end_dt)
+        self.session_nanos = self.minute_grid.sessions[idx1:idx2]
         
     def __iter__(self):
         yield self.session_nanos[0], ALGO_START
@@ -97,6 +91,29 @@ cdef class SimulationClock(TradingClock):
         
         yield t, ALGO_END
         
+    cpdef tuple to_arrays(self):
+        '''
+            Materialize the full event stream as a contiguous array of
+            nanos (int64) and an array of bar types (uint8), in the same
+            order as iterating the clock.
+        '''
+        sessions = np.asarray(self.session_nanos, dtype=np.int64)
+        intraday = np.asarray(self.intraday_nanos, dtype=np.int64)
+        
+        offsets = np.concatenate(([self.before_trading_start_nano], 
+                                  intraday, 
+                                  [self.after_trading_hours_nano]))
+        session_bars = np.full(len(offsets), TRADING_BAR, dtype=np.uint8)
+        session_bars[0] = BEFORE_TRADING_START
+        session_bars[-1] = AFTER_TRADING_HOURS
+        
+        grid = (sessions[:,None] + offsets[None,:]).ravel()
+        nanos = np.concatenate(([sessions[0]], grid, [grid[-1]]))
+        bars = np.concatenate(([ALGO_START], 
+                               np.tile(session_bars, len(sessions)),
+                               [ALGO_END])).astype(np.uint8)
+        
+        return nanos, bars
         
     def __str__(self):
         tz = self.trading_calendar.tz
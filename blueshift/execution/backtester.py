@@ -18,9 +18,13 @@ Created on Sat Oct  6 12:54:09 2018
 """
 
 from enum import Enum
+import numpy as np
+import pandas as pd
 
 from blueshift.execution.broker import AbstractBrokerAPI
 from blueshift.execution._clock import BARS
+from blueshift.execution.models import (ExecutionModel, BarDataExecution,
+                                        group_cumsum)
 from blueshift.trades._order import Order
 from blueshift.trades._position import Position
 from blueshift.trades._trade import Trade
@@ -29,6 +33,7 @@ from blueshift.trades._order_types import (OrderUpdateType,
                                            OrderSide)
 from blueshift.utils.calendars.trading_calendar import TradingCalendar
 from blueshift.blotter._accounts import BacktestAccount
+from blueshift.blotter.position_book import PositionBook
 from blueshift.assets._assets import InstrumentType
 from blueshift.utils.exceptions import (InsufficientFund, 
                                         BrokerAPIError,
@@ -38,8 +43,6 @@ from blueshift.utils.cutils import check_input
 from blueshift.utils.decorators import blueprint
 from blueshift.utils.types import BrokerType, MODE
 
-import random
-
 class ResponseType(Enum):
     '''
         Enum for response from a broker (usually a rest broker)
@@ -64,6 +67,9 @@ class APICommand(Enum):
     LOGIN = 11
     LOGOUT = 12
     
+# avoid the enum attribute lookup on every response
+_SUCCESS = ResponseType.SUCCESS.value
+    
 MarginDict = {
     InstrumentType.SPOT:0.1,
     InstrumentType.FUTURES:0.1,
@@ -82,7 +88,8 @@ class BackTester(object):
     '''
     
     def __init__(self, name, calendar, initial_capital, 
-                 currency = 'local'):
+                 currency = 'local', data_portal=None, 
+                 execution_model=None, mark_to_market=True):
         self.timestamp = None
         self.broker_name = name
         self.authentication_token = -1
@@ -95,6 +102,14 @@ class BackTester(object):
         self._account = BacktestAccount(name,initial_capital, 
                                         currency=currency)
         self._profile = {"name":"blueshift"}
+        self._data_portal = data_portal
+        self._execution_model = None
+        self.set_execution_model(execution_model or BarDataExecution())
+        # the account exposures are set from the position book, which
+        # is updated per traded position, with a full reconcile end of
+        # day. Optionally revalue the book every bar from the data portal.
+        self._mark_to_market = mark_to_market
+        self._book = PositionBook()
         self.tid = 0
         self.dispath_dict = {}
         self.make_dispath_dict()
@@ -150,6 +165,20 @@ class BackTester(object):
     def after_trading_hours(self, timestamp):
         self.timestamp = timestamp
         self._open_orders = {}
+        # revalue from the data portal, the last trading bar may be
+        # long past (or skipped) in the sparse mode.
+        if self._data_portal is not None:
+            self._book.revalue(self._data_portal)
+        self._book.mark_positions(self._open_positions)
+        self.reconcile()
+        
+    def reconcile(self):
+        '''
+            Full revaluation of the account from the open positions.
+        '''
+        self._account.update_account(self._account.cash, 
+                                     self._account.margin,
+                                     self._open_positions)
     
     def heart_beat(self, timestamp):
         self.timestamp = timestamp
@@ -158,6 +187,9 @@ class BackTester(object):
     def trading_bar(self, timestamp):
         self.timestamp = timestamp
         self.execute_orders(timestamp)
+        if self._mark_to_market and self._data_portal is not None:
+            self._account.mark_to_market(
+                    *self._book.revalue(self._data_portal))
     
     def no_op(self, *args, **kwargs):
         return self.make_response(ResponseType.SUCCESS,
@@ -200,6 +232,7 @@ class BackTester(object):
         '''
             This process will always succeed for backtester 
         '''
+        self._book.mark_positions(self._open_positions)
         return self.make_response(ResponseType.SUCCESS, 
                                   self._open_positions)
         
@@ -300,109 +333,174 @@ class BackTester(object):
             return self.make_response(ResponseType.ERROR,
                                           "order not found")
         
-    def execution_model(self, order):
-        price = random.randint(20,25)
+    @property
+    def execution_model(self):
+        return self._execution_model
+    
+    def set_execution_model(self, model):
+        if not isinstance(model, ExecutionModel):
+            raise BrokerAPIError(msg="not a valid execution model")
+        self._execution_model = model
         
-        traded = round(random.randint(100,500))
-        return price, traded
+    def set_data_portal(self, data_portal):
+        self._data_portal = data_portal
         
     def execute_orders(self, timestamp):
-        order_ids = list(self._open_orders.keys())
-        for order_id in order_ids:
-            order = self._open_orders[order_id]
-            # obtain the traded quantity and price
-            price, traded = self.execution_model(order)
-            # ignore if traded is 0. Note traded is without sign
-            # the order remains open for next exec opportunity
-            if traded == 0:
-                continue
-            
-            # check if quantity traded is valid
-            if order.quantity - order.filled <  traded:
-                traded = order.quantity - order.filled
-            
-            # compute the cash and margins required
-            margin, cash_flow = self.compute_margin_cashflow(
-                    order.asset,price, traded, order.side)
-            commission = self.compute_commission(price, traded)
-            cash_flow = cash_flow - commission
-            
-            # create the trade object
-            self.tid = self.tid+1
-            t = Trade(self.tid, traded, order.side, order_id, 
-                      order_id, order_id, -1,  # dummy instrument ID
-                      order.asset,order.product_type, price, 
-                      cash_flow, margin,commission,timestamp, 
-                      timestamp)
+        '''
+            Match all open orders against the current bar in a batch.
+            The fills, cash flows and margins are computed as arrays, 
+            the orders and positions are updated in a single pass and 
+            the account is settled and revalued once for the bar.
+        '''
+        if not self._open_orders:
+            return
+        
+        if not isinstance(timestamp, pd.Timestamp):
+            # the clock may send nanos for trading bars
+            timestamp = pd.Timestamp(timestamp, tz=self.calendar.tz)
+        
+        if self._data_portal is None:
+            raise BrokerAPIError(msg="no data portal to execute orders")
             
-            # try settling the trade with account
-            try:
-                self._account.settle_trade(t)
-            except InsufficientFund:
+        orders = list(self._open_orders.values())
+        # fills for all open orders against the current bar
+        prices, fills, commissions = self._execution_model.execute(
+                orders, self._data_portal)
+        
+        # ignore if traded is 0. Note traded is without sign
+        # the order remains open for next exec opportunity
+        remaining = np.fromiter((o.quantity - o.filled for o in orders),
+                                dtype=np.float64, count=len(orders))
+        fills = np.floor(np.minimum(fills, remaining))
+        idx = np.flatnonzero(fills > 0)
+        if len(idx) == 0:
+            return
+        
+        orders = [orders[i] for i in idx]
+        prices = prices[idx]
+        fills = fills[idx]
+        commissions = commissions[idx]
+        
+        margins, cash_flows = self.compute_margin_cashflow(
+                orders, prices, fills)
+        accepted = self._check_funds(cash_flows + margins + commissions)
+        
+        while not accepted.all():
+            for i in np.flatnonzero(~accepted):
+                order_id = orders[i].oid
                 self._open_orders[order_id].update(OrderUpdateType.\
                                  REJECT,{"reason":"insufficient fund"})
                 self._closed_orders[order_id] = self._open_orders.\
                                                 pop(order_id)
-                continue
+            keep = np.flatnonzero(accepted)
+            orders = [orders[i] for i in keep]
+            prices = prices[keep]
+            fills = fills[keep]
+            commissions = commissions[keep]
+            if not orders:
+                return
+            # the rejected fills change the exposure (and so the margins)
+            # for later orders, check again till none is rejected.
+            margins, cash_flows = self.compute_margin_cashflow(
+                    orders, prices, fills)
+            accepted = self._check_funds(cash_flows + margins + 
+                                         commissions)
+        
+        # settle the account for all trades together
+        self._account.settle_trades(float(cash_flows.sum()), 
+                                    float(margins.sum()), 
+                                    float(commissions.sum()))
+        
+        for i, order in enumerate(orders):
+            order_id = order.oid
+            margin = float(margins[i])
+            # create the trade object
+            self.tid = self.tid+1
+            t = Trade(self.tid, int(fills[i]), order.side, order_id, 
+                      order_id, order_id, -1,  # dummy instrument ID
+                      order.asset,order.product_type, float(prices[i]), 
+                      float(cash_flows[i]), margin, 
+                      float(commissions[i]), timestamp, timestamp)
             
             # update the order in the order book and see if done
-            self._open_orders[order_id].update(OrderUpdateType.\
-                             EXECUTION,t)
-            
-            #TODO: optimize the pop?
-            if self._open_orders[order_id].status == OrderStatus.\
-                    COMPLETE:
+            order.update(OrderUpdateType.EXECUTION,t)
+            if order.status == OrderStatus.COMPLETE:
                 self._closed_orders[order_id] = self._open_orders.\
                                                 pop(order_id)
             
             # update the position book
-            if t.asset in self._open_positions:
-                self._open_positions[t.asset].update(t, margin)
-                #TODO: optimize the pop?
-                if self._open_positions[t.asset].if_closed():
+            position = self._open_positions.get(t.asset, None)
+            if position is not None:
+                position.update(t, margin)
+                if position.if_closed():
                     self._closed_positions.append(self._open_positions.\
                                                   pop(t.asset))
             else:
-                p = Position.from_trade(t, margin)
-                self._open_positions[t.asset] = p
-                
-            # finally update the account metrics
-            cash = self._account.cash + cash_flow
-            margin = self._account.margin + margin
-            self._account.update_account(cash, margin,
-                                         self._open_positions)
-    
-    def compute_margin_cashflow(self, asset, price, traded, side):
-        instrument_type = asset.instrument_type
-        pct_margin = MarginDict[instrument_type]
-        
-        if side == OrderSide.BUY:
-            traded_qty = traded
-        else:
-            traded_qty = - traded
-        current_exposure = 0
-        new_exposure = traded_qty*price
-        
-        current_pos = self._open_positions.get(asset, None)
-        if current_pos:
-            current_exposure = current_pos.quantity*price
+                position = Position.from_trade(t, margin)
+                self._open_positions[t.asset] = position
             
-        square_off = abs(current_exposure) - \
-                         abs(current_exposure+new_exposure)
+            self._book.update(position)
                 
-        if instrument_type == InstrumentType.SPOT:
-            pass
-                
-        else:
-            # for non cash, no price cash flows, only margins
-            margin = -pct_margin*square_off
-            cash_flow = 0
-                
-        return margin, cash_flow
+        # finally update the account metrics from the book totals
+        self._account.mark_to_market(*self._book.totals())
+        
+    def _check_funds(self, required):
+        '''
+            Accept the fills in order as long as the running cash can 
+            fund them, skipping (rejecting) the ones that can not.
+        '''
+        cash = self._account.cash
+        if np.cumsum(required).max() <= cash:
+            return np.ones(len(required), dtype=bool)
+        
+        accepted = np.zeros(len(required), dtype=bool)
+        for i, amount in enumerate(required):
+            if amount <= cash:
+                accepted[i] = True
+                cash = cash - amount
+        return accepted
+    
+    def compute_margin_cashflow(self, orders, prices, traded):
+        '''
+            Margins and cash flows for a batch of fills, accounting for
+            the change in exposure from the earlier fills on the same 
+            asset. Cash instruments pay the full traded value, others
+            only block (or release) margin on the change in exposure.
+        '''
+        assets = [order.asset for order in orders]
+        unique = list(dict.fromkeys(assets))
+        asset_pos = {asset:i for i, asset in enumerate(unique)}
+        asset_idx = np.fromiter((asset_pos[asset] for asset in assets),
+                                dtype=np.int64, count=len(assets))
+        
+        base = np.zeros(len(unique))
+        for i, asset in enumerate(unique):
+            position = self._open_positions.get(asset, None)
+            if position is not None:
+                base[i] = position.quantity
+        
+        sides = np.fromiter((order.side for order in orders), 
+                            dtype=np.int64, count=len(orders))
+        signed = np.where(sides == OrderSide.BUY, traded, -traded)
+        qty_before = base[asset_idx] + group_cumsum(asset_idx, signed)\
+                        - signed
+        
+        current_exposure = qty_before*prices
+        new_exposure = signed*prices
+        square_off = np.abs(current_exposure) - \
+                        np.abs(current_exposure+new_exposure)
+        
+        instrument_types = [asset.instrument_type for asset in assets]
+        pct_margin = np.array([MarginDict[i] for i in instrument_types])
+        is_spot = np.array([i == InstrumentType.SPOT for i in \
+                            instrument_types], dtype=bool)
+        
+        # for non cash, no price cash flows, only margins
+        margins = np.where(is_spot, 0, -pct_margin*square_off)
+        cash_flows = np.where(is_spot, new_exposure, 0)
+        
+        return margins, cash_flows
                 
-    def compute_commission(self, price, traded):
-        return 0
-    
     def _api(self):
         while True:
             order = yield               # recieve the api call
@@ -443,15 +541,21 @@ class BackTesterAPI(AbstractBrokerAPI):
         self._mode_supports = [MODE.BACKTEST]
         
         api = kwargs.get("broker",None)
+        data_portal = kwargs.get("data_portal",None)
+        execution_model = kwargs.get("execution_model",None)
+        mark_to_market = kwargs.get("mark_to_market",True)
+        # in-process calls skip the generator protocol by default
+        self._direct_call = kwargs.get("direct_call",True)
         
-        if api:
-            if isinstance(api, BackTester):
-                self._api = api
-            else:
-                self._api = BackTester(name, calendar, 
-                                         initial_capital)
+        if isinstance(api, BackTester):
+            self._api = api
+            if data_portal is not None:
+                self._api.set_data_portal(data_portal)
         else:
-            self._api = BackTester(name, calendar, initial_capital)
+            self._api = BackTester(name, calendar, initial_capital,
+                                   data_portal=data_portal,
+                                   execution_model=execution_model,
+                                   mark_to_market=mark_to_market)
         
         self._trading_calendar = calendar
         self.initial_capital = initial_capital
@@ -468,23 +572,30 @@ class BackTesterAPI(AbstractBrokerAPI):
     def make_api_payload(self, command, data):
         return {"cmd":command, "payload":data}
     
+    def _call(self, command, data):
+        '''
+            Route an API call to the backtester. In direct mode the 
+            handler is looked up and invoked in-process, else the call 
+            is sent as a payload through the generator protocol.
+        '''
+        if self._direct_call:
+            return self._api.dispath_dict.get(command, 
+                                              self._api.default_op)(data)
+        return self._api.send(self.make_api_payload(command, data))
+    
     def process_response(self, response):
-        if response['status'] == ResponseType.SUCCESS.value:
+        if response['status'] == _SUCCESS:
             return response['data']
         else:
             msg = response['data']
             raise BrokerAPIError(msg=msg)
         
     def login(self, *args, **kwargs):
-        response = self._api.send(self.make_api_payload(APICommand.\
-                                                          LOGIN,
-                                          kwargs))
+        response = self._call(APICommand.LOGIN, kwargs)
         return self.process_response(response)
     
     def logout(self, *args, **kwargs):
-        response = self._api.send(self.make_api_payload(APICommand.\
-                                                          LOGOUT,
-                                          kwargs))
+        response = self._call(APICommand.LOGOUT, kwargs)
         return self.process_response(response)
     
     @property
@@ -493,37 +604,35 @@ class BackTesterAPI(AbstractBrokerAPI):
     
     @property
     def profile(self):
-        response = self._api.send(self.make_api_payload(APICommand.\
-                                                          GET_PROFILE,
-                                          {}))
+        response = self._call(APICommand.GET_PROFILE, {})
         return self.process_response(response)
     
     @property
     def account(self):
-        response = self._api.send(self.make_api_payload(APICommand.\
-                                                          GET_ACCOUNT,
-                                          {}))
+        response = self._call(APICommand.GET_ACCOUNT, {})
         return self.process_response(response)
     
+    @property
+    def typed_account(self):
+        '''
+            The backtester account object itself (not a copy), for the 
+            performance tracker to read the fields directly.
+        '''
+        return self._api._account
+    
     @property
     def positions(self):
-        response = self._api.send(self.make_api_payload(APICommand.\
-                                        GET_POSITIONS,
-                                        {}))
+        response = self._call(APICommand.GET_POSITIONS, {})
         return self.process_response(response)
     
     @property
     def open_orders(self):
-        response = self._api.send(self.make_api_payload(APICommand.\
-                                        GET_OPEN_ORDERS,
-                                        {}))
+        response = self._call(APICommand.GET_OPEN_ORDERS, {})
         return self.process_response(response)
     
     @property
     def orders(self):
-        response = self._api.send(self.make_api_payload(APICommand.\
-                                        GET_ORDERS,
-                                        {}))
+        response = self._call(APICommand.GET_ORDERS, {})
         return self.process_response(response)
     
     @property
@@ -531,15 +640,11 @@ class BackTesterAPI(AbstractBrokerAPI):
         return self._trading_calendar.tz
     
     def order(self, order_id):
-        response = self._api.send(self.make_api_payload(APICommand.\
-                                                          GET_ORDER,
-                                          order_id))
+        response = self._call(APICommand.GET_ORDER, order_id)
         return self.process_response(response)
     
     def place_order(self, order):
-        response = self._api.send(self.make_api_payload(APICommand.\
-                                                          PLACE_ORDER,
-                                          order))
+        response = self._call(APICommand.PLACE_ORDER, order)
         return self.process_response(response)
     
     def update_order(self, order_param, *args, **kwargs):
@@ -549,9 +654,7 @@ class BackTesterAPI(AbstractBrokerAPI):
             order_id = order_param
         
         kwargs["order_id"] = order_id
-        response = self._api.send(self.make_api_payload(APICommand.\
-                                        MODIFTY_ORDER,
-                                        kwargs))
+        response = self._call(APICommand.MODIFTY_ORDER, kwargs)
         
         return self.process_response(response)
     
@@ -561,42 +664,36 @@ class BackTesterAPI(AbstractBrokerAPI):
         else:
             order_id = order_param
             
-        response = self._api.send(self.make_api_payload(APICommand.\
-                                        CANCEL_ORDER,
-                                        order_id))  
+        response = self._call(APICommand.CANCEL_ORDER, order_id)  
         return self.process_response(response)
         
     def fund_transfer(self, amount):
-        response = self._api.send(self.make_api_payload(APICommand.\
-                                        ADD_CAPITAL,
-                                        amount))
+        response = self._call(APICommand.ADD_CAPITAL, amount)
         
         return self.process_response(response)
     
+    def set_slippage(self, model):
+        self._api.execution_model.set_slippage(model)
+        
+    def set_commission(self, model):
+        self._api.execution_model.set_commission(model)
+        
     def trading_bar(self, timestamp):
-        self._api.send(self.make_api_payload(BARS.TRADING_BAR,
-                         timestamp))
+        self._call(BARS.TRADING_BAR, timestamp)
         
     def before_trading_start(self, timestamp):
-        self._api.send(self.make_api_payload(BARS.\
-                                               BEFORE_TRADING_START,
-                         timestamp))
+        self._call(BARS.BEFORE_TRADING_START, timestamp)
         
     def after_trading_hours(self, timestamp):
-        self._api.send(self.make_api_payload(BARS.\
-                                               AFTER_TRADING_HOURS,
-                         timestamp))
+        self._call(BARS.AFTER_TRADING_HOURS, timestamp)
         
     def algo_start(self, timestamp):
-        self._api.send(self.make_api_payload(BARS.ALGO_START,
-                         timestamp))
+        self._call(BARS.ALGO_START, timestamp)
         
     def algo_end(self, timestamp):
-        self._api.send(self.make_api_payload(BARS.ALGO_END,
-                         timestamp))
+        self._call(BARS.ALGO_END, timestamp)
         
     def heart_beat(self, timestamp):
-        self._api.send(self.make_api_payload(BARS.HEART_BEAT,
-                         timestamp))
+        self._call(BARS.HEAR_BEAT, timestamp)
         
         
\ No newline at end of file
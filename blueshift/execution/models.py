@@ -0,0 +1,269 @@
+# Copyright 2018 QuantInsti Quantitative Learnings Pvt Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Created on Tue Feb 12 10:21:37 2019
+
+@author: prodipta
+"""
+from abc import ABC, abstractmethod
+import numpy as np
+
+from blueshift.trades._order_types import OrderSide, OrderType
+from blueshift.utils.exceptions import ValidationError
+
+def group_cumsum(groups, values):
+    '''
+        Cumulative sum of `values` within each group (inclusive), in 
+        the original order of the elements. `groups` are integer group
+        labels.
+    '''
+    order = np.argsort(groups, kind='stable')
+    sorted_groups = groups[order]
+    sorted_values = values[order]
+    
+    starts = np.ones(len(order), dtype=bool)
+    starts[1:] = sorted_groups[1:] != sorted_groups[:-1]
+    
+    cum = np.cumsum(sorted_values)
+    offsets = (cum - sorted_values)[starts]
+    sizes = np.diff(np.append(np.flatnonzero(starts), len(order)))
+    
+    out = np.empty(len(order), dtype=cum.dtype)
+    out[order] = cum - np.repeat(offsets, sizes)
+    return out
+
+class SlippageModel(ABC):
+    '''
+        Slippage models compute the execution prices for a batch of
+        fills. All inputs are arrays, one element per order. The `sides`
+        are +1 for buy and -1 for sell.
+    '''
+    @abstractmethod
+    def simulate(self, sides, traded, prices, volumes):
+        raise NotImplementedError
+
+    def __str__(self):
+        return f"Blueshift Slippage Model [{self.__class__.__name__}]"
+
+    def __repr__(self):
+        return self.__str__()
+
+class NoSlippage(SlippageModel):
+    '''
+        Fills at the bar price.
+    '''
+    def simulate(self, sides, traded, prices, volumes):
+        return prices
+
+class FixedSlippage(SlippageModel):
+    '''
+        Fills at the bar price adjusted by half of a fixed spread.
+    '''
+    def __init__(self, spread=0.0):
+        self._half_spread = abs(float(spread))/2
+
+    def simulate(self, sides, traded, prices, volumes):
+        return prices + sides*self._half_spread
+
+class VolumeShareSlippage(SlippageModel):
+    '''
+        Price impact grows with the square of the share of the bar
+        volume taken by the fill.
+    '''
+    def __init__(self, price_impact=0.1):
+        self._price_impact = abs(float(price_impact))
+
+    def simulate(self, sides, traded, prices, volumes):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            share = np.where(volumes > 0, traded/volumes, 0)
+        impact = self._price_impact*share**2
+        return prices*(1 + sides*impact)
+
+class CommissionModel(ABC):
+    '''
+        Commission models compute the commissions for a batch of fills,
+        given the (unsigned) traded quantities and execution prices.
+    '''
+    @abstractmethod
+    def calculate(self, traded, prices):
+        raise NotImplementedError
+
+    def __str__(self):
+        return f"Blueshift Commission Model [{self.__class__.__name__}]"
+
+    def __repr__(self):
+        return self.__str__()
+
+class NoCommission(CommissionModel):
+    '''
+        Zero commissions.
+    '''
+    def calculate(self, traded, prices):
+        return np.zeros(len(traded))
+
+class PerShareCommission(CommissionModel):
+    '''
+        A fixed cost per unit traded, with a minimum per trade.
+    '''
+    def __init__(self, cost=0.0, min_trade_cost=0.0):
+        self._cost = abs(float(cost))
+        self._min_trade_cost = abs(float(min_trade_cost))
+
+    def calculate(self, traded, prices):
+        commissions = traded*self._cost
+        return np.where(traded > 0,
+                        np.maximum(commissions, self._min_trade_cost), 0)
+
+class PerDollarCommission(CommissionModel):
+    '''
+        Commission as a fraction of the traded value.
+    '''
+    def __init__(self, cost=0.0):
+        self._cost = abs(float(cost))
+
+    def calculate(self, traded, prices):
+        return traded*prices*self._cost
+
+class ExecutionModel(ABC):
+    '''
+        Execution models compute fills for all open orders of a bar in
+        one go. The `execute` method returns arrays (in the order of the
+        orders) of execution prices, traded quantities (unsigned) and
+        commissions. A zero traded quantity means no fill.
+    '''
+    def __init__(self, slippage=None, commission=None):
+        self._slippage = slippage or NoSlippage()
+        self._commission = commission or NoCommission()
+
+    @property
+    def slippage(self):
+        return self._slippage
+
+    @property
+    def commission(self):
+        return self._commission
+
+    def set_slippage(self, slippage):
+        if not isinstance(slippage, SlippageModel):
+            raise ValidationError(msg="not a valid slippage model.")
+        self._slippage = slippage
+
+    def set_commission(self, commission):
+        if not isinstance(commission, CommissionModel):
+            raise ValidationError(msg="not a valid commission model.")
+        self._commission = commission
+
+    @abstractmethod
+    def execute(self, orders, data_portal):
+        raise NotImplementedError
+
+    def __str__(self):
+        return f"Blueshift Execution Model [{self.__class__.__name__}]"
+
+    def __repr__(self):
+        return self.__str__()
+
+class BarDataExecution(ExecutionModel):
+    '''
+        Deterministic fills against the current bar from the data portal.
+        Market orders fill at the close. Fills for an asset are capped
+        at `volume_limit` share of the bar volume, shared among the
+        orders for that asset in order of arrival. Limit orders fill
+        only if the bar range crosses the limit, at a price no worse
+        than the limit. Stop orders fill only if the bar range crosses
+        the trigger price.
+    '''
+    FIELDS = ['open','high','low','close','volume']
+
+    def __init__(self, slippage=None, commission=None, volume_limit=0.025):
+        super(BarDataExecution, self).__init__(slippage, commission)
+        self._volume_limit = abs(float(volume_limit))
+
+    def _fetch_bars(self, orders, data_portal):
+        assets = [order.asset for order in orders]
+        unique = list(dict.fromkeys(assets))
+        idx = {asset:i for i, asset in enumerate(unique)}
+        asset_idx = np.fromiter((idx[asset] for asset in assets),
+                                dtype=np.int64, count=len(assets))
+
+        bars = data_portal.current(unique, self.FIELDS)
+        bars = np.asarray(bars.loc[unique, self.FIELDS].values,
+                          dtype=np.float64)
+
+        return asset_idx, bars
+
+    def _volume_caps(self, asset_idx, remaining, volumes):
+        '''
+            Allocate the capped volume per asset to its orders in the
+            order of arrival.
+        '''
+        caps = np.floor(volumes*self._volume_limit)[asset_idx]
+        wanted = group_cumsum(asset_idx, remaining)
+        allowed = np.minimum(wanted, caps)
+        # what the earlier orders of the same asset already took
+        taken = np.minimum(wanted - remaining, caps)
+        return np.maximum(allowed - taken, 0)
+
+    def execute(self, orders, data_portal):
+        n = len(orders)
+        if n == 0:
+            empty = np.zeros(0)
+            return empty, empty, empty
+
+        asset_idx, bars = self._fetch_bars(orders, data_portal)
+        opens, highs, lows, closes, volumes = bars.T
+
+        remaining = np.empty(n)
+        sides = np.empty(n)
+        order_types = np.empty(n, dtype=np.int64)
+        limits = np.empty(n)
+        triggers = np.empty(n)
+        for i, order in enumerate(orders):
+            remaining[i] = order.quantity - order.filled
+            sides[i] = 1 if order.side == OrderSide.BUY else -1
+            order_types[i] = order.order_type
+            limits[i] = order.price
+            triggers[i] = order.trigger_price
+
+        high = highs[asset_idx]
+        low = lows[asset_idx]
+        price = closes[asset_idx]
+        valid = ~np.isnan(price) & (volumes[asset_idx] > 0)
+
+        is_limit = (order_types == OrderType.LIMIT) | \
+                    (order_types == OrderType.STOPLOSS)
+        is_stop = (order_types == OrderType.STOPLOSS) | \
+                    (order_types == OrderType.STOPLOSS_MARKET)
+
+        # buy limits need the low below the limit, sells the high above
+        crossed = np.where(sides > 0, low <= limits, high >= limits)
+        valid = valid & (~is_limit | crossed)
+        # buy stops trigger on the high, sell stops on the low
+        triggered = np.where(sides > 0, high >= triggers, low <= triggers)
+        valid = valid & (~is_stop | triggered)
+
+        remaining = np.where(valid, remaining, 0)
+        volumes = np.where(np.isnan(volumes), 0, volumes)
+        traded = self._volume_caps(asset_idx, remaining, volumes)
+
+        prices = self._slippage.simulate(sides, traded, price,
+                                         volumes[asset_idx])
+        prices = np.where(is_limit & (sides > 0),
+                          np.minimum(prices, limits), prices)
+        prices = np.where(is_limit & (sides < 0),
+                          np.maximum(prices, limits), prices)
+        prices = np.where(traded > 0, prices, 0)
+        commissions = self._commission.calculate(traded, prices)
+
+        return prices, traded, commissions
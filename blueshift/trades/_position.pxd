@@ -51,6 +51,8 @@ cdef class Position:
     cpdef __reduce__(self)
     cpdef add_to_position(self, Position pos)
     cpdef update(self, Trade trade, float margin)
+    cdef _compute_pnls(self)
+    cpdef mark_to_market(self, float price, object timestamp=*)
     cpdef if_closed(self)
     cpdef apply_split(self, float ratio)
     cpdef apply_merger(self, Asset acquirer, float ratio, float cash_pct)
\ No newline at end of file
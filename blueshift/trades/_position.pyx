@@ -231,18 +231,7 @@ cdef class Position:
         self.value = self.quantity*self.last_price
         self.timestamp = pos.timestamp
         
-        if self.buy_quantity > self.sell_quantity:
-            self.realized_pnl = self.sell_quantity*\
-                                    (self.sell_price - self.buy_price)
-            self.unrealized_pnl = (self.buy_quantity - self.sell_quantity)*\
-                                    (self.last_price - self.buy_price)
-        else:
-            self.realized_pnl = self.buy_quantity*\
-                                    (self.sell_price - self.buy_price)
-            self.unrealized_pnl = (self.sell_quantity - self.buy_quantity)*\
-                                    (self.sell_price - self.last_price)
-                                    
-        self.pnl = self.unrealized_pnl + self.realized_pnl
+        self._compute_pnls()
         self.margin = self.margin + pos.margin
     
     cpdef update(self, Trade trade, float margin):
@@ -263,6 +252,10 @@ cdef class Position:
         self.value = self.quantity*self.last_price
         self.timestamp = trade.timestamp
         
+        self._compute_pnls()
+        self.margin = self.margin + margin
+        
+    cdef _compute_pnls(self):
         if self.buy_quantity > self.sell_quantity:
             self.realized_pnl = self.sell_quantity*\
                                     (self.sell_price - self.buy_price)
@@ -275,7 +268,16 @@ cdef class Position:
                                     (self.sell_price - self.last_price)
                                     
         self.pnl = self.unrealized_pnl + self.realized_pnl
-        self.margin = self.margin + margin
+        
+    cpdef mark_to_market(self, float price, object timestamp=None):
+        '''
+            Revalue the position at the given price.
+        '''
+        self.last_price = price
+        self.value = self.quantity*self.last_price
+        if timestamp is not None:
+            self.timestamp = timestamp
+        self._compute_pnls()
         
     cpdef if_closed(self):
         if self.quantity == 0:
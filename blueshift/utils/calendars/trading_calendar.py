@@ -20,14 +20,19 @@ import pandas as pd
 import numpy as np
 import pytz
 from datetime import datetime, time
+from os import path as os_path
+from hashlib import md5
+from pickle import UnpicklingError
 import json
 
-from blueshift.utils.exceptions import SessionOutofRange
+from blueshift.utils.exceptions import (SessionOutofRange, 
+                                        BlueShiftPathException)
 from blueshift.utils.cutils import check_input
 from blueshift.utils.decorators import blueprint
 
 # constat values
 NANO = 1000000000
+DAY_NANO = 24*60*60*NANO
 
 # defaults for calendar creations
 START_DATE = pd.Timestamp('1990-01-01 00:00:00')
@@ -62,33 +67,78 @@ def make_consistent_tz(dt, tz):
         dt = dt.tz_convert(tz=tz)
     return dt
 
+def local_days_to_nano(days, tz):
+    '''
+        convert (naive) local dates to nanos of their local midnights
+    '''
+    days = days.tz_localize(tz, nonexistent='shift_forward')
+    return np.asarray(days.values, dtype='datetime64[ns]').astype(np.int64)
+
 def days_to_nano(dts, tz, weekends):
     '''
         convert a list of bizdays to a list of sessions in nanos
     '''
-    dtsn = []
-    # TODO: optimize this function
     if dts is None:
-        start = make_consistent_tz(START_DATE, tz)
-        end = make_consistent_tz(END_DATE, tz)
-        n_days = (end - start).days + 1
-        dts = [start + pd.Timedelta(days=i) for i
-               in range(n_days)
-               if (start + pd.Timedelta(days=i)).weekday() not in weekends]
-    else:
-        dts = [pd.Timestamp(dt.date()) for dt in dts
-               if dt.weekday() not in weekends]
+        return default_bizdays(tz, weekends)
+    
+    days = pd.DatetimeIndex(dts)
+    if days.tz is not None:
+        days = days.tz_localize(None)
+    days = days.normalize()
+    if weekends:
+        days = days[~np.isin(days.weekday, list(weekends))]
+        
+    return local_days_to_nano(days, tz)
+
+_BIZDAYS_CACHE = {}
+
+def _bizdays_cache_file(key):
+    '''
+        path of the on-disk cache of default bizdays for the key, None
+        if the blueshift directory is not available.
+    '''
+    from blueshift.configs.defaults import blueshift_dir
     try:
-        dts = pd.DatetimeIndex(dts)
-        if dts.tz is None:
-            dts = dts.tz_localize(tz)
-        else:
-            dts = dts.tz_convert(tz)
-        dtsn = [dt.value for dt in dts]
-    except Exception as e:
-        raise(e)
+        return os_path.join(blueshift_dir("calendars"),
+                            md5(key.encode()).hexdigest()+".npy")
+    except BlueShiftPathException:
+        return None
+
+def default_bizdays(tz, weekends):
+    '''
+        All days between the default start and end dates that are not 
+        weekends, as session nanos. Cached in memory and on disk, keyed
+        by the calendar definition.
+    '''
+    weekends = sorted(set(weekends or []))
+    key = "%s|%s|%s|%s" % (tz, weekends, START_DATE.value, END_DATE.value)
+    if key in _BIZDAYS_CACHE:
+        return _BIZDAYS_CACHE[key].copy()
+    
+    bizdays = None
+    cache_file = _bizdays_cache_file(key)
+    if cache_file and os_path.exists(cache_file):
+        try:
+            bizdays = np.load(cache_file)
+        except (OSError, ValueError, EOFError, UnpicklingError):
+            # corrupt cache, rebuild
+            bizdays = None
+    
+    if bizdays is None:
+        days = pd.date_range(START_DATE.normalize(), END_DATE.normalize(),
+                             freq='D')
+        if weekends:
+            days = days[~np.isin(days.weekday, weekends)]
+        bizdays = local_days_to_nano(days, tz)
         
-    return np.asarray(dtsn)
+        if cache_file:
+            try:
+                np.save(cache_file, bizdays)
+            except OSError:
+                pass
+    
+    _BIZDAYS_CACHE[key] = bizdays
+    return bizdays.copy()
 
 def date_to_nano(dt, tz):
     '''
@@ -107,6 +157,153 @@ def date_to_nano_midnight(dt, tz):
     dt = dt.normalize()
     return dt.value
 
+class MinuteGrid(object):
+    '''
+        Index of all trading bars of a calendar at a given frequency.
+        The bars are laid out as one flat int64 array of session nanos
+        times intraday offsets (session major), but only the sessions
+        and the offsets are stored and a bar nano is computed from its
+        position on access. A nano maps to its session through a table
+        of days since the first session, so position lookups are O(1).
+    '''
+    def __init__(self, sessions, session_ends, open_nano, close_nano,
+                 frequency=1):
+        self._frequency = max(int(frequency),1)
+        self._period = self._frequency*60*NANO
+        self._sessions = sessions
+        self._session_ends = session_ends
+        self._offsets = np.arange(open_nano, close_nano, self._period,
+                                  dtype=np.int64)
+        self._n_bars = len(self._offsets)
+        
+        self._origin = 0
+        self._day_table = np.full(1, -1, dtype=np.int64)
+        if len(sessions) > 0:
+            self._origin = int(sessions[0])
+            # local midnights are whole days apart up to dst shifts
+            days = (sessions - self._origin + DAY_NANO//2)//DAY_NANO
+            self._day_table = np.searchsorted(
+                    days, np.arange(days[-1]+1), 'right') - 1
+    
+    @property
+    def frequency(self):
+        return self._frequency
+    
+    @property
+    def period(self):
+        return self._period
+    
+    @property
+    def sessions(self):
+        return self._sessions
+    
+    @property
+    def offsets(self):
+        return self._offsets
+    
+    @property
+    def bars_per_session(self):
+        return self._n_bars
+    
+    def __len__(self):
+        return len(self._sessions)*self._n_bars
+    
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            pos = np.arange(start, stop, step, dtype=np.int64)
+            return self._sessions[pos//self._n_bars] + \
+                        self._offsets[pos%self._n_bars]
+        
+        pos = int(key)
+        if pos < 0:
+            pos = pos + len(self)
+        if pos < 0 or pos >= len(self):
+            raise IndexError("bar position out of range")
+        return int(self._sessions[pos//self._n_bars] + \
+                   self._offsets[pos%self._n_bars])
+    
+    def bars(self, start_idx, end_idx):
+        '''
+            nanos of all bars of the sessions between the indices
+        '''
+        sessions = self._sessions[start_idx:end_idx]
+        return (sessions[:,None] + self._offsets[None,:]).ravel()
+    
+    def session_index(self, nano):
+        '''
+            index of the last session starting on or before the nano,
+            -1 if the nano is before the first session.
+        '''
+        sessions = self._sessions
+        n = len(sessions)
+        if n == 0 or nano < self._origin:
+            return -1
+        
+        day = (nano - self._origin)//DAY_NANO
+        if day >= len(self._day_table):
+            idx = n - 1
+        else:
+            idx = int(self._day_table[day])
+        
+        # the day estimate can be off by one around dst shifts
+        if idx + 1 < n and nano >= sessions[idx+1]:
+            idx = idx + 1
+        elif nano < sessions[idx]:
+            idx = idx - 1
+        return idx
+    
+    def bar_index(self, nano, session_idx):
+        '''
+            index of the last bar at or before the nano within the
+            session, -1 if the nano is before the first bar.
+        '''
+        if self._n_bars == 0:
+            return -1
+        nanos = nano - self._sessions[session_idx] - self._offsets[0]
+        if nanos < 0:
+            return -1
+        return int(min(nanos//self._period, self._n_bars - 1))
+    
+    def position(self, nano):
+        '''
+            position of the last bar at or before the nano, -1 if none.
+        '''
+        idx = self.session_index(nano)
+        if idx < 0:
+            return -1
+        return idx*self._n_bars + self.bar_index(nano, idx)
+    
+    def locate(self, nano):
+        '''
+            position of the bar at exactly the nano, -1 if not a bar.
+        '''
+        pos = self.position(nano)
+        if pos < 0 or self[pos] != nano:
+            return -1
+        return pos
+    
+    def positions(self, nanos):
+        '''
+            vectorized version of `position` for an array of nanos.
+        '''
+        nanos = np.asarray(nanos, dtype=np.int64)
+        idx = self._sessions.searchsorted(nanos, 'right') - 1
+        if self._n_bars == 0:
+            return np.full(len(nanos), -1, dtype=np.int64)
+        
+        elapsed = nanos - self._sessions[np.maximum(idx,0)] - \
+                        self._offsets[0]
+        bars = np.where(elapsed < 0, -1, 
+                        np.minimum(elapsed//self._period, self._n_bars-1))
+        return np.where(idx < 0, -1, idx*self._n_bars + bars)
+    
+    def __str__(self):
+        return f"Blueshift Minute Grid [freq:{self._frequency}]"
+    
+    def __repr__(self):
+        return self.__str__()
+
 @blueprint
 class TradingCalendar(object):
     '''
@@ -122,6 +319,7 @@ class TradingCalendar(object):
         self._saved_bizdays = bizdays
         self._saved_weekends = weekends
         self._bizdays = days_to_nano(bizdays, tz, weekends)
+        self._update_session_ends()
         open_time = time(*opens)
         self._open_nano = (open_time.hour*60 + open_time.minute)*60*NANO
         close_time = time(*closes)
@@ -195,6 +393,98 @@ class TradingCalendar(object):
     def __repr__(self):
         return self.__str__()
     
+    def _update_session_ends(self):
+        '''
+            nanos of the local midnight following each session
+        '''
+        days = pd.to_datetime(self._bizdays).tz_localize('Etc/UTC').\
+                tz_convert(self._tz).tz_localize(None) + pd.Timedelta(days=1)
+        self._session_ends = local_days_to_nano(days, self._tz)
+        # the grids refer to the old sessions
+        self._grids = {}
+    
+    def minute_grid(self, frequency=1):
+        '''
+            the (shared) bar index at the given frequency in minutes,
+            built on first request.
+        '''
+        grid = self._grids.get(frequency, None)
+        if grid is None:
+            grid = MinuteGrid(self._bizdays, self._session_ends,
+                              self._open_nano, self._close_nano,
+                              frequency)
+            self._grids[frequency] = grid
+        return grid
+    
+    def session_range(self, start_dt, end_dt):
+        '''
+            indices (start, end) of the sessions between dates, 
+            inclusive, in the session array.
+        '''
+        dt1 = date_to_nano_midnight(start_dt,self._tz)
+        dt2 = date_to_nano_midnight(end_dt,self._tz)
+        idx1 = np.searchsorted(self._bizdays,dt1)
+        idx2 = np.searchsorted(self._bizdays,dt2,'right')
+        return int(idx1), int(max(idx2, idx1+1))
+    
+    def to_nano(self, dt):
+        '''
+            nanos since epoch for a timestamp (naive timestamps are
+            assumed to be in the calendar timezone). Ints are returned
+            as is.
+        '''
+        if isinstance(dt, (int, np.integer)):
+            return int(dt)
+        if dt.tz is None:
+            return pd.Timestamp(dt, tz=self._tz).value
+        return dt.value
+    
+    def _session_idx(self, nano):
+        '''
+            index of the last session starting on or before the nano 
+            and a flag if the nano falls within that session date.
+        '''
+        idx = self._bizdays.searchsorted(nano, 'right') - 1
+        if idx < 0:
+            return idx, False
+        return idx, nano < self._session_ends[idx]
+    
+    def is_session_nano(self, nano):
+        '''
+            check if the date of the nano is a valid session
+        '''
+        return self._session_idx(nano)[1]
+    
+    def is_open_nano(self, nano):
+        '''
+            check if the nano falls within an open session
+        '''
+        idx, in_session = self._session_idx(nano)
+        if not in_session:
+            return False
+        nanos = nano - self._bizdays[idx]
+        return self._open_nano <= nanos <= self._close_nano
+    
+    def next_session_nano(self, nano):
+        '''
+            midnight nano of the first session after the date of nano
+        '''
+        idx = self._bizdays.searchsorted(nano, 'right')
+        if idx < len(self._bizdays):
+            return self._bizdays[idx]
+        raise SessionOutofRange(dt=nano)
+        
+    def previous_session_nano(self, nano):
+        '''
+            midnight nano of the last session before the date of nano
+        '''
+        idx, in_session = self._session_idx(nano)
+        if in_session:
+            idx = idx - 1
+        if idx >= 0:
+            return self._bizdays[idx]
+        raise SessionOutofRange(dt=nano)
+    
     def is_holiday(self, dt):
         '''
             check for holiday
@@ -205,87 +495,47 @@ class TradingCalendar(object):
         '''
             check if it is a valid session
         '''
-        dtm = date_to_nano_midnight(dt,self._tz)
-        if np_search(self._bizdays,dtm) > 0:
-            return True
-        return False
+        return self.is_session_nano(self.to_nano(dt))
         
     def is_open(self, dt):
         '''
             check for a open session
         '''
-        dtn = date_to_nano(dt,self._tz)
-        dtnm = date_to_nano_midnight(dt, self._tz)
-        if self.is_session(dt):
-            nanos = dtn - dtnm
-            if nanos >= self._open_nano and nanos <= self._close_nano:
-                return True
-        return False
+        return self.is_open_nano(self.to_nano(dt))
         
     def next_open(self, dt):
         '''
             returns next open session time
         '''
-        dtn = date_to_nano_midnight(dt,self._tz)
-        idx = np.searchsorted(self._bizdays,dtn)
-        if self._bizdays[idx] == dtn:
-            idx = idx+1
-        if idx < len(self._bizdays):
-            return pd.Timestamp(self._bizdays[idx] + self._open_nano,
-                                tz=self._tz)
-        else:
-            raise SessionOutofRange
+        nano = self.next_session_nano(self.to_nano(dt))
+        return pd.Timestamp(nano + self._open_nano, tz=self._tz)
         
     def previous_open(self, dt):
         '''
             returns previous open session time
         '''
-        dtn = date_to_nano_midnight(dt,self._tz)
-        idx = np.searchsorted(self._bizdays,dtn) - 1
-        if idx >= 0:
-            return pd.Timestamp(self._bizdays[idx] + self._open_nano,
-                                tz=self._tz)
-        else:
-            raise SessionOutofRange
+        nano = self.previous_session_nano(self.to_nano(dt))
+        return pd.Timestamp(nano + self._open_nano, tz=self._tz)
         
     def next_close(self, dt):
         '''
             returns next close session time
         '''
-        dtn = date_to_nano_midnight(dt,self._tz)
-        idx = np.searchsorted(self._bizdays,dtn)
-        if self._bizdays[idx] == dtn:
-            idx = idx+1
-        if idx < len(self._bizdays):
-            return pd.Timestamp(self._bizdays[idx] + self._close_nano,
-                                tz=self._tz)
-        else:
-            raise SessionOutofRange(dt=dt)
+        nano = self.next_session_nano(self.to_nano(dt))
+        return pd.Timestamp(nano + self._close_nano, tz=self._tz)
         
     def previous_close(self, dt):
         '''
             returns previous close session time
         '''
-        dtn = date_to_nano_midnight(dt,self._tz)
-        idx = np.searchsorted(self._bizdays,dtn) - 1
-        if idx >= 0:
-            return pd.Timestamp(self._bizdays[idx] + self._close_nano,
-                                tz=self._tz)
-        else:
-            raise SessionOutofRange(dt=dt)
+        nano = self.previous_session_nano(self.to_nano(dt))
+        return pd.Timestamp(nano + self._close_nano, tz=self._tz)
         
     def sessions(self, start_dt, end_dt):
         '''
             list all valid sessions between dates, inclusive
         '''
-        dt1 = date_to_nano_midnight(start_dt,self._tz)
-        dt2 = date_to_nano_midnight(end_dt,self._tz)
-        idx1 = np.searchsorted(self._bizdays,dt1)
-        idx2 = np.searchsorted(self._bizdays,dt2)
-        if self._bizdays[idx2] ==  dt2:
-            idx2 = idx2 + 1
-        idx2 = max(idx2, idx1+1)
-        
+        idx1, idx2 = self.session_range(start_dt, end_dt)
         return pd.to_datetime(self._bizdays[idx1:idx2]).\
                 tz_localize('Etc/UTC').tz_convert(self._tz)
                 
@@ -293,7 +543,10 @@ class TradingCalendar(object):
         '''
             list all valid minutes between dates, inclusive
         '''
-        raise NotImplementedError()
+        idx1, idx2 = self.session_range(start_dt, end_dt)
+        nanos = self.minute_grid().bars(idx1, idx2)
+        return pd.to_datetime(nanos).tz_localize('Etc/UTC').\
+                tz_convert(self._tz)
         
     def add_bizdays(self, dts):
         '''
@@ -301,16 +554,16 @@ class TradingCalendar(object):
         '''
         dtsn = days_to_nano(dts, self._tz, [])
         self._bizdays = np.unique(np.append(self._bizdays, dtsn))
-        self._bizdays = np.sort(self._bizdays)
+        self._update_session_ends()
     
     def add_holidays(self, dts):
         '''
             manually add holiddays. Should be Timestamp list.
         '''
         dtsn = days_to_nano(dts, self._tz, [])
-        sort_idx = self._bizdays.argsort()
-        idx = sort_idx[np.searchsorted(self._bizdays,dtsn,sorter = sort_idx)]
-        if idx.size > 0:
-            self._bizdays = np.delete(self._bizdays,idx)
+        holidays = np.isin(self._bizdays, dtsn)
+        if holidays.any():
+            self._bizdays = self._bizdays[~holidays]
+            self._update_session_ends()
         
         
\ No newline at end of file
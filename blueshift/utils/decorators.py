@@ -19,6 +19,7 @@ Created on Thu Oct 25 15:24:19 2018
 import pandas as pd
 from functools import wraps
 from weakref import ref as weakref_ref
+from weakref import WeakSet
 import math
 import time
 import logging
@@ -69,9 +70,27 @@ class singleton(object):
         Way around is to use self.__class__ directly, but there should
         be a cleaner way.
     '''
+    _registry = WeakSet()
+    
     def __init__(self,cls, *args, **kwargs):
         self.cls = cls
         self.__instance = None
+        singleton._registry.add(self)
+    
+    def reset(self):
+        '''
+            Forget the current instance, next call creates a new one.
+        '''
+        self.__instance = None
+        
+    @classmethod
+    def reset_all(cls):
+        '''
+            Forget the instances of all singletons, for e.g. in a
+            forked process that must not share the parent objects.
+        '''
+        for obj in list(cls._registry):
+            obj.reset()
     
     def __call__(self,*args,**kwargs):
         '''
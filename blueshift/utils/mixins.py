@@ -17,7 +17,8 @@ Created on Mon Nov  5 16:19:35 2018
 @author: prodipta
 """
 from pandas import Timestamp
-from time import sleep
+from time import sleep, monotonic
+from threading import Lock
 
 from blueshift.utils.exceptions import StateMachineError
 
@@ -42,6 +43,60 @@ class StateMachineMixin(object):
             raise StateMachineError(msg=strmsg)
             
         self._current_state = to_state
+
+class TokenBucket(object):
+    '''
+        Thread-safe token bucket rate limiter, refilled at `rate` tokens
+        per `period` seconds, up to `capacity` tokens. A capacity of one
+        spaces the calls evenly, so that no window of `period` seconds
+        sees more than `rate` calls. Only the calling thread sleeps.
+    '''
+    def __init__(self, rate, period=1, capacity=1):
+        self._lock = Lock()
+        self._period = 1
+        self._capacity = 1
+        self.update(rate, period, capacity)
+        self._tokens = self._capacity
+        self._last = monotonic()
+    
+    @property
+    def rate(self):
+        return self._rate
+    
+    @property
+    def period(self):
+        return self._period
+    
+    def update(self, rate, period=None, capacity=None):
+        '''
+            Update the refill rate (and the capacity) on the fly.
+        '''
+        with self._lock:
+            self._rate = rate
+            if period:
+                self._period = period
+            if capacity:
+                self._capacity = capacity
+            self._fill_rate = self._rate/self._period
+    
+    def acquire(self, tokens=1):
+        '''
+            Take `tokens` from the bucket, blocking the calling thread
+            till they are available. The tokens are reserved under the
+            lock and the wait happens outside, so that waiting callers
+            are served in order. Returns the time waited.
+        '''
+        with self._lock:
+            now = monotonic()
+            self._tokens = min(self._capacity, self._tokens + 
+                               (now - self._last)*self._fill_rate)
+            self._last = now
+            self._tokens = self._tokens - tokens
+            wait = max(0, -self._tokens/self._fill_rate)
+        
+        if wait > 0:
+            sleep(wait)
+        return wait
         
 class APIRateLimitMixin(object):
     
@@ -34,6 +34,7 @@ def run_algo(output, show_progress=False, publish=False,
     """ run algo from parameters """
     
     trading_environment = kwargs.pop("trading_environment", None)
+    sparse = kwargs.pop("sparse", False)
     
     if not trading_environment:
         # try to create an environment from the parameters
@@ -66,7 +67,7 @@ def run_algo(output, show_progress=False, publish=False,
     try:
         algo = TradingAlgorithm(
                 name=trading_environment.name, broker=broker, 
-                algo=algo_file, mode=mode)
+                algo=algo_file, mode=mode, sparse=sparse)
     except BaseException as e:
         print_msg(str(e), _type="error", 
                   platform=Platform.NOTEBOOK if if_notebook() else \
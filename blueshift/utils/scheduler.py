@@ -17,7 +17,9 @@ Created on Wed Jan  2 14:44:46 2019
 @author: prodipta
 """
 
-import bisect
+import heapq
+from itertools import count
+import numpy as np
 import pandas as pd
 from datetime import time
 from pandas.tseries.offsets import MonthBegin, MonthEnd
@@ -33,6 +35,51 @@ MAX_WEEK_DAY_OFFSET = 2
 MAX_MINUTE_OFFSET = 59
 MAX_HOUR_OFFSET = 3
 
+def _session_nanos(sessions):
+    '''
+        Nanos (UTC) of the local midnights of the sessions.
+    '''
+    dts = np.asarray(sessions.normalize().values, dtype='datetime64[ns]')
+    return dts.astype(np.int64)
+
+def _session_days(sessions):
+    # local dates as days since epoch
+    dts = np.asarray(sessions.tz_localize(None).values, 
+                     dtype='datetime64[D]')
+    return dts.astype(np.int64)
+
+def _nth_of_groups(sessions, keys, n):
+    '''
+        Pick the n-th session (from the end if n is negative) from each
+        group of consecutive sessions with the same key.
+    '''
+    size = len(keys)
+    if size == 0:
+        return np.zeros(0, dtype=np.int64)
+    
+    starts = np.flatnonzero(np.diff(keys)) + 1
+    starts = np.concatenate(([0], starts))
+    ends = np.append(starts[1:], size)
+    
+    if n >= 0:
+        idx = starts + n
+        idx = idx[idx < ends]
+    else:
+        idx = ends + n
+        idx = idx[idx >= starts]
+        
+    return _session_nanos(sessions)[idx]
+
+def _week_keys(sessions):
+    days = _session_days(sessions)
+    # epoch is a Thursday, weeks start on Monday
+    return days - (days + 3) % 7
+
+def _month_keys(sessions):
+    dts = np.asarray(sessions.tz_localize(None).values, 
+                     dtype='datetime64[M]')
+    return dts.astype(np.int64)
+
 class date_rules(object):
     '''
         Wrapper class to expose different date scheduling rules.
@@ -50,7 +97,7 @@ class date_rules(object):
     @classmethod
     def every_day(cls):
         def func(sessions):
-            return [dt.normalize().value for dt in sessions]
+            return _session_nanos(sessions)
         
         func.date_rule = True
         return func
@@ -62,9 +109,8 @@ class date_rules(object):
             raise ScheduleFunctionError(msg="invalid days offset supplied.")
             
         def func(sessions):
-            dts = pd.Series(sessions).groupby([sessions.year, 
-                           sessions.weekofyear]).nth(days_offset)
-            return [dt.normalize().value for dt in dts]
+            return _nth_of_groups(sessions, _week_keys(sessions), 
+                                  days_offset)
         
         func.date_rule = True
         return func
@@ -77,9 +123,8 @@ class date_rules(object):
         days_offset = -days_offset -1
         
         def func(sessions):
-            dts = pd.Series(sessions).groupby([sessions.year, 
-                           sessions.month]).nth(days_offset)
-            return [dt.normalize().value for dt in dts]
+            return _nth_of_groups(sessions, _week_keys(sessions), 
+                                  days_offset)
         
         func.date_rule = True
         return func
@@ -91,9 +136,8 @@ class date_rules(object):
             raise ScheduleFunctionError(msg="invalid days offset supplied.")
         
         def func(sessions):
-            dts = pd.Series(sessions).groupby([sessions.year, 
-                           sessions.month]).nth(days_offset)
-            return [dt.normalize().value for dt in dts]
+            return _nth_of_groups(sessions, _month_keys(sessions), 
+                                  days_offset)
         
         func.date_rule = True
         return func
@@ -105,9 +149,8 @@ class date_rules(object):
             raise ScheduleFunctionError(msg="invalid days offset supplied.")
         days_offset = -days_offset -1
         def func(sessions):
-            dts = pd.Series(sessions).groupby([sessions.year, 
-                           sessions.month]).nth(days_offset)
-            return [dt.normalize().value for dt in dts]
+            return _nth_of_groups(sessions, _month_keys(sessions), 
+                                  days_offset)
         
         func.date_rule = True
         return func
@@ -138,7 +181,7 @@ class time_rules(object):
         def func(session_open, session_close):
             dt = datetime_time_to_nanos(session_open) + \
                 datetime_time_to_nanos(time(hour=hours, minute=minutes))
-            return [dt]
+            return np.array([dt], dtype=np.int64)
         
         func.time_rule = True
         return func
@@ -158,7 +201,7 @@ class time_rules(object):
         def func(session_open, session_close):
             dt = datetime_time_to_nanos(session_close) - \
                 datetime_time_to_nanos(time(hour=hours, minute=minutes))
-            return [dt]
+            return np.array([dt], dtype=np.int64)
         
         func.time_rule = True
         return func
@@ -179,8 +222,7 @@ class time_rules(object):
             start_val = datetime_time_to_nanos(session_open)
             end_val = datetime_time_to_nanos(session_close)
             step = NANO_SECOND*60*minutes
-            dts = [dt for dt in range(start_val, end_val, step)]
-            return dts
+            return np.arange(start_val, end_val, step, dtype=np.int64)
         
         func.time_rule = True
         return func
@@ -201,8 +243,7 @@ class time_rules(object):
             start_val = datetime_time_to_nanos(session_open)
             end_val = datetime_time_to_nanos(session_close)
             step = NANO_SECOND*60*60*hours
-            dts = [dt for dt in range(start_val, end_val, step)]
-            return dts
+            return np.arange(start_val, end_val, step, dtype=np.int64)
         
         func.time_rule = True
         return func
@@ -238,6 +279,7 @@ class TimeRule(object):
                                               self._trading_calendar.tz)
         
         self._trigger_dts = None
+        self._n_triggers = 0
         self._trigger_idx = -1
         
         self._calc_dts()
@@ -261,6 +303,8 @@ class TimeRule(object):
             # if still no trigger dates, raise exceptions
             if len(self._trigger_dts) < 1:
                 raise ScheduleFunctionError(msg="failed to create task schedules")
+        
+        self._n_triggers = len(self._trigger_dts)
             
     def _trigger_dts_calc(self, start_dt, end_dt):
         # bump the dates to ensure we capture month start and end
@@ -269,27 +313,28 @@ class TimeRule(object):
         sessions = self._trading_calendar.sessions(start_dt_use, end_dt_use)
         mkt_open = self._trading_calendar.open_time
         mkt_close = self._trading_calendar.close_time
-        dt_dates = self._dt_func(sessions)
+        dt_dates = np.asarray(self._dt_func(sessions), dtype=np.int64)
         # we make sure the date ranges does not fall outside the start 
         # and end dates.
-        dt_dates = [dt for dt in dt_dates if dt >= start_dt.value and\
-                    dt <= end_dt.value]
+        dt_dates = dt_dates[(dt_dates >= start_dt.value) & \
+                            (dt_dates <= end_dt.value)]
         # we cannot do the same for times, for e.g. for 24 hour calendar
         # it becomes meaningless. open may be > close.
-        dt_times = self._time_func(mkt_open, mkt_close)
+        dt_times = np.asarray(self._time_func(mkt_open, mkt_close), 
+                              dtype=np.int64)
         
-        return [dt1 + dt2 for dt1 in dt_dates for dt2 in dt_times]
+        return (dt_dates[:,None] + dt_times[None,:]).ravel()
     
     def __next__(self):
         self._trigger_idx = self._trigger_idx + 1
-        if self._trigger_idx < len(self._trigger_dts):
-            return self._trigger_dts[self._trigger_idx]
+        if self._trigger_idx < self._n_triggers:
+            return int(self._trigger_dts[self._trigger_idx])
         
         self._start_dt = self._end_dt
         self._end_dt = self._start_dt + pd.Timedelta(days=MAX_DAYS_AHEAD)
         self._calc_dts()
         self._trigger_idx = 0
-        return self._trigger_dts[self._trigger_idx]
+        return int(self._trigger_dts[self._trigger_idx])
     
     def __iter__(self):
         return self
@@ -362,35 +407,38 @@ class Scheduler(object):
     '''
         Class to manage scheduled events (events based on time-stamp). The 
         core parts are a queue and a method to check the queue on request. 
-        The implementation uses bisect insort_left to insert an incoming 
-        event to the first possible sorted position, and also uses bisect
-        bisect_right to retrieve all pending tasks for a given nano. The
+        The queue is a heap of (nano, sequence, event) tuples, the sequence
+        keeps the insertion order for events with the same nano. The
         event trigger method returns early in case the task queue is empty
         or the task with the nearest future nano is higher than the current
-        nano. Else it removes and processes all hits and re-insert them 
-        after updating the next call nano.
+        nano. Else it pops all hits, re-inserts them after updating the 
+        next call nano and then runs the callbacks.
     '''
     def __init__(self):
         self._events = []
+        self._counter = count()
         self._next_dt = None
         
     def add_event(self, event):
-        bisect.insort_left(self._events, event)
-        self._next_dt = self._events[0].dt
+        heapq.heappush(self._events, (event.dt, next(self._counter), 
+                                      event))
+        self._next_dt = self._events[0][0]
         
-    def trigger_events(self, context, data, dt):
-        if not self._events:
-            return
-        
-        if dt < self._next_dt:
-            return
+    @property
+    def next_trigger(self):
+        '''
+            The nano of the earliest pending event, None if no events.
+        '''
+        return self._next_dt
         
-        pos = bisect.bisect_right(self._events, dt)
-        if pos == 0:
+    def trigger_events(self, context, data, dt):
+        if self._next_dt is None or dt < self._next_dt:
             return
         
-        callback_list = self._events[:pos]
-        self._events = self._events[pos:]
+        events = self._events
+        callback_list = []
+        while events and events[0][0] <= dt:
+            callback_list.append(heapq.heappop(events)[2])
         
         for e in callback_list:
             self.add_event(next(e))
@@ -401,17 +449,3 @@ class Scheduler(object):
     
     def __repr__(self):
         return self.__str__()
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
\ No newline at end of file
@@ -0,0 +1,323 @@
+# Copyright 2018 QuantInsti Quantitative Learnings Pvt Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Created on Fri Feb 15 10:12:45 2019
+
+@author: prodipta
+
+batch runs of backtests (parameter sweeps) across a process pool.
+
+"""
+import multiprocessing
+from functools import partial
+from itertools import product
+from os.path import basename, splitext, join
+from ast import literal_eval
+import pandas as pd
+
+from blueshift.algo import TradingAlgorithm, BlueShiftEnvironment, MODE
+from blueshift.alerts import get_alert_manager
+from blueshift.brokers.backtest import BackTest
+from blueshift.execution.backtester import BackTesterAPI
+from blueshift.configs.defaults import (blueshift_saved_orders_path,
+                                        ensure_directory)
+from blueshift.utils.ctx_mgr import ShowProgressBar
+from blueshift.utils.exceptions import ValidationError
+from blueshift.utils.decorators import singleton
+from blueshift.utils.types import BacktestJob, listlike
+
+# the environment built in the parent for a sweep, inherited by the 
+# forked workers.
+_shared_environment = None
+
+def parse_param_grid(specs):
+    '''
+        Convert a list of "name=v1,v2,..." strings to a parameter
+        grid dict. Values are parsed as python literals if possible,
+        else kept as strings.
+    '''
+    def parse(value):
+        try:
+            return literal_eval(value)
+        except (ValueError, SyntaxError):
+            return value
+    
+    grid = {}
+    for spec in specs:
+        if '=' not in spec:
+            raise ValidationError(msg=f"invalid parameter spec {spec}.")
+        name, values = spec.split('=',1)
+        grid[name.strip()] = [parse(v.strip()) for v in values.split(',')]
+    
+    return grid
+
+def parse_date_ranges(specs):
+    '''
+        Convert a list of "start:end" strings to a list of start and
+        end date tuples.
+    '''
+    ranges = []
+    for spec in specs:
+        try:
+            start_date, end_date = spec.split(':')
+            ranges.append((pd.Timestamp(start_date.strip()), 
+                           pd.Timestamp(end_date.strip())))
+        except ValueError:
+            raise ValidationError(msg=f"invalid date range {spec}.")
+    
+    return ranges
+
+def make_jobs(algo_file, params=None, dates=None, name=None):
+    '''
+        Create the backtest jobs for all combinations of the parameter
+        grid (a dict of name to list of values) and the date ranges
+        (a list of start and end date tuples).
+    '''
+    params = params or {}
+    dates = dates or [(None, None)]
+    name = name or splitext(basename(algo_file))[0]
+    
+    keys = list(params.keys())
+    values = [params[k] if listlike(params[k]) else [params[k]] \
+              for k in keys]
+    
+    jobs = []
+    for combo in product(*values):
+        for start_date, end_date in dates:
+            job_name = f"{name}_{len(jobs)}"
+            jobs.append(BacktestJob(job_name, algo_file,
+                                    dict(zip(keys, combo)),
+                                    start_date, end_date))
+    
+    return jobs
+
+def make_environment(jobs, sparse=False, **kwargs):
+    '''
+        Create the trading environment for a batch of jobs once. Its 
+        calendar, asset finder and data portal are then reused by all
+        the jobs (see `run_job`). Returns None if the environment can
+        not be created, or is not a backtest one.
+    '''
+    if not jobs:
+        return None
+    
+    job = jobs[0]
+    try:
+        trading_environment = BlueShiftEnvironment(
+                name=job.name, algo_file=job.algo_file,
+                start_date=job.start_date, end_date=job.end_date,
+                mode=MODE.BACKTEST, **kwargs)
+    except SystemExit:
+        # leave it to the jobs to report the error.
+        return None
+    
+    if not isinstance(trading_environment.broker_tuple.broker, 
+                      BackTesterAPI):
+        return None
+    
+    return trading_environment
+
+def _job_broker(job, trading_environment, initial_capital=None):
+    '''
+        A new backtester and clock for the job, on the calendar, asset
+        finder and data portal of the environment.
+    '''
+    shared = trading_environment.broker_tuple
+    if initial_capital is None:
+        initial_capital = shared.broker.account['net']
+    
+    return BackTest(name=job.name, 
+                    trading_calendar=trading_environment.trading_calendar,
+                    initial_capital=initial_capital,
+                    frequency=shared.clock.emit_frequency,
+                    start_date=job.start_date, end_date=job.end_date,
+                    asset_finder=shared.asset_finder,
+                    data_portal=shared.data_portal)
+
+def run_job(job, sparse=False, trading_environment=None, **kwargs):
+    '''
+        Run a single backtest job in the current process and return
+        the performance dataframe. If a trading environment is given 
+        (see `make_environment`), the job reuses its calendar, asset 
+        finder and data portal. Else a new environment is created, and
+        the keyword arguments are passed on to it (config file, capital,
+        broker etc.).
+    '''
+    if trading_environment is None:
+        trading_environment = BlueShiftEnvironment(
+                name=job.name, algo_file=job.algo_file,
+                start_date=job.start_date, end_date=job.end_date,
+                mode=MODE.BACKTEST, **kwargs)
+        broker = trading_environment.broker_tuple
+    else:
+        trading_environment.get_algo_file(job.algo_file)
+        broker = _job_broker(job, trading_environment,
+                             kwargs.get("initial_capital", None))
+    
+    # the blotter files are per job, to keep concurrent runs apart.
+    blotter_root = join(blueshift_saved_orders_path(), job.name)
+    ensure_directory(blotter_root)
+    
+    algo = TradingAlgorithm(
+            name=job.name, broker=broker,
+            algo=trading_environment.algo_file,
+            mode=MODE.BACKTEST, params=job.params,
+            sparse=sparse, blotter_root=blotter_root)
+    
+    return algo.back_test_run(get_alert_manager())
+
+def _run_job_worker(job, kwargs):
+    '''
+        Pool target. Every job gets a fresh worker process, as the
+        blotter, trackers and loggers are process singletons. Errors
+        are returned, not raised, so that one bad job does not bring
+        down the batch.
+    '''
+    try:
+        # a forked worker inherits the singletons of the parent
+        singleton.reset_all()
+        return job, run_job(job, trading_environment=_shared_environment,
+                            **kwargs), None
+    except SystemExit:
+        # environment creation failure prints the error and exits.
+        return job, None, "failed to create the trading environment."
+    except BaseException as e:
+        return job, None, str(e) or e.__class__.__name__
+
+def _get_mp_context():
+    '''
+        Prefer fork so that the workers inherit the imported modules
+        and the environment built in the parent (calendar, asset finder
+        and data portal) copy-on-write, instead of rebuilding them per 
+        job. Without fork, every job builds its own environment.
+    '''
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
+class SweepResults(object):
+    '''
+        Result store of a batch run. Keeps the performance dataframe,
+        the parameters and the error (if any) of each job, in the order
+        the jobs were submitted.
+    '''
+    def __init__(self, jobs=None):
+        self._jobs = {}
+        self._perfs = {}
+        self._errors = {}
+        for job in jobs or []:
+            self._jobs[job.name] = job
+    
+    def __len__(self):
+        return len(self._perfs)
+    
+    def __getitem__(self, name):
+        return self._perfs[name]
+    
+    def __contains__(self, name):
+        return name in self._perfs
+    
+    @property
+    def names(self):
+        return [name for name in self._jobs if name in self._perfs]
+    
+    @property
+    def jobs(self):
+        return self._jobs
+    
+    @property
+    def errors(self):
+        return self._errors
+    
+    def add(self, job, perfs, error=None):
+        self._jobs[job.name] = job
+        if error is not None:
+            self._errors[job.name] = error
+        else:
+            self._perfs[job.name] = perfs
+    
+    def to_frame(self):
+        '''
+            All performance dataframes stacked, with the job name as
+            the first index level.
+        '''
+        names = self.names
+        if not names:
+            return pd.DataFrame()
+        return pd.concat([self._perfs[name] for name in names],
+                         keys=names, names=['job', None])
+    
+    def summary(self):
+        '''
+            One row per job with its parameters and the last row of
+            its performance.
+        '''
+        rows = {}
+        for name in self.names:
+            perfs = self._perfs[name]
+            row = dict(self._jobs[name].params)
+            if len(perfs) > 0:
+                row.update(perfs.iloc[-1].to_dict())
+            rows[name] = row
+        
+        return pd.DataFrame.from_dict(rows, orient='index')
+    
+    def save(self, output):
+        self.to_frame().to_csv(output)
+    
+    def __str__(self):
+        return f"Blueshift Sweep Results [jobs:{len(self._jobs)}, "\
+                f"errors:{len(self._errors)}]"
+    
+    def __repr__(self):
+        return self.__str__()
+
+def run_sweep(jobs, processes=None, output=None, show_progress=False,
+              **kwargs):
+    '''
+        Run a batch of backtest jobs across a pool of processes and
+        collect the performance dataframes in a result store. The
+        keyword arguments are passed on to each run.
+    '''
+    jobs = list(jobs)
+    names = [job.name for job in jobs]
+    if len(set(names)) != len(names):
+        raise ValidationError(msg="job names must be unique.")
+    
+    results = SweepResults(jobs)
+    if not jobs:
+        return results
+    
+    processes = min(processes or multiprocessing.cpu_count(), len(jobs))
+    target = partial(_run_job_worker, kwargs=kwargs)
+    
+    global _shared_environment
+    ctx = _get_mp_context()
+    if ctx.get_start_method() == 'fork':
+        _shared_environment = make_environment(jobs, **kwargs)
+    
+    try:
+        with ctx.Pool(processes, maxtasksperchild=1) as pool:
+            runner = pool.imap_unordered(target, jobs)
+            with ShowProgressBar(runner, show_progress=show_progress,
+                                 label="sweep", length=len(jobs)) as done:
+                for job, perfs, error in done:
+                    results.add(job, perfs, error)
+    finally:
+        _shared_environment = None
+    
+    if output:
+        results.save(output)
+    
+    return results
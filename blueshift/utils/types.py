@@ -53,6 +53,16 @@ Broker = namedtuple("Broker",('auth', 'asset_finder', 'data_portal',
 '''
 Command = namedtuple("Command",("cmd","args","kwargs"))
 
+'''
+    Data type for a single backtest run in a batch, with the algo 
+    parameters to override and the backtest date range. Results before
+    the (optional) record start date are warm-up and are discarded.
+'''
+BacktestJob = namedtuple("BacktestJob",("name", "algo_file", "params",
+                                        "start_date", "end_date",
+                                        "record_start"),
+                         defaults=(None,))
+
 class HashKeyType(click.ParamType):
     name = 'SHA or MD5 string type'
     def __init__(self, length=32):
@@ -0,0 +1,252 @@
+# Copyright 2018 QuantInsti Quantitative Learnings Pvt Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Created on Mon Feb 18 11:20:37 2019
+
+@author: prodipta
+
+date-sharded and walk-forward backtests, run in parallel on top of the
+batch runner.
+
+"""
+import multiprocessing
+from os.path import basename, splitext
+from itertools import product
+import numpy as np
+import pandas as pd
+
+from blueshift.utils.sweep import run_sweep
+from blueshift.utils.exceptions import (ValidationError,
+                                        BacktestUnexpectedExit)
+from blueshift.utils.types import BacktestJob, listlike
+
+# columns of the performance that carry the account level and are
+# re-based when stitching.
+LEVEL_COLUMNS = ['net', 'cash', 'liquid_value']
+
+def _sessions(start_date, end_date, trading_calendar=None):
+    '''
+        Local (naive) session dates between the dates, inclusive. All
+        weekdays if no calendar is supplied.
+    '''
+    if trading_calendar is None:
+        return pd.bdate_range(pd.Timestamp(start_date).normalize(),
+                              pd.Timestamp(end_date).normalize())
+    
+    sessions = trading_calendar.sessions(pd.Timestamp(start_date),
+                                         pd.Timestamp(end_date))
+    return sessions.tz_localize(None)
+
+def _algo_name(algo_file, name):
+    return name or splitext(basename(algo_file))[0]
+
+def _check_results(results):
+    if results.errors:
+        name, error = next(iter(results.errors.items()))
+        raise BacktestUnexpectedExit(msg=f"{name} ({error})")
+
+def make_shards(algo_file, start_date, end_date, shards, warmup=0,
+                trading_calendar=None, params=None, name=None):
+    '''
+        Split the sessions between the dates in `shards` contiguous
+        pieces. Each job starts `warmup` sessions before its shard and
+        records from the shard start.
+    '''
+    shards = int(shards)
+    warmup = int(warmup)
+    if shards < 1 or warmup < 0:
+        raise ValidationError(msg="invalid shards or warm-up period.")
+    
+    sessions = _sessions(start_date, end_date, trading_calendar)
+    if len(sessions) < shards:
+        raise ValidationError(msg="too many shards for the date range.")
+    
+    name = _algo_name(algo_file, name)
+    params = params or {}
+    
+    jobs = []
+    for i, idx in enumerate(np.array_split(np.arange(len(sessions)),
+                                           shards)):
+        start = int(idx[0])
+        record_start = sessions[start] if start > 0 else None
+        jobs.append(BacktestJob(f"{name}_shard_{i}", algo_file,
+                                dict(params),
+                                sessions[max(start - warmup, 0)],
+                                sessions[int(idx[-1])], record_start))
+    
+    return jobs
+
+def stitch_performance(perfs, record_starts, initial_capital):
+    '''
+        Join the performance dataframes of consecutive runs, each of
+        which starts with the same capital. Rows before the record
+        start of a run are dropped. The account levels and the
+        cumulative commissions of each run are re-based on the end of
+        the previous run, and the leverages recomputed.
+    '''
+    pieces = []
+    last_net = float(initial_capital)
+    last_commissions = 0.0
+    
+    for perf, record_start in zip(perfs, record_starts):
+        base_net = float(initial_capital)
+        base_commissions = 0.0
+        
+        if record_start is not None:
+            record_start = pd.Timestamp(record_start)
+            if perf.index.tz is not None and record_start.tz is None:
+                record_start = record_start.tz_localize(perf.index.tz)
+            warm = perf[perf.index < record_start]
+            perf = perf[perf.index >= record_start]
+            if len(warm) > 0:
+                base_net = float(warm['net'].iloc[-1])
+                base_commissions = float(warm['commissions'].iloc[-1])
+        
+        if len(perf) == 0:
+            continue
+        
+        perf = perf.copy()
+        offset = last_net - base_net
+        for col in LEVEL_COLUMNS:
+            perf[col] = perf[col] + offset
+        perf['commissions'] = perf['commissions'] + last_commissions \
+                                - base_commissions
+        
+        liquid_value = perf['liquid_value'].values
+        valid = liquid_value > 0
+        safe = np.where(valid, liquid_value, 1)
+        perf['gross_leverage'] = np.where(
+                valid, perf['gross_exposure'].values/safe, 0)
+        perf['net_leverage'] = np.where(
+                valid, perf['net_exposure'].values/safe, 0)
+        
+        pieces.append(perf)
+        last_net = float(perf['net'].iloc[-1])
+        last_commissions = float(perf['commissions'].iloc[-1])
+    
+    if not pieces:
+        return pd.DataFrame()
+    return pd.concat(pieces)
+
+def run_sharded(algo_file, start_date, end_date, shards=None, warmup=0,
+                processes=None, trading_calendar=None, params=None,
+                initial_capital=10000, name=None, **kwargs):
+    '''
+        Run a long backtest as date shards in parallel and stitch the
+        performance. Only valid for algos that do not carry state over
+        the warm-up period (or reset it), as each shard starts afresh.
+    '''
+    if shards is None:
+        shards = multiprocessing.cpu_count()
+    
+    jobs = make_shards(algo_file, start_date, end_date, shards, warmup,
+                       trading_calendar, params, name)
+    results = run_sweep(jobs, processes, initial_capital=initial_capital,
+                        **kwargs)
+    _check_results(results)
+    
+    return stitch_performance([results[job.name] for job in jobs],
+                              [job.record_start for job in jobs],
+                              initial_capital)
+
+def _score(perf, objective):
+    if callable(objective):
+        return float(objective(perf))
+    if len(perf) == 0:
+        return np.nan
+    return float(perf[objective].iloc[-1])
+
+def walk_forward(algo_file, start_date, end_date, train, test,
+                 params=None, objective='net', processes=None,
+                 trading_calendar=None, initial_capital=10000, name=None,
+                 **kwargs):
+    '''
+        Walk-forward backtest on rolling windows of `train` in-sample
+        and `test` out-of-sample sessions. If a parameter grid is
+        supplied, all combinations are run in-sample for each window
+        and the best by the `objective` (a performance column, taken
+        at the end, or a callable of the performance dataframe) is run
+        out-of-sample. Each out-of-sample run starts at the beginning
+        of its window, so the algo is re-initialized and sees the
+        in-sample period as warm-up. All runs of a stage go in a
+        single batch. Returns the stitched out-of-sample performance
+        and a dataframe of the selected parameters per window.
+    '''
+    train = int(train)
+    test = int(test)
+    if train < 0 or test < 1:
+        raise ValidationError(msg="invalid train or test period.")
+    
+    sessions = _sessions(start_date, end_date, trading_calendar)
+    if len(sessions) < train + test:
+        raise ValidationError(msg="date range shorter than a window.")
+    
+    name = _algo_name(algo_file, name)
+    params = params or {}
+    keys = list(params.keys())
+    values = [params[k] if listlike(params[k]) else [params[k]] \
+              for k in keys]
+    combos = [dict(zip(keys, combo)) for combo in product(*values)]
+    
+    windows = []
+    for start in range(0, len(sessions) - train, test):
+        end = min(start + train + test, len(sessions)) - 1
+        windows.append((sessions[start], sessions[start + train - 1] \
+                        if train > 0 else None,
+                        sessions[start + train], sessions[end]))
+    
+    # in-sample optimization, if there is anything to choose from
+    selected = [combos[0] if combos else {}]*len(windows)
+    scores = [np.nan]*len(windows)
+    if len(combos) > 1 and train > 0:
+        jobs = []
+        for i, (train_start, train_end, _, _) in enumerate(windows):
+            for j, combo in enumerate(combos):
+                jobs.append(BacktestJob(f"{name}_train_{i}_{j}",
+                                        algo_file, combo, train_start,
+                                        train_end))
+        results = run_sweep(jobs, processes,
+                            initial_capital=initial_capital, **kwargs)
+        _check_results(results)
+        
+        for i in range(len(windows)):
+            window_scores = [_score(results[f"{name}_train_{i}_{j}"],
+                                    objective) \
+                             for j in range(len(combos))]
+            if np.all(np.isnan(window_scores)):
+                # no valid score in this window, keep the first combo
+                continue
+            best = int(np.nanargmax(window_scores))
+            selected[i] = combos[best]
+            scores[i] = window_scores[best]
+    
+    # out-of-sample runs, with the in-sample period as warm-up
+    jobs = []
+    for i, (train_start, _, test_start, test_end) in enumerate(windows):
+        jobs.append(BacktestJob(f"{name}_test_{i}", algo_file,
+                                selected[i], train_start, test_end,
+                                test_start))
+    results = run_sweep(jobs, processes, initial_capital=initial_capital,
+                        **kwargs)
+    _check_results(results)
+    
+    perf = stitch_performance([results[job.name] for job in jobs],
+                              [job.record_start for job in jobs],
+                              initial_capital)
+    
+    selection = pd.DataFrame(selected, index=[w[2] for w in windows])
+    selection['score'] = scores
+    selection.index.name = 'test_start'
+    
+    return perf, selection
@@ -49,7 +49,7 @@ ext_modules = [
         Extension('blueshift.assets._assets', ['blueshift/assets/_assets.pyx']),
         Extension('blueshift.blotter._accounts', ['blueshift/blotter/_accounts.pyx']),
         Extension('blueshift.blotter._perf', ['blueshift/blotter/_perf.pyx']),
-        Extension('blueshift.execution._clock', ['blueshift/execution/_clock.c']),
+        Extension('blueshift.execution._clock', ['blueshift/execution/_clock.pyx']),
         Extension('blueshift.trades._order_types', ['blueshift/trades/_order_types.pyx']),
         Extension('blueshift.trades._order', ['blueshift/trades/_order.pyx']),
         Extension('blueshift.trades._trade', ['blueshift/trades/_trade.pyx']),
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Mar  5 11:20:37 2019
+
+@author: prodipta
+"""
+import gc
+import tempfile
+import pandas as pd
+import unittest
+
+from blueshift.algorithm.algorithm import TradingAlgorithm
+from blueshift.assets.assets import AssetFinder
+from blueshift.assets._assets import Equity
+from blueshift.data.dataportal import DataPortal
+from blueshift.execution._clock import SimulationClock
+from blueshift.execution.backtester import BackTesterAPI
+from blueshift.utils.calendars.trading_calendar import TradingCalendar
+from blueshift.utils.exceptions import InitializationError
+from blueshift.utils.types import BrokerType, MODE
+
+trading_calendar = TradingCalendar('NSE_EQ',tz="Asia/Calcutta",
+                                   opens=(9,15,0), closes=(15,30,0),
+                                   weekends=[5,6])
+
+algo_code = '''
+from blueshift.api import (symbol, order_target, schedule_function,
+                           date_rules, time_rules)
+TARGET = 10
+def initialize(context):
+    context.assets = [symbol("S1"), symbol("S2")]
+    schedule_function(rebalance, date_rules.every_day(), 
+                      time_rules.market_open(minutes=30))
+def rebalance(context, data):
+    for asset in context.assets:
+        order_target(asset, TARGET)
+'''
+
+class TestAssetFinder(AssetFinder):
+    def __init__(self):
+        self.assets = {i:Equity(i,f"S{i}") for i in range(1,3)}
+    def refresh_data(self, *args, **kwargs):
+        pass
+    def fetch_asset(self, sid):
+        return self.assets[sid]
+    def fetch_assets(self, sids):
+        return [self.assets[sid] for sid in sids]
+    def lookup_symbol(self, sym):
+        return self.assets[int(sym[1:])]
+    def lookup_symbols(self, syms):
+        return [self.lookup_symbol(sym) for sym in syms]
+
+class FlatPriceData(DataPortal):
+    '''
+        every asset at price 100 and volume 1M.
+    '''
+    def __init__(self):
+        self._asset_finder = TestAssetFinder()
+    @property
+    def name(self):
+        return 'flat'
+    @property
+    def tz(self):
+        return trading_calendar.tz
+    @property
+    def asset_finder(self):
+        return self._asset_finder
+    def set_timestamp(self, timestamp):
+        pass
+    def current(self, assets, fields):
+        if isinstance(fields, str):
+            if isinstance(assets, Equity):
+                return 100.0
+            return pd.Series(100.0, index=list(assets))
+        values = {f:1e6 if f=='volume' else 100.0 for f in fields}
+        if isinstance(assets, Equity):
+            return pd.Series(values)
+        return pd.DataFrame(values, index=list(assets))
+    def history(self, *args, **kwargs):
+        raise NotImplementedError
+
+def run_backtest(blotter_root, params=None):
+    clock = SimulationClock(trading_calendar, 1, 
+                            pd.Timestamp('2019-01-01'),
+                            pd.Timestamp('2019-01-10'))
+    broker = BackTesterAPI('test', BrokerType.BACKTESTER, 
+                           trading_calendar, 100000, 
+                           data_portal=FlatPriceData())
+    algo = TradingAlgorithm(name='test', mode=MODE.BACKTEST, api=broker,
+                            clock=clock, asset_finder=TestAssetFinder(), 
+                            data_portal=FlatPriceData(), algo=algo_code,
+                            blotter_root=blotter_root, params=params)
+    perf = algo.back_test_run()
+    return algo, perf
+
+class TestTradingAlgorithm(unittest.TestCase):
+    
+    def check_clean_run(self, algo, perf, expected_perf, target=10):
+        positions = algo.context.broker.positions
+        matched, unexplained = algo._blotter._reconcile_positions(
+                positions)
+        self.assertTrue(matched, f"unexplained positions {unexplained}")
+        self.assertEqual(sorted(p.quantity for p in positions.values()),
+                         [target, target])
+        pd.testing.assert_frame_equal(perf, expected_perf)
+    
+    def test_two_backtests(self):
+        # the second run starts clean, while the first is still alive
+        algo1, perf1 = run_backtest(tempfile.mkdtemp())
+        algo2, perf2 = run_backtest(tempfile.mkdtemp())
+        self.check_clean_run(algo2, perf2, perf1)
+        
+    def test_backtest_after_another(self):
+        # no positions carried over from a finished (collected) run
+        algo1, perf1 = run_backtest(tempfile.mkdtemp())
+        del algo1
+        gc.collect()
+        algo2, perf2 = run_backtest(tempfile.mkdtemp())
+        self.check_clean_run(algo2, perf2, perf1)
+    
+    def test_params(self):
+        # module level variables of the algo are overridden
+        algo, perf = run_backtest(tempfile.mkdtemp(), {'TARGET':20})
+        self.assertEqual(algo.namespace['TARGET'], 20)
+        positions = algo.context.broker.positions
+        self.assertEqual(sorted(p.quantity for p in positions.values()),
+                         [20, 20])
+        
+        self.assertRaises(InitializationError, run_backtest, 
+                          tempfile.mkdtemp(), {'NOPE':20})
+            
+if __name__ == '__main__':
+    unittest.main()
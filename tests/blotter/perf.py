@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Feb 28 11:20:43 2019
+
+@author: prodipta
+"""
+import numpy as np
+import unittest
+
+from blueshift.blotter._perf import (MetricsBuffer, Performance,
+                                     BASE_METRICS, DAILY_METRICS)
+from blueshift.blotter._accounts import Account, BacktestAccount
+
+def make_account(cash=1000):
+    return Account('test', cash, margin=100, gross_exposure=500,
+                   net_exposure=-200, mtm=25, holdings=50,
+                   commissions=3, currency='INR')
+
+class TestMetricsBuffer(unittest.TestCase):
+    
+    def test_grow(self):
+        buf = MetricsBuffer(('net','cash'), 2)
+        for i in range(5):
+            buf.append({'net':i, 'cash':10*i}, i)
+        
+        self.assertEqual(len(buf), 5)
+        self.assertEqual(len(buf.index), 8)
+        self.assertEqual(buf.last_timestamp(), 4)
+        self.assertEqual(list(buf.last()), [4, 40])
+        
+        index, values = buf.window(3)
+        self.assertEqual(list(index), [2, 3, 4])
+        self.assertEqual(list(values[:,1]), [20, 30, 40])
+        # the full history, and nothing for a negative count
+        self.assertEqual(list(buf.window(10)[0]), [0, 1, 2, 3, 4])
+        self.assertEqual(len(buf.window(-1)[0]), 0)
+        # missing fields are zero
+        buf.append({'net':5}, 5)
+        self.assertEqual(list(buf.last()), [5, 0])
+    
+    def test_ring(self):
+        buf = MetricsBuffer(('net','cash'), maxlen=3)
+        self.assertEqual(len(buf.index), 6)
+        for i in range(2):
+            buf.append({'net':i, 'cash':-i}, i)
+        self.assertEqual(list(buf.window(3)[0]), [0, 1])
+        
+        # wraps around, the oldest rows are dropped
+        for i in range(2, 8):
+            buf.append({'net':i, 'cash':-i}, i)
+            index, values = buf.window(3)
+            self.assertEqual(list(index), list(range(i-2, i+1)))
+            self.assertEqual(list(values[:,0]), list(range(i-2, i+1)))
+            self.assertEqual(buf.last_timestamp(), i)
+            self.assertEqual(list(buf.last()), [i, -i])
+        
+        self.assertEqual(len(buf), 3)
+        self.assertEqual(len(buf.index), 6)
+        self.assertEqual(list(buf.window(10)[0]), [5, 6, 7])
+        self.assertEqual(list(buf.window(1)[1][0]), [7, -7])
+    
+    def test_views(self):
+        buf = MetricsBuffer(('net','cash'), maxlen=4)
+        for i in range(6):
+            buf.append({'net':i, 'cash':-i}, i)
+        
+        # slices of the storage, not copies
+        index, values = buf.window(4)
+        self.assertTrue(np.shares_memory(index, buf.index))
+        self.assertTrue(np.shares_memory(values, buf.values))
+        
+        view = buf.last_view()
+        self.assertEqual(view['net'], 5)
+        self.assertEqual(view.cash, -5)
+        self.assertEqual(dict(view.items()), {'net':5, 'cash':-5})
+        self.assertEqual(view.get('nope', 1), 1)
+        self.assertRaises(KeyError, lambda: view['nope'])
+        self.assertTrue(np.shares_memory(view.values(), buf.values))
+    
+    def test_typed_account(self):
+        # the typed reads match the dict form, field by field
+        account = make_account()
+        typed = MetricsBuffer(tuple(DAILY_METRICS) + ('nope',))
+        mapped = MetricsBuffer(tuple(DAILY_METRICS) + ('nope',))
+        typed.append(account, 1)
+        mapped.append(account.to_dict(), 1)
+        
+        self.assertEqual(list(typed.last()), list(mapped.last()))
+        self.assertEqual(typed.last_view()['net'], account.net)
+        self.assertEqual(typed.last_view()['margin'], 100)
+        self.assertEqual(typed.last_view()['nope'], 0)
+        
+        account = BacktestAccount('test', 1000)
+        account.fund_transfer(500)
+        typed.append(account, 2)
+        self.assertEqual(typed.last_view()['cash'], 1500)
+        self.assertEqual(typed.last_view()['net'], 1500)
+
+class TestPerformance(unittest.TestCase):
+    
+    def test_performance(self):
+        account = make_account()
+        perf = Performance(account, 0, maxlen=2)
+        self.assertEqual(perf.currency, 'INR')
+        self.assertEqual(Performance(account.to_dict(), 0).currency,
+                         'INR')
+        self.assertEqual(perf.pnls.metrics, tuple(BASE_METRICS))
+        
+        for i in range(1, 4):
+            perf.update_pnls(make_account(1000+i), i)
+        perf.update_perfs(make_account(2000), 4)
+        
+        self.assertEqual(perf.last_updated, 4)
+        self.assertEqual(perf.pos_pnls, 2)
+        self.assertEqual(perf.pos_perfs, 2)
+        self.assertEqual(perf.last_pnl()['cash'], 1003)
+        self.assertEqual(perf.last_perf()['cash'], 2000)
+        
+        index, values = perf.get_past_pnls(5)
+        self.assertEqual(list(index), [2, 3])
+        self.assertEqual(list(values[:,1]), [1002, 1003])
+        self.assertTrue(np.shares_memory(values, perf.pnls.values))
+        
+        index, values = perf.get_past_perfs(5)
+        self.assertEqual(list(index), [0, 4])
+        self.assertEqual(list(values[:,1]), [1000, 2000])
+        self.assertEqual(list(perf.get_last_perf()), list(values[-1]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Mar  4 14:05:21 2019
+
+@author: prodipta
+"""
+import numpy as np
+import pandas as pd
+import unittest
+
+from blueshift.blotter.position_book import PositionBook
+from blueshift.blotter._accounts import BacktestAccount
+from blueshift.trades._trade import Trade
+from blueshift.trades._position import Position
+from blueshift.trades._order_types import OrderSide, ProductType
+from blueshift.assets._assets import Equity, EquityFutures
+
+ts = pd.Timestamp("2019-02-18 09:30:00", tz="Asia/Calcutta")
+
+class PriceData(object):
+    def __init__(self, prices):
+        self.prices = prices
+    
+    def current(self, assets, field):
+        return pd.Series([self.prices.get(a, np.nan) for a in assets],
+                         index=assets)
+
+def trade(tid, asset, side, qty, price):
+    return Trade(tid, qty, side, 'oid', 'oid', 'oid', -1, asset,
+                 ProductType.DELIVERY, price, 0, 0, 0, ts, ts)
+
+def rescan(positions):
+    account = BacktestAccount('test', 0)
+    account.update_account(0, 0, positions)
+    return (account.net_exposure, account.gross_exposure, account.mtm,
+            account.holdings)
+
+class TestPositionBook(unittest.TestCase):
+    
+    def setUp(self):
+        self.assets = [Equity(1, "AAA"), EquityFutures(2, symbol="AAA-I"),
+                       Equity(3, "BBB")]
+        self.book = PositionBook(capacity=1)
+        self.positions = {}
+    
+    def fill(self, asset, side, qty, price):
+        t = trade(len(self.positions), asset, side, qty, price)
+        position = self.positions.get(asset, None)
+        if position is None:
+            position = Position.from_trade(t, 0)
+            self.positions[asset] = position
+        else:
+            position.update(t, 0)
+        self.book.update(position)
+    
+    def assert_totals(self, totals, expected):
+        np.testing.assert_allclose(totals, expected, atol=1e-2)
+    
+    def test_update(self):
+        a, f, b = self.assets
+        self.assertEqual(self.book.totals(), (0, 0, 0, 0))
+        
+        fills = [(a, OrderSide.BUY, 10, 100), (f, OrderSide.SELL, 5, 50),
+                 (a, OrderSide.BUY, 10, 110), (b, OrderSide.BUY, 3, 20),
+                 (f, OrderSide.BUY, 5, 45), (a, OrderSide.SELL, 5, 120)]
+        for fill in fills:
+            self.fill(*fill)
+            # the running totals match a full rescan after every fill
+            self.assert_totals(self.book.totals(),
+                               rescan(self.positions))
+        
+        self.assertEqual(len(self.book), 3)
+        self.assertEqual(list(self.book.quantity), [15, 0, 3])
+        # the closed futures position has no contribution
+        self.assertEqual(self.book.mtm[1], 0)
+        self.assertEqual(self.book.holdings[1], 0)
+    
+    def test_revalue(self):
+        a, f, b = self.assets
+        self.fill(a, OrderSide.BUY, 10, 100)
+        self.fill(f, OrderSide.SELL, 5, 50)
+        self.fill(b, OrderSide.BUY, 2, 10)
+        
+        # a missing price keeps the last known
+        data = PriceData({a:110, f:40})
+        totals = self.book.revalue(data)
+        self.assertEqual(totals, self.book.totals())
+        self.assert_totals(totals, (1100 - 200 + 20, 1100 - 200 + 20,
+                                    100 + 50, 1000 + 20))
+        
+        # fills after the revalue update the totals from there
+        self.fill(a, OrderSide.SELL, 10, 115)
+        self.book.mark_positions(self.positions)
+        self.assert_totals(self.book.totals(), rescan(self.positions))
+        self.assert_totals(self.book.totals(), (-200 + 20, -200 + 20,
+                                                50, 20))
+        
+        self.fill(f, OrderSide.BUY, 5, 40)
+        self.fill(b, OrderSide.SELL, 2, 10)
+        self.assertEqual(self.book.revalue(data), (0, 0, 0, 0))
+        self.assertEqual(self.book.totals(), (0, 0, 0, 0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Mar  4 12:08:44 2019
+
+@author: prodipta
+"""
+import os
+import tempfile
+import shutil
+from datetime import date
+import pandas as pd
+import unittest
+from unittest import mock
+
+from blueshift.brokers.zerodha import kiteassets
+from blueshift.brokers.zerodha.kiteassets import (KiteAssetFinder,
+                                                  KiteInstrumentsIndex)
+from blueshift.assets._assets import Equity, EquityFutures, Forex
+from blueshift.utils.calendars.trading_calendar import TradingCalendar
+from blueshift.utils.exceptions import SymbolNotFound
+
+trading_calendar = TradingCalendar('NSE_EQ',tz="Asia/Calcutta",
+                                   opens=(9,15,0), closes=(15,30,0),
+                                   weekends=[5,6])
+
+COLUMNS = ['instrument_token', 'tradingsymbol', 'name', 'expiry',
+           'strike', 'tick_size', 'lot_size', 'instrument_type',
+           'segment', 'exchange']
+MAR, APR, MAY, JUN = (date(2019,3,28), date(2019,4,25), date(2019,5,30),
+                      date(2019,6,27))
+CDS_MAR, CDS_APR = date(2019,3,27), date(2019,4,26)
+
+# a small instruments dump, in the format of the Kite API
+INSTRUMENTS = [
+        (408065, 'INFY', 'INFOSYS', '', 0, 0.05, 1, 'EQ', 'NSE', 'NSE'),
+        (738561, 'RELIANCE', 'RELIANCE', '', 0, 0.05, 1, 'EQ', 'NSE',
+         'NSE'),
+        (779521, 'SBIN-BE', 'SBI', '', 0, 0.05, 1, 'EQ', 'NSE', 'NSE'),
+        (779777, 'M-M', 'M&M', '', 0, 0.05, 1, 'EQ', 'NSE', 'NSE'),
+        (256265, 'NIFTY 50', 'NIFTY', '', 0, 0, 0, 'EQ', 'INDICES',
+         'NSE'),
+        (264969, 'INDIA VIX', None, '', 0, 0, 0, 'EQ', 'INDICES', 'NSE'),
+        (128083204, 'INFY', 'INFOSYS', '', 0, 0.05, 1, 'EQ', 'BSE',
+         'BSE'),
+        (11000, 'NIFTY19MARFUT', 'NIFTY', MAR, 0, 0.05, 75, 'FUT',
+         'NFO-FUT', 'NFO'),
+        (11001, 'NIFTY19APRFUT', 'NIFTY', APR, 0, 0.05, 75, 'FUT',
+         'NFO-FUT', 'NFO'),
+        (11002, 'NIFTY19MAYFUT', 'NIFTY', MAY, 0, 0.05, 75, 'FUT',
+         'NFO-FUT', 'NFO'),
+        (11003, 'NIFTY19JUNFUT', 'NIFTY', JUN, 0, 0.05, 75, 'FUT',
+         'NFO-FUT', 'NFO'),
+        (11004, 'INFY19MARFUT', 'INFY', MAR, 0, 0.05, 1200, 'FUT',
+         'NFO-FUT', 'NFO'),
+        (11005, 'INDIAVIX19MARFUT', 'INDIAVIX', MAR, 0, 0.0025, 150,
+         'FUT', 'NFO-FUT', 'NFO'),
+        (11006, 'NIFTYIT19MARFUT', 'NIFTYIT', MAR, 0, 0.05, 25, 'FUT',
+         'NFO-FUT', 'NFO'),
+        (11007, 'NIFTY19MAR11000CE', 'NIFTY', MAR, 11000, 0.05, 75, 'CE',
+         'NFO-OPT', 'NFO'),
+        (11008, 'BANKNIFTY19MAR27000PE', 'BANKNIFTY', MAR, 27000, 0.05,
+         20, 'PE', 'NFO-OPT', 'NFO'),
+        (11009, 'NIFTY1930711000CE', 'NIFTY', date(2019,3,7), 11000,
+         0.05, 75, 'CE', 'NFO-OPT', 'NFO'),
+        (11010, 'INFY19MAR700CE', 'INFY', MAR, 700, 0.05, 1200, 'CE',
+         'NFO-OPT', 'NFO'),
+        (12000, 'USDINR19MARFUT', 'USDINR', CDS_MAR, 0, 0.0025, 1, 'FUT',
+         'CDS-FUT', 'CDS'),
+        (12001, 'USDINR19APRFUT', 'USDINR', CDS_APR, 0, 0.0025, 1, 'FUT',
+         'CDS-FUT', 'CDS'),
+        (12002, 'USDINR19MAR70CE', 'USDINR', CDS_MAR, 70, 0.0025, 1,
+         'CE', 'CDS-OPT', 'CDS'),
+        (12003, '763GS2029MAR', 'GS', CDS_MAR, 0, 0.0025, 1, 'FUT',
+         'CDS-FUT', 'CDS')]
+
+def instruments_dump():
+    return [dict(zip(COLUMNS, row)) for row in INSTRUMENTS]
+
+def legacy_filter(instruments):
+    '''
+        the row by row filter and underlying extraction that the
+        vectorized version replaced.
+    '''
+    df = instruments.dropna()
+    df = df.loc[df.exchange.isin(KiteAssetFinder.cls.EXCHANGES)]
+    df = df[df.segment != "NSE-INDICES"]
+    df = df[df.segment != "INDICES"]
+    df = df[df.tradingsymbol.str.contains('INDIAVIX')==False]
+    df = df[df.tradingsymbol.str.contains('NIFTYIT')==False]
+    df = df[df.tradingsymbol.str.contains('NIFTYMID50')==False]
+    df = df[df.segment != "CDS-OPT"]
+    
+    def flag(s):
+        splits = s.split("-")
+        if len(splits[-1])==2 and splits[-1] != splits[0]:
+            return False
+        return True
+    df = df[[flag(s) for s in df.tradingsymbol]]
+    
+    def single_stock_options(s,t):
+        if t == 'NFO-OPT':
+            return 'NIFTY' in s
+        return True
+    df = df[[single_stock_options(r['tradingsymbol'],r['segment']) \
+             for i, r in df.iterrows()]]
+    
+    def bond_futures(s, t):
+        return not (t == 'CDS' and s[0].isdigit())
+    df = df[[bond_futures(r['tradingsymbol'],r['exchange']) \
+             for i, r in df.iterrows()]].copy()
+    
+    today = pd.Timestamp.now().normalize()
+    df['expiry'] = pd.to_datetime(df.expiry)
+    df.loc[pd.isnull(df.expiry),"expiry"] = today
+    futures = df["instrument_type"]=="FUT"
+    expiries = sorted(set(df.expiry[(df['exchange']=="NFO") & \
+                                    futures]))[:3]
+    cds_expiries = sorted(set(df.expiry[(df['exchange']=="CDS") & \
+                                        futures]))[:3]
+    df = df[df.expiry.isin(set([*expiries, *cds_expiries, today]))].copy()
+    
+    df['underlying'] = [r['tradingsymbol'].split(
+            r['expiry'].strftime('%y%b').upper())[0] \
+            for i, r in df.iterrows()]
+    
+    exp1_dict = dict(zip(expiries,['I',"II","III"]))
+    exp2_dict = dict(zip(cds_expiries,['I',"II","III"]))
+    def expiry_month(e,i,s):
+        if i != "FUT":
+            return ""
+        if s == "NFO":
+            return exp1_dict.get(e,"")
+        if s == "CDS":
+            return exp2_dict.get(e,"")
+        return ""
+    df['exp'] = [expiry_month(r["expiry"], r["instrument_type"],
+                              r["exchange"]) for i, r in df.iterrows()]
+    
+    return df, expiries, cds_expiries
+
+class TestKiteInstrumentsIndex(unittest.TestCase):
+    
+    def test_lookups(self):
+        df = pd.DataFrame([
+                {'tradingsymbol':'INFY', 'instrument_token':1,
+                 'underlying':'INFY', 'exp':'', 'instrument_type':'EQ'},
+                {'tradingsymbol':'NIFTY19MARFUT', 'instrument_token':2,
+                 'underlying':'NIFTY', 'exp':'I', 'instrument_type':'FUT'},
+                # duplicates, the first row wins
+                {'tradingsymbol':'INFY', 'instrument_token':3,
+                 'underlying':'INFY', 'exp':'', 'instrument_type':'EQ'},
+                {'tradingsymbol':'NIFTY19MARFUT2', 'instrument_token':2,
+                 'underlying':'NIFTY', 'exp':'I', 'instrument_type':'FUT'}])
+        index = KiteInstrumentsIndex(df)
+        
+        self.assertEqual(len(index), 4)
+        self.assertEqual(index.by_symbol('INFY')['instrument_token'], 1)
+        self.assertEqual(index.by_token(3)['tradingsymbol'], 'INFY')
+        self.assertEqual(index.by_token(2)['tradingsymbol'],
+                         'NIFTY19MARFUT')
+        self.assertEqual(index.by_expiry('NIFTY', 'I')['tradingsymbol'],
+                         'NIFTY19MARFUT')
+        self.assertEqual(index.by_expiry('INFY', '', 'EQ')[
+                'instrument_token'], 1)
+        
+        self.assertIsNone(index.by_symbol('SBIN'))
+        self.assertIsNone(index.by_token(4))
+        self.assertIsNone(index.by_expiry('NIFTY', 'II'))
+        self.assertIsNone(index.by_expiry('NIFTY', 'I', 'CE'))
+    
+    def test_no_expiries(self):
+        # a list without the underlying columns has no futures index
+        df = pd.DataFrame({'tradingsymbol':['INFY'],
+                           'instrument_token':[1],
+                           'instrument_type':['EQ']})
+        index = KiteInstrumentsIndex(df)
+        self.assertEqual(index.by_symbol('INFY')['instrument_token'], 1)
+        self.assertIsNone(index.by_expiry('INFY', '', 'EQ'))
+        self.assertEqual(len(KiteInstrumentsIndex(df.iloc[:0])), 0)
+
+class FakeKiteAPI(object):
+    def __init__(self, instruments=None):
+        self._instruments = instruments
+        self.calls = 0
+    def instruments(self):
+        self.calls += 1
+        if self._instruments is None:
+            raise AssertionError("unexpected download")
+        return self._instruments
+
+class TestKiteAssetFinder(unittest.TestCase):
+    
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.snapshot = os.path.join(self.root, 'snapshot.pkl')
+        self.patches = [
+                mock.patch.object(KiteAssetFinder.cls, '_snapshot_file',
+                                  lambda finder: self.snapshot),
+                mock.patch.object(kiteassets, 'get_logger')]
+        for patch in self.patches:
+            patch.start()
+        self.logger = kiteassets.get_logger.return_value
+    
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        shutil.rmtree(self.root)
+    
+    def make_finder(self, instruments=None):
+        KiteAssetFinder.reset()
+        api = FakeKiteAPI(instruments)
+        return KiteAssetFinder(api=api, trading_calendar=trading_calendar)
+    
+    def test_filter_matches_legacy(self):
+        finder = self.make_finder(instruments_dump())
+        expected, expiries, cds_expiries = legacy_filter(
+                pd.DataFrame(instruments_dump()))
+        
+        pd.testing.assert_frame_equal(finder._instruments_list, expected)
+        self.assertEqual(finder.expiries, expiries)
+        self.assertEqual(finder.cds_expiries, cds_expiries)
+        
+        self.assertEqual(list(finder._instruments_list.tradingsymbol),
+                         ['INFY', 'RELIANCE', 'M-M', 'NIFTY19MARFUT',
+                          'NIFTY19APRFUT', 'NIFTY19MAYFUT',
+                          'INFY19MARFUT', 'NIFTY19MAR11000CE',
+                          'BANKNIFTY19MAR27000PE', 'USDINR19MARFUT',
+                          'USDINR19APRFUT'])
+        self.assertEqual(list(finder._instruments_list.exp),
+                         ['', '', '', 'I', 'II', 'III', 'I', '', '', 'I',
+                          'II'])
+        self.assertEqual(list(finder._instruments_list.underlying)[3:],
+                         ['NIFTY', 'NIFTY', 'NIFTY', 'INFY',
+                          'NIFTY', 'BANKNIFTY', 'USDINR', 'USDINR'])
+    
+    def test_snapshot(self):
+        finder = self.make_finder(instruments_dump())
+        self.assertTrue(os.path.exists(self.snapshot))
+        expected = finder._instruments_list
+        
+        # a restart on the same day does not download
+        finder = self.make_finder()
+        pd.testing.assert_frame_equal(finder._instruments_list, expected)
+        self.assertEqual(finder._api.calls, 0)
+        self.assertEqual(finder.expiries[0], pd.Timestamp(MAR))
+        self.assertEqual(finder.asset_to_id(finder.lookup_symbol(
+                "NIFTY-I")), 11000)
+        self.logger.warning.assert_not_called()
+    
+    def test_expired_snapshot(self):
+        finder = self.make_finder(instruments_dump())
+        snapshot = pd.read_pickle(self.snapshot)
+        snapshot['valid_till'] = pd.Timestamp.now(
+                tz=trading_calendar.tz) - pd.Timedelta(minutes=1)
+        pd.to_pickle(snapshot, self.snapshot)
+        
+        finder = self.make_finder(instruments_dump())
+        self.assertEqual(finder._api.calls, 1)
+        self.logger.warning.assert_not_called()
+    
+    def test_bad_snapshot(self):
+        with open(self.snapshot, 'wb') as fp:
+            fp.write(b'not a pickle')
+        
+        # falls back to the download and replaces the snapshot
+        finder = self.make_finder(instruments_dump())
+        self.assertEqual(finder._api.calls, 1)
+        self.assertEqual(len(finder._instruments_list), 11)
+        self.assertEqual(self.logger.warning.call_count, 1)
+        msg = self.logger.warning.call_args[0][0]
+        self.assertTrue(msg.startswith("failed to read"))
+        self.assertIn('instruments_list', pd.read_pickle(self.snapshot))
+    
+    def test_write_failure(self):
+        self.snapshot = os.path.join(self.root, 'missing', 'snapshot.pkl')
+        finder = self.make_finder(instruments_dump())
+        self.assertEqual(len(finder._instruments_list), 11)
+        self.assertFalse(os.path.exists(self.snapshot))
+        self.assertEqual(self.logger.warning.call_count, 1)
+        msg = self.logger.warning.call_args[0][0]
+        self.assertTrue(msg.startswith("failed to write"))
+    
+    def test_symbol_lookups(self):
+        finder = self.make_finder(instruments_dump())
+        
+        asset = finder.lookup_symbol('INFY')
+        self.assertIsInstance(asset, Equity)
+        self.assertEqual((asset.symbol, asset.exchange_name),
+                         ('INFY', 'NSE'))
+        self.assertEqual(finder.symbol_to_asset('NSE:INFY').symbol, 'INFY')
+        
+        # continuous futures by the expiry month
+        for sym, expected in [('NIFTY-I', 'NIFTY19MARFUT'),
+                              ('NIFTY-II', 'NIFTY19APRFUT'),
+                              ('NIFTY-III', 'NIFTY19MAYFUT'),
+                              ('NIFTY19APRFUT', 'NIFTY19APRFUT'),
+                              ('INFY-I', 'INFY19MARFUT')]:
+            asset = finder.lookup_symbol(sym)
+            self.assertIsInstance(asset, EquityFutures)
+            self.assertEqual(asset.symbol, expected)
+        
+        asset = finder.lookup_symbol('USDINR-II')
+        self.assertIsInstance(asset, Forex)
+        self.assertEqual(asset.symbol, 'USDINR19APRFUT')
+        
+        for sym in ['SBIN-BE', 'INFY-II', 'NIFTY19JUNFUT', 'NIFTY-IV',
+                    'INFY19MAR700CE']:
+            self.assertRaises(SymbolNotFound, finder.lookup_symbol, sym)
+    
+    def test_token_lookups(self):
+        finder = self.make_finder(instruments_dump())
+        
+        asset = finder.id_to_asset(11001)
+        self.assertEqual(asset.symbol, 'NIFTY19APRFUT')
+        self.assertEqual(finder.asset_to_id(asset), 11001)
+        self.assertEqual(finder.asset_to_id(finder.lookup_symbol('M-M')),
+                         779777)
+        
+        self.assertRaises(SymbolNotFound, finder.id_to_asset, 11003)
+        self.assertRaises(SymbolNotFound, finder.asset_to_id,
+                          Equity(-1, symbol='SBIN'))
+    
+    def test_duplicates(self):
+        # the first matching row wins, as with a search on the list
+        finder = self.make_finder(instruments_dump())
+        instruments = finder._instruments_list
+        dup = instruments[instruments.tradingsymbol == 'INFY'].copy()
+        dup['instrument_token'] = 999
+        dup['tick_size'] = 0.1
+        finder.refresh_data(instruments_list=pd.concat([instruments, dup]))
+        
+        self.assertEqual(finder.asset_to_id(finder.lookup_symbol('INFY')),
+                         408065)
+        self.assertEqual(finder.lookup_symbol('INFY').tick_size, 500)
+        self.assertEqual(finder.id_to_asset(999).tick_size, 1000)
+    
+    def test_cache_cleared_on_rebuild(self):
+        finder = self.make_finder(instruments_dump())
+        asset = finder.lookup_symbol('NIFTY-I')
+        self.assertIs(finder.lookup_symbol('NIFTY-I'), asset)
+        self.assertIs(finder.id_to_asset(11000), finder.id_to_asset(11000))
+        
+        # a new list with a changed lot size and token
+        instruments = finder._instruments_list.copy()
+        rows = instruments.tradingsymbol == 'NIFTY19MARFUT'
+        instruments.loc[rows, 'lot_size'] = 50
+        instruments.loc[rows, 'instrument_token'] = 21000
+        finder.refresh_data(instruments_list=instruments)
+        
+        new_asset = finder.lookup_symbol('NIFTY-I')
+        self.assertIsNot(new_asset, asset)
+        self.assertEqual((asset.mult, new_asset.mult), (75, 50))
+        self.assertEqual(finder.asset_to_id(new_asset), 21000)
+        self.assertEqual(finder.id_to_asset(21000).mult, 50)
+        self.assertRaises(SymbolNotFound, finder.id_to_asset, 11000)
+    
+    def test_expired_index(self):
+        # lookups after the validity refresh the list (and the index)
+        finder = self.make_finder(instruments_dump())
+        asset = finder.lookup_symbol('INFY')
+        finder._valid_till_nano = 0
+        finder._instruments_list_valid_till = pd.Timestamp.now(
+                tz=trading_calendar.tz) - pd.Timedelta(minutes=1)
+        os.remove(self.snapshot)
+        
+        self.assertIsNot(finder.lookup_symbol('INFY'), asset)
+        self.assertEqual(finder._api.calls, 2)
+        self.assertGreater(finder._valid_till_nano, 0)
+
+if __name__ == '__main__':
+    unittest.main()
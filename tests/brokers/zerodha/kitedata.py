@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Mar  5 16:45:12 2019
+
+@author: prodipta
+"""
+from threading import Lock
+from time import monotonic, sleep
+import pandas as pd
+import unittest
+
+from kiteconnect.exceptions import KiteException
+
+from blueshift.brokers.zerodha.kitedata import KiteRestData
+from blueshift.assets._assets import Equity
+from blueshift.utils.calendars.trading_calendar import TradingCalendar
+from blueshift.utils.exceptions import (MissingDataError, SymbolNotFound,
+                                        UnsupportedFrequency)
+from blueshift.utils.mixins import TokenBucket
+
+trading_calendar = TradingCalendar('NSE_EQ',tz="Asia/Calcutta",
+                                   opens=(9,15,0), closes=(15,30,0),
+                                   weekends=[5,6])
+assets = [Equity(i, f"S{i}") for i in range(1,7)]
+
+class FakeKiteAPI(object):
+    '''
+        daily bars with the close at the instrument token. Requests
+        take `latency` seconds, per token if a dict.
+    '''
+    def __init__(self, rate=1000, latency=0, errors=None):
+        self._max_instruments = 5
+        self.history_limiter = TokenBucket(rate)
+        self.latency = latency
+        self.errors = errors or []
+        self.calls = []
+        self._lock = Lock()
+    def historical_data(self, instrument, from_date, to_date, interval):
+        with self._lock:
+            self.calls.append((instrument, monotonic()))
+        latency = self.latency
+        if isinstance(latency, dict):
+            latency = latency.get(instrument, 0)
+        sleep(latency)
+        if instrument in self.errors:
+            raise KiteException("too many requests", 429)
+        dates = pd.date_range(end=to_date, periods=3, freq='D')
+        return [{'date':dt.date(), 'open':1, 'high':2, 'low':0,
+                 'close':instrument, 'volume':100} for dt in dates]
+
+class FakeAssetFinder(object):
+    def __init__(self, missing=None):
+        self.missing = missing or []
+    def asset_to_id(self, asset):
+        if asset.sid in self.missing:
+            raise SymbolNotFound(msg=asset.symbol)
+        return 100*asset.sid
+
+def make_portal(api, missing=None, workers=4):
+    KiteRestData.reset()
+    return KiteRestData(name='test', api=api,
+                        trading_calendar=trading_calendar,
+                        asset_finder=FakeAssetFinder(missing),
+                        history_workers=workers, history_cache=False)
+
+class TestKiteRestDataHistory(unittest.TestCase):
+    
+    def test_cache_opt_in(self):
+        # no on-disk cache unless asked for
+        KiteRestData.reset()
+        portal = KiteRestData(name='test', api=FakeKiteAPI(),
+                              trading_calendar=trading_calendar,
+                              asset_finder=FakeAssetFinder())
+        self.assertIsNone(portal._cache)
+        
+        cache = object()
+        KiteRestData.reset()
+        portal = KiteRestData(name='test', api=FakeKiteAPI(),
+                              trading_calendar=trading_calendar,
+                              asset_finder=FakeAssetFinder(),
+                              history_cache=cache)
+        self.assertIs(portal._cache, cache)
+    
+    def test_history(self):
+        api = FakeKiteAPI(latency={100:0.2})
+        portal = make_portal(api, missing=[3])
+        
+        df = portal.history(assets[:4], ['close', 'volume'], 2, '1d')
+        # in the order of the assets, unknown ones skipped
+        self.assertEqual(list(df.index.get_level_values(0).unique()),
+                         [assets[0], assets[1], assets[3]])
+        self.assertEqual(list(df.columns), ['close', 'volume'])
+        self.assertEqual(list(df.loc[assets[3], 'close']), [400, 400])
+        self.assertEqual(sorted(call[0] for call in api.calls),
+                         [100, 200, 400])
+        
+        # prunes to the max instruments, before skipping the unknown
+        api.calls = []
+        portal.history(assets, ['close'], 1, '1d')
+        self.assertEqual(sorted(call[0] for call in api.calls),
+                         [100, 200, 400, 500])
+        
+        self.assertIsNone(portal.history(assets[2:3], ['close'], 1, '1d'))
+        self.assertIsNone(portal.history(assets, ['close'], 0, '1d'))
+        self.assertRaises(UnsupportedFrequency, portal.history, assets,
+                          ['close'], 1, '5m')
+    
+    def test_as_completed(self):
+        api = FakeKiteAPI(latency={100:0.3, 200:0.1})
+        portal = make_portal(api)
+        
+        start = monotonic()
+        results = list(portal.history_as_completed(assets[:3], ['close'],
+                                                   1, '1d'))
+        elapsed = monotonic() - start
+        self.assertEqual([asset for asset, df in results],
+                         [assets[2], assets[1], assets[0]])
+        self.assertEqual(list(results[0][1]['close']), [300])
+        # concurrent, not the sum of the latencies
+        self.assertLess(elapsed, 0.35)
+    
+    def test_rate_limit(self):
+        # the limiter paces the requests across the workers
+        api = FakeKiteAPI(rate=20, latency=0.2)
+        portal = make_portal(api, workers=4)
+        
+        start = monotonic()
+        df = portal.history(assets[:5], ['close'], 1, '1d')
+        elapsed = monotonic() - start
+        self.assertEqual(len(df), 5)
+        
+        times = sorted(t for _, t in api.calls)
+        for i in range(1, len(times)):
+            self.assertGreater(times[i] - times[i-1], 0.05 - 0.02)
+        self.assertLess(elapsed, 4*0.05 + 0.2 + 0.15)
+    
+    def test_error_cancels(self):
+        # one worker, the failed request is the first in the queue
+        api = FakeKiteAPI(latency=0.05, errors=[100])
+        portal = make_portal(api, workers=1)
+        
+        with self.assertRaises(MissingDataError):
+            list(portal.history_as_completed(assets[:5], ['close'], 1,
+                                             '1d'))
+        sleep(0.2)
+        # at most the one already picked up by the worker runs
+        called = [call[0] for call in api.calls]
+        self.assertEqual(called[0], 100)
+        self.assertLessEqual(len(called), 2)
+    
+    def test_early_exit(self):
+        api = FakeKiteAPI(latency=0.05)
+        portal = make_portal(api, workers=1)
+        
+        results = portal.history_as_completed(assets[:5], ['close'], 1,
+                                              '1d')
+        asset, df = next(results)
+        self.assertEqual(asset, assets[0])
+        results.close()
+        sleep(0.2)
+        self.assertLessEqual(len(api.calls), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Mar  1 15:36:09 2019
+
+@author: prodipta
+"""
+import os
+import json
+import tempfile
+import shutil
+import pandas as pd
+import unittest
+
+from kiteconnect import KiteTicker
+
+from blueshift.brokers.zerodha.kitereplay import (TickRecorder, read_ticks,
+                                                  tick_nano, encode_packet,
+                                                  encode_message,
+                                                  KiteReplayProtocol,
+                                                  KiteReplayServer,
+                                                  TICK_COLUMNS)
+from blueshift.utils.exceptions import MissingDataError
+from blueshift.utils.types import NANO_SECOND
+
+# NSE equity, NSE index and currency derivative tokens
+EQUITY = 408065
+INDEX = 256265
+CURRENCY = 412675
+t0 = pd.Timestamp('2019-03-01 09:15:00', tz='Asia/Calcutta').value
+
+def make_tick(token, price, volume, nano):
+    return {'timestamp':nano, 'instrument_token':token,
+            'last_price':price, 'last_traded_quantity':5,
+            'average_traded_price':price, 'volume_traded':volume,
+            'total_buy_quantity':100, 'total_sell_quantity':200,
+            'open':price - 1, 'high':price + 2, 'low':price - 2,
+            'close':price - 0.5, 'oi':0}
+
+def parse(message):
+    return KiteTicker("key", "token")._parse_binary(message)
+
+class TestTickFiles(unittest.TestCase):
+    
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'ticks', 'ticks.csv')
+    
+    def tearDown(self):
+        shutil.rmtree(self.root)
+    
+    def test_round_trip(self):
+        dt = pd.Timestamp(t0 + 5*NANO_SECOND, tz='Asia/Calcutta')
+        ticks = [{'instrument_token':EQUITY, 'last_price':100.5,
+                  'volume_traded':1000, 'exchange_timestamp':dt,
+                  'ohlc':{'open':99, 'high':101, 'low':98, 'close':97}},
+                 {'instrument_token':INDEX, 'last_price':11000.25}]
+        
+        recorder = TickRecorder(self.path)
+        recorder.write(ticks, t0 + 10*NANO_SECOND)
+        recorder.close()
+        # appends to the same file, without a second header
+        recorder = TickRecorder(self.path)
+        recorder.write(ticks[:1], t0)
+        recorder.close()
+        
+        df = read_ticks(self.path)
+        self.assertEqual(list(df.columns), TICK_COLUMNS)
+        self.assertEqual(list(df['timestamp']),
+                         [t0 + 5*NANO_SECOND]*2 + [t0 + 10*NANO_SECOND])
+        self.assertEqual(list(df['instrument_token']),
+                         [EQUITY, EQUITY, INDEX])
+        self.assertEqual(list(df['high']), [101, 101, 0])
+        self.assertEqual(list(df['volume_traded']), [1000, 1000, 0])
+    
+    def test_read_ticks(self):
+        self.assertRaises(MissingDataError, read_ticks, self.path)
+        
+        # missing columns are filled in
+        os.makedirs(os.path.dirname(self.path))
+        pd.DataFrame({'timestamp':[t0 + 1, t0],
+                      'instrument_token':[EQUITY, INDEX],
+                      'last_price':[10, 20]}).to_csv(self.path,
+                                                     index=False)
+        df = read_ticks(self.path)
+        self.assertEqual(list(df.columns), TICK_COLUMNS)
+        self.assertEqual(list(df['instrument_token']), [INDEX, EQUITY])
+        self.assertEqual(list(df['oi']), [0, 0])
+    
+    def test_tick_nano(self):
+        dt = pd.Timestamp(t0, tz='Asia/Calcutta').to_pydatetime()
+        self.assertEqual(tick_nano({'exchange_timestamp':dt}), t0)
+        self.assertEqual(tick_nano({'last_trade_time':dt}), t0)
+        self.assertEqual(tick_nano({}, 42), 42)
+
+class TestEncoding(unittest.TestCase):
+    
+    def test_modes(self):
+        tick = make_tick(EQUITY, 100.25, 1000, t0)
+        message = encode_message([encode_packet(tick, 'ltp', t0),
+                                  encode_packet(tick, 'quote', t0),
+                                  encode_packet(tick, 'full', t0)])
+        ltp, quote, full = parse(message)
+        
+        self.assertEqual(ltp['mode'], 'ltp')
+        self.assertEqual(ltp['last_price'], 100.25)
+        self.assertEqual(quote['mode'], 'quote')
+        self.assertEqual(quote['volume_traded'], 1000)
+        self.assertEqual(quote['total_sell_quantity'], 200)
+        self.assertEqual(quote['ohlc'], {'open':99.25, 'high':102.25,
+                                         'low':98.25, 'close':99.75})
+        self.assertEqual(full['mode'], 'full')
+        self.assertEqual(full['last_price'], 100.25)
+        self.assertEqual(tick_nano(full), t0)
+        self.assertIsNone(tick_nano(quote))
+    
+    def test_segments(self):
+        tick = make_tick(INDEX, 11000.5, 0, t0)
+        quote, full = parse(encode_message(
+                [encode_packet(tick, 'quote', t0),
+                 encode_packet(tick, 'full', t0 + NANO_SECOND)]))
+        self.assertFalse(quote['tradable'])
+        self.assertEqual(quote['last_price'], 11000.5)
+        self.assertEqual(quote['ohlc']['high'], 11002.5)
+        self.assertEqual(tick_nano(full), t0 + NANO_SECOND)
+        
+        tick = make_tick(CURRENCY, 71.2345675, 10, t0)
+        ltp, = parse(encode_message([encode_packet(tick, 'ltp', t0)]))
+        self.assertAlmostEqual(ltp['last_price'], 71.2345675)
+
+class TestReplayProtocol(unittest.TestCase):
+    
+    def setUp(self):
+        ticks = pd.DataFrame([make_tick(EQUITY, 100, 10, t0),
+                              make_tick(INDEX, 11000, 0, t0),
+                              make_tick(EQUITY, 101, 20, t0 + NANO_SECOND),
+                              make_tick(EQUITY, 102, 30,
+                                        t0 + 3*NANO_SECOND)])
+        self.server = KiteReplayServer(ticks, speed=2, shift_time=False)
+        self.sent = []
+        self.protocol = KiteReplayProtocol()
+        self.protocol.factory = self.server
+        self.protocol.sendMessage = lambda payload, isBinary: \
+                self.sent.append(parse(payload))
+        self.protocol.onOpen()
+    
+    def tearDown(self):
+        self.protocol.onClose(True, 1000, None)
+    
+    def send(self, action, value):
+        msg = json.dumps({'a':action, 'v':value})
+        self.protocol.onMessage(msg.encode(), False)
+    
+    def step(self):
+        # drive the replay by hand instead of the reactor
+        call = self.protocol._call
+        if call is not None and call.active():
+            call.cancel()
+        self.protocol._step()
+    
+    def test_replay(self):
+        self.send('subscribe', [EQUITY])
+        self.assertIsNotNone(self.protocol._call)
+        self.assertEqual(self.sent, [])
+        
+        # both ticks of the first timestamp, only the subscribed one
+        self.step()
+        self.assertEqual(len(self.sent), 1)
+        tick, = self.sent[0]
+        self.assertEqual((tick['instrument_token'], tick['mode'],
+                          tick['last_price']), (EQUITY, 'quote', 100))
+        # the next one in 1 second, at twice the speed
+        self.assertAlmostEqual(self.protocol._call.getTime() - \
+                               self.protocol._call.seconds(), 0.5, 1)
+        
+        # a new subscription gets the last tick so far
+        self.send('mode', ['full', [EQUITY]])
+        self.send('subscribe', [INDEX])
+        self.assertEqual(len(self.sent), 2)
+        tick, = self.sent[1]
+        self.assertEqual((tick['instrument_token'], tick['last_price']),
+                         (INDEX, 11000))
+        
+        self.step()
+        tick, = self.sent[2]
+        self.assertEqual((tick['mode'], tick['last_price']),
+                         ('full', 101))
+        self.assertEqual(tick_nano(tick), t0 + NANO_SECOND)
+        
+        # nothing after unsubscribe, and the replay ends
+        self.send('unsubscribe', [EQUITY])
+        self.step()
+        self.assertEqual(len(self.sent), 3)
+        self.assertEqual(self.protocol._position, 4)
+    
+    def test_invalid_messages(self):
+        self.protocol.onMessage(b'not json', False)
+        self.protocol.onMessage(json.dumps({'a':'subscribe'}).encode(),
+                                False)
+        self.protocol.onMessage(b'\x00\x01', True)
+        self.assertEqual(self.protocol._modes, {})
+        self.assertIsNone(self.protocol._call)
+    
+    def test_shift_time(self):
+        self.server.shift_time = True
+        self.send('subscribe', [EQUITY])
+        self.send('mode', ['full', [EQUITY]])
+        self.assertGreater(self.protocol._offset, 0)
+        self.step()
+        self.step()
+        tick, = self.sent[-1]
+        self.assertEqual(tick_nano(tick) - tick_nano(self.sent[0][0]),
+                         NANO_SECOND)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Mar  1 10:14:26 2019
+
+@author: prodipta
+"""
+from threading import Thread
+import numpy as np
+import pandas as pd
+import unittest
+
+from blueshift.brokers.zerodha.kitestream import KiteStreamingData
+from blueshift.assets._assets import Equity
+from blueshift.utils.calendars.trading_calendar import TradingCalendar
+from blueshift.utils.exceptions import (MissingDataError,
+                                        UnsupportedFrequency)
+
+trading_calendar = TradingCalendar('NSE_EQ',tz="Asia/Calcutta",
+                                   opens=(9,15,0), closes=(15,30,0),
+                                   weekends=[5,6])
+assets = [Equity(i, f"S{i}") for i in range(1,4)]
+
+class FakeTicker(object):
+    def __init__(self, connected=True):
+        self.connected = connected
+        self.calls = []
+    def is_connected(self):
+        return self.connected
+    def subscribe(self, tokens):
+        self.calls.append(('subscribe', list(tokens)))
+    def set_mode(self, mode, tokens):
+        self.calls.append(('mode', list(tokens)))
+    def close(self):
+        pass
+
+class FakeAssetFinder(object):
+    '''
+        token is 100 times the sid. Records if the tick lock was
+        held during the lookups.
+    '''
+    def __init__(self):
+        self.portal = None
+        self.locked = []
+    def asset_to_id(self, asset):
+        if self.portal is not None:
+            # try the lock from another thread, as it is re-entrant
+            result = []
+            def probe():
+                acquired = self.portal._ticked.acquire(blocking=False)
+                if acquired:
+                    self.portal._ticked.release()
+                result.append(not acquired)
+            thread = Thread(target=probe)
+            thread.start()
+            thread.join()
+            self.locked.append(result[0])
+        return 100*asset.sid
+
+class FakeRESTData(object):
+    def __init__(self):
+        self.calls = []
+    def history(self, assets, fields, nbar, frequency):
+        self.calls.append((nbar, frequency))
+        idx = pd.date_range('2019-02-01', periods=nbar, freq='D',
+                            tz=trading_calendar.tz)
+        return pd.concat({asset:pd.DataFrame(
+                {f:float(asset.sid) for f in fields}, index=idx) \
+                for asset in assets})
+
+def tick(token, price, volume, dt):
+    dt = pd.Timestamp(dt, tz=trading_calendar.tz).to_pydatetime()
+    return {'instrument_token':token, 'last_price':price,
+            'volume_traded':volume, 'exchange_timestamp':dt}
+
+def make_portal(**kwargs):
+    KiteStreamingData.reset()
+    params = {'name':'test', 'api':object(),
+              'trading_calendar':trading_calendar,
+              'asset_finder':FakeAssetFinder(), 'ticker':FakeTicker(),
+              'timeout':0, 'connect':False}
+    params.update(kwargs)
+    return KiteStreamingData(**params)
+
+class TestKiteStreamingData(unittest.TestCase):
+    
+    def setUp(self):
+        self.portal = make_portal(max_bars=3)
+    
+    def feed(self):
+        # two ticks in the first minute, one in each of the next three
+        self.portal._on_ticks(None, [
+                tick(100, 10.0, 1000, '2019-03-01 09:15:05'),
+                tick(200, 20.0, 500, '2019-03-01 09:15:10')])
+        self.portal._on_ticks(None, [
+                tick(100, 12.0, 1010, '2019-03-01 09:15:30'),
+                tick(100, 9.0, 1015, '2019-03-01 09:15:50')])
+        for i, minute in enumerate([16, 17, 18]):
+            self.portal._on_ticks(None, [
+                    tick(100, 11.0 + i, 1020 + 10*i,
+                         f'2019-03-01 09:{minute}:00')])
+    
+    def test_subscribe(self):
+        ticker = self.portal.ticker
+        self.assertEqual(self.portal.subscribe(assets[:2]), [0, 1])
+        self.assertEqual(ticker.calls, [('subscribe', [100, 200]),
+                                        ('mode', [100, 200])])
+        
+        # only the new ones are sent
+        self.assertEqual(self.portal.subscribe(assets[::-1]), [2, 1, 0])
+        self.assertEqual(ticker.calls[2:], [('subscribe', [300]),
+                                            ('mode', [300])])
+        
+        # resubscribed on (re-)connect
+        ticker.calls = []
+        self.portal._on_connect(ticker, None)
+        self.assertEqual(ticker.calls, [('subscribe', [100, 200, 300]),
+                                        ('mode', [100, 200, 300])])
+    
+    def test_subscribe_disconnected(self):
+        portal = make_portal(ticker=FakeTicker(False))
+        self.assertEqual(portal.subscribe(assets), [0, 1, 2])
+        self.assertEqual(portal.ticker.calls, [])
+    
+    def test_lookup_outside_lock(self):
+        finder = self.portal.asset_finder
+        finder.portal = self.portal
+        self.portal.subscribe(assets)
+        self.portal.current(assets[0], 'close')
+        self.assertEqual(len(finder.locked), 4)
+        self.assertFalse(any(finder.locked))
+    
+    def test_grow(self):
+        many = [Equity(i, f"S{i}") for i in range(1, 101)]
+        self.portal.subscribe(many[:1])
+        self.portal._on_ticks(None, [tick(100, 10.0, 1000,
+                                          '2019-03-01 09:15:05')])
+        
+        rows = self.portal.subscribe(many)
+        self.assertEqual(rows, list(range(100)))
+        self.assertEqual(self.portal._bars.shape, (5, 128, 3))
+        self.assertEqual(self.portal.current(many[0], 'close'), 10.0)
+        self.portal._on_ticks(None, [tick(10000, 5.0, 10,
+                                          '2019-03-01 09:15:05')])
+        self.assertEqual(self.portal.current(many[-1], 'close'), 5.0)
+    
+    def test_bars(self):
+        self.portal.subscribe(assets)
+        self.portal._on_ticks(None, [
+                tick(100, 10.0, 1000, '2019-03-01 09:15:05'),
+                tick(100, 12.0, 1010, '2019-03-01 09:15:30'),
+                tick(100, 9.0, 1015, '2019-03-01 09:15:50'),
+                tick(999, 50.0, 10, '2019-03-01 09:15:50')])
+        
+        df = self.portal.current(assets[0], ['open', 'high', 'low',
+                                             'close', 'volume'])
+        self.assertEqual(list(df), [10.0, 12.0, 9.0, 9.0, 15.0])
+        
+        # a new minute, volume is the change in the day volume
+        self.portal._on_ticks(None, [
+                tick(100, 11.0, 1030, '2019-03-01 09:16:00')])
+        df = self.portal.current(assets[0], ['open', 'close', 'volume'])
+        self.assertEqual(list(df), [11.0, 11.0, 15.0])
+        self.assertEqual(self.portal._counts[0], 2)
+    
+    def test_current(self):
+        self.portal.subscribe(assets)
+        self.feed()
+        
+        self.assertEqual(self.portal.current(assets[0], 'last'), 13.0)
+        self.assertTrue(np.isnan(self.portal.current(assets[2], 'close')))
+        
+        s = self.portal.current(assets, 'close')
+        self.assertEqual(list(s.index), assets)
+        self.assertEqual(list(s.values[:2]), [13.0, 20.0])
+        
+        s = self.portal.current(assets[1], ['open', 'volume'])
+        self.assertEqual(list(s.index), ['open', 'volume'])
+        self.assertEqual(list(s), [20.0, 0.0])
+        
+        df = self.portal.current(assets[:2], ['close', 'volume'])
+        self.assertEqual(df.shape, (2, 2))
+        self.assertEqual(df.loc[assets[0], 'volume'], 10.0)
+        
+        self.assertRaises(MissingDataError, self.portal.current,
+                          assets[0], 'vwap')
+    
+    def test_history(self):
+        self.portal.subscribe(assets)
+        self.feed()
+        
+        # the ring buffer has wrapped, the oldest minute is gone
+        s = self.portal.history(assets[0], 'close', 3, '1m')
+        self.assertEqual(list(s), [11.0, 12.0, 13.0])
+        self.assertEqual(list(s.index),
+                         list(pd.date_range('2019-03-01 09:16:00',
+                                            periods=3, freq='min',
+                                            tz=trading_calendar.tz)))
+        
+        df = self.portal.history(assets[0], ['open', 'volume'], 2, '1m')
+        self.assertEqual(list(df['volume']), [10.0, 10.0])
+        
+        self.assertRaises(MissingDataError, self.portal.history,
+                          assets[0], 'close', 4, '1m')
+        self.assertRaises(MissingDataError, self.portal.history,
+                          assets[:2], 'close', 2, '1m')
+        self.assertRaises(UnsupportedFrequency, self.portal.history,
+                          assets[0], 'close', 2, '5m')
+    
+    def test_history_rest(self):
+        rest_data = FakeRESTData()
+        portal = make_portal(max_bars=3, rest_data=rest_data)
+        portal.subscribe(assets)
+        portal._on_ticks(None, [tick(100, 10.0, 1000,
+                                     '2019-03-01 09:15:05')])
+        
+        s = portal.history(assets[0], 'close', 1, '1m')
+        self.assertEqual(list(s), [10.0])
+        self.assertEqual(rest_data.calls, [])
+        
+        df = portal.history(assets[:2], 'last', 5, '1d')
+        self.assertEqual(df.shape, (5, 2))
+        self.assertEqual(list(df[assets[1]]), [2.0]*5)
+        
+        df = portal.history(assets[:2], ['close', 'open'], 10, '1m')
+        self.assertEqual(len(df.loc[assets[0]]), 10)
+        self.assertEqual(rest_data.calls, [(5, '1d'), (10, '1m')])
+
+if __name__ == '__main__':
+    unittest.main()
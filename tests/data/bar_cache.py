@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Feb 27 09:52:31 2019
+
+@author: prodipta
+"""
+import tempfile
+import shutil
+import numpy as np
+import pandas as pd
+import unittest
+
+from blueshift.data.bar_cache import BarCache
+from blueshift.utils.exceptions import UnsupportedFrequency
+from blueshift.utils.types import OHLCV_FIELDS
+
+tz = 'Asia/Calcutta'
+key = 408065
+
+def make_bars(n, start='2019-01-01', base=100.0):
+    '''
+        daily bars with the close at base + k/2 for the k-th bar.
+    '''
+    k = np.arange(n)
+    index = pd.date_range(start, periods=n, freq='D', tz=tz)
+    close = base + k/2
+    return pd.DataFrame({'open':close - 1, 'high':close + 1,
+                         'low':close - 2, 'close':close,
+                         'volume':1000.0 + k}, index=index,
+                        columns=list(OHLCV_FIELDS))
+
+class Broker(object):
+    '''
+        serves the bars from the `market` dataframe, and records the
+        start of each request.
+    '''
+    def __init__(self, market, lookback=None):
+        self.market = market
+        self.lookback = lookback
+        self.calls = []
+    
+    def fetch(self, start):
+        self.calls.append(start)
+        if start is None:
+            return self.market
+        if self.lookback and start < self.market.index[-self.lookback]:
+            return None
+        return self.market[self.market.index >= start]
+    
+    def now(self):
+        # the last bar is still forming
+        return self.market.index[-1] + pd.Timedelta(hours=12)
+
+class TestBarCache(unittest.TestCase):
+    
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cache = BarCache(self.root, name='test', scale=100)
+    
+    def tearDown(self):
+        shutil.rmtree(self.root)
+    
+    def history(self, broker, nbar):
+        return self.cache.history(key, '1d', nbar, broker.fetch, tz=tz,
+                                  now=broker.now())
+    
+    def assert_bars(self, df, expected):
+        self.assertEqual(list(df.index), list(expected.index))
+        np.testing.assert_almost_equal(df.values, expected.values)
+    
+    def test_read_write(self):
+        self.assertEqual(self.cache.length(key, '1d'), 0)
+        df = self.cache.read(key, '1d', tz=tz)
+        self.assertEqual(len(df), 0)
+        self.assertEqual(list(df.columns), list(OHLCV_FIELDS))
+        
+        bars = make_bars(10)
+        now = bars.index[-1] + pd.Timedelta(hours=12)
+        self.assertTrue(self.cache.write(key, '1d', bars, now))
+        # the forming bar is not written
+        self.assertEqual(self.cache.length(key, '1d'), 9)
+        self.assert_bars(self.cache.read(key, '1d', tz=tz), bars[:-1])
+        self.assert_bars(self.cache.read(key, '1d', 3, tz=tz),
+                         bars[-4:-1])
+        # naive UTC without a timezone
+        df = self.cache.read(key, '1d', 3)
+        self.assertIsNone(df.index.tz)
+        self.assertEqual(df.index[-1], bars.index[-2].tz_convert(
+                'UTC').tz_localize(None))
+        
+        # overlapping writes append only the new (completed) bars
+        now = now + pd.Timedelta(days=2)
+        self.assertTrue(self.cache.write(key, '1d', make_bars(12), now))
+        self.assertEqual(self.cache.length(key, '1d'), 11)
+        
+        self.cache.clear(key, '1d')
+        self.assertEqual(self.cache.length(key, '1d'), 0)
+        self.assertRaises(UnsupportedFrequency, self.cache.read, key, '5m')
+    
+    def test_top_up(self):
+        broker = Broker(make_bars(10))
+        df = self.history(broker, 5)
+        self.assertEqual(broker.calls, [None])
+        self.assert_bars(df, broker.market[-5:])
+        self.assertEqual(self.cache.length(key, '1d'), 9)
+        
+        # two more days, only the tail is fetched
+        broker.market = make_bars(12)
+        df = self.history(broker, 5)
+        self.assertEqual(broker.calls[1:], [broker.market.index[8]])
+        self.assert_bars(df, broker.market[-5:])
+        self.assertEqual(self.cache.length(key, '1d'), 11)
+        
+        # the still forming bar is always from the fetch
+        market = broker.market.copy()
+        market.iloc[-1, list(OHLCV_FIELDS).index('close')] = 200
+        broker.market = market
+        df = self.history(broker, 3)
+        self.assertEqual(broker.calls[2:], [market.index[10]])
+        self.assertEqual(df['close'].iloc[-1], 200)
+        self.assertEqual(self.cache.length(key, '1d'), 11)
+    
+    def test_continuation_mismatch(self):
+        broker = Broker(make_bars(10))
+        self.history(broker, 5)
+        
+        # prices adjusted for a corporate action, the last cached bar
+        # does not match any more
+        market = make_bars(11)
+        market[['open', 'high', 'low', 'close']] /= 2
+        broker.market = market
+        df = self.history(broker, 5)
+        self.assertEqual(broker.calls, [None, market.index[8], None])
+        self.assert_bars(df, market[-5:])
+        self.assertEqual(self.cache.length(key, '1d'), 10)
+        self.assert_bars(self.cache.read(key, '1d', tz=tz), market[:-1])
+    
+    def test_rebuild(self):
+        # a gap in the tail (the last cached bar missing)
+        broker = Broker(make_bars(10))
+        self.history(broker, 5)
+        broker.market = make_bars(12).drop(make_bars(12).index[8])
+        df = self.history(broker, 5)
+        self.assertEqual(broker.calls[1:], [make_bars(12).index[8], None])
+        self.assert_bars(df, broker.market[-5:])
+        self.assertEqual(self.cache.length(key, '1d'), 10)
+        
+        # a start the broker cannot serve
+        broker = Broker(make_bars(20), lookback=5)
+        df = self.history(broker, 5)
+        self.assertEqual(broker.calls[1:], [None])
+        self.assert_bars(df, broker.market[-5:])
+        
+        # more than cached
+        broker = Broker(make_bars(20))
+        df = self.history(broker, 30)
+        self.assertEqual(broker.calls, [broker.market.index[18], None])
+        self.assertEqual(len(df), 20)
+    
+    def test_overflow(self):
+        # the scaled prices do not fit in int32, nothing is cached
+        broker = Broker(make_bars(10, base=3e7))
+        df = self.history(broker, 5)
+        self.assert_bars(df, broker.market[-5:])
+        self.assertEqual(self.cache.length(key, '1d'), 0)
+        self.history(broker, 5)
+        self.assertEqual(broker.calls, [None, None])
+        self.assertFalse(self.cache.write(key, '1d', broker.market,
+                                          broker.now()))
+        
+        # nor do the timestamps
+        broker = Broker(make_bars(10, start='2038-01-15'))
+        df = self.history(broker, 5)
+        self.assert_bars(df, broker.market[-5:])
+        self.assertEqual(self.cache.length(key, '1d'), 0)
+        
+        # missing values
+        bars = make_bars(10)
+        bars.iloc[3, 0] = np.nan
+        self.assertFalse(self.cache.write(key, '1d', bars,
+                                          Broker(bars).now()))
+        self.assertEqual(self.cache.length(key, '1d'), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Dec  6 15:12:08 2018
+
+@author: prodipta
+"""
+import tempfile
+import shutil
+import numpy as np
+import pandas as pd
+import unittest
+
+from blueshift.data.interfaces.bcolzio import (BcolzSchema, BColzWriter,
+                                               BColzReader, ScaledArray)
+from blueshift.utils.exceptions import MissingDataError
+from blueshift.utils.types import OHLCV_FIELDS
+
+sid = 1
+nrows = 100
+start = pd.Timestamp('2019-01-01 03:45:00')
+
+def make_data(n=nrows, offset=0):
+    '''
+        minute bars with the close as 10000 + k for the k-th bar.
+    '''
+    k = np.arange(offset, offset + n)
+    index = pd.date_range(start + pd.Timedelta(minutes=offset), 
+                          periods=n, freq='min')
+    return pd.DataFrame({'open':10000+k, 'high':10000+k, 'low':10000+k,
+                         'close':10000+k, 'volume':k}, 
+                        index=index).astype(np.int32)
+
+def make_writer(root, **kwargs):
+    meta_data = {BColzWriter.SCALE_KEY:100, 
+                 BColzWriter.NOSCALE_KEY:['volume']}
+    schema = BcolzSchema(root, prefixes=['minute'])
+    return BColzWriter(len(OHLCV_FIELDS), list(OHLCV_FIELDS), meta_data,
+                       schema=schema, **kwargs)
+
+class TestBColzWriter(unittest.TestCase):
+    
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        
+    def read(self, writer):
+        reader = BColzReader(writer._schema)
+        return reader.read_dataframe(sid)
+        
+    def test_incremental(self):
+        writer = make_writer(self.root)
+        self.assertEqual(writer.write_dataframe(sid, make_data(50)), 50)
+        # an overlapping write appends only the new rows
+        self.assertEqual(writer.write_dataframe(sid, make_data()), 50)
+        self.assertEqual(writer.write_dataframe(sid, make_data()), 0)
+        self.assertEqual(writer.write_dataframe(sid, make_data(0)), 0)
+        
+        df = self.read(writer)
+        self.assertEqual(len(df), nrows)
+        self.assertTrue(df.index.is_unique)
+        self.assertEqual(writer.verify(sid), [])
+        
+    def test_not_incremental(self):
+        writer = make_writer(self.root, incremental=False)
+        writer.write_dataframe(sid, make_data(50))
+        self.assertEqual(writer.write_dataframe(sid, make_data()), nrows)
+        self.assertEqual(len(self.read(writer)), 50 + nrows)
+        
+    def test_checksums(self):
+        writer = make_writer(self.root)
+        writer.CHECKSUM_BLOCK = 10
+        writer.write_dataframe(sid, make_data(25))
+        ct = writer._ensure_ctable(sid)
+        before = list(ct.attrs[BColzWriter.CHECKSUMS_KEY])
+        self.assertEqual(len(before), 3)
+        
+        # the append rehashes the last partial block onwards only
+        writer.write_dataframe(sid, make_data(10, 25))
+        ct = writer._ensure_ctable(sid)
+        after = list(ct.attrs[BColzWriter.CHECKSUMS_KEY])
+        self.assertEqual(len(after), 4)
+        self.assertEqual(after[:2], before[:2])
+        self.assertNotEqual(after[2], before[2])
+        self.assertEqual(writer.verify(sid), [])
+        
+        # same as writing all in one go
+        other = make_writer(tempfile.mkdtemp(dir=self.root))
+        other.CHECKSUM_BLOCK = 10
+        other.write_dataframe(sid, make_data(35))
+        ct = other._ensure_ctable(sid)
+        self.assertEqual(list(ct.attrs[BColzWriter.CHECKSUMS_KEY]), after)
+        
+    def test_checksum_mismatch(self):
+        writer = make_writer(self.root)
+        writer.CHECKSUM_BLOCK = 10
+        writer.write_dataframe(sid, make_data(35))
+        
+        ct = writer._ensure_ctable(sid)
+        ct['close'][22] = 0
+        ct.flush()
+        self.assertEqual(writer.verify(sid), [2])
+        self.assertRaises(MissingDataError, writer.verify, 2)
+        
+class TestBColzReader(unittest.TestCase):
+    
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        make_writer(self.root).write_dataframe(sid, make_data())
+        self.reader = BColzReader(BcolzSchema(self.root, 
+                                              prefixes=['minute']))
+        
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        
+    def test_search_range(self):
+        reader = self.reader
+        ct, _, _ = reader.read_ctable(sid)
+        ts = ct[BColzReader.INDEX_NAME]
+        t10 = start + pd.Timedelta(minutes=10)
+        t20 = start + pd.Timedelta(minutes=20)
+        
+        self.assertEqual(reader.search_range(ts), (0, nrows))
+        # both ends inclusive, timestamps or seconds
+        self.assertEqual(reader.search_range(ts, t10, t20), (10, 21))
+        self.assertEqual(reader.search_range(ts, t10.value//10**9, 
+                                             t20.value//10**9), (10, 21))
+        self.assertEqual(reader.search_range(ts, t10, t20, nbars=5), 
+                         (16, 21))
+        self.assertEqual(reader.search_range(ts, end_dt=t20, nbars=5), 
+                         (16, 21))
+        self.assertEqual(reader.search_range(ts, lo=50), (50, nrows))
+        
+        # between bars and out of the range
+        t = t10 + pd.Timedelta(seconds=30)
+        self.assertEqual(reader.search_range(ts, t, t), (11, 11))
+        t = start - pd.Timedelta(days=1)
+        self.assertEqual(reader.search_range(ts, end_dt=t), (0, 0))
+        
+    def test_read_range(self):
+        t10 = start + pd.Timedelta(minutes=10)
+        t20 = start + pd.Timedelta(minutes=20)
+        index, data = self.reader.read_range(sid, ['close', 'volume'], 
+                                             t10, t20)
+        
+        self.assertEqual(list(data.keys()), ['close', 'volume'])
+        self.assertEqual(index[0], t10.value//10**9)
+        self.assertEqual(len(index), 11)
+        self.assertIsInstance(data['close'], ScaledArray)
+        self.assertTrue(np.allclose(data['close'].values, 
+                                    100 + np.arange(10, 21)/100))
+        # volume is not scaled
+        self.assertTrue(np.allclose(data['volume'].values, 
+                                    np.arange(10, 21)))
+        
+        index, data = self.reader.read_range(sid)
+        self.assertEqual(list(data.keys()), list(OHLCV_FIELDS))
+        self.assertEqual(len(index), nrows)
+        
+    def test_read_dataframe(self):
+        df = self.reader.read_dataframe(sid, ['close'], nbars=3)
+        self.assertEqual(list(df.columns), ['close'])
+        self.assertEqual(df.index[-1], start + pd.Timedelta(minutes=99))
+        self.assertTrue(np.allclose(df['close'].values, 
+                                    [100.97, 100.98, 100.99]))
+        
+        # a range with no rows
+        t = start - pd.Timedelta(days=1)
+        df = self.reader.read_dataframe(sid, ['close', 'volume'], 
+                                        end_dt=t)
+        self.assertEqual(len(df), 0)
+        self.assertEqual(list(df.columns), ['close', 'volume'])
+        
+    def test_missing(self):
+        self.assertRaises(MissingDataError, self.reader.read_ctable, 2)
+        self.assertRaises(MissingDataError, self.reader.read_range, sid,
+                          ['vwap'])
+        
+    def test_scaled_array(self):
+        raw = np.array([100, 250, -50], dtype=np.int32)
+        arr = ScaledArray(raw, 100)
+        self.assertEqual(len(arr), 3)
+        self.assertTrue(np.allclose(arr.values, [1, 2.5, -0.5]))
+        self.assertAlmostEqual(arr[1], 2.5)
+        self.assertTrue(np.allclose(arr[1:], [2.5, -0.5]))
+        self.assertEqual(np.asarray(arr, dtype=np.float32).dtype, 
+                         np.float32)
+        
+        arr = ScaledArray(raw)
+        self.assertEqual(arr.values.dtype, np.float64)
+        self.assertTrue(np.allclose(arr.values, raw))
+        
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Dec 10 11:21:45 2018
+
+@author: prodipta
+"""
+import tempfile
+import shutil
+import numpy as np
+import pandas as pd
+import unittest
+
+from blueshift.data.dataportal import DBDataPortal
+from blueshift.data.interfaces.bcolzio import BcolzSchema, BColzWriter
+from blueshift.assets._assets import Equity
+from blueshift.utils.calendars.trading_calendar import TradingCalendar
+from blueshift.utils.types import OHLCV_FIELDS
+
+trading_calendar = TradingCalendar('NSE_EQ',tz="Asia/Calcutta",
+                                   opens=(9,15,0), closes=(15,30,0),
+                                   weekends=[5,6])
+tz = trading_calendar.tz
+asset = Equity(1, "AAA")
+missing = Equity(2, "BBB")
+day1 = pd.Timestamp('2019-01-01')
+day2 = pd.Timestamp('2019-01-02')
+
+def write_store(root):
+    '''
+        minute bars for all of day1 and day2, the close for the k-th 
+        bar is 100 + k/100 and the volume is 1.
+    '''
+    grid = trading_calendar.minute_grid(1)
+    start, end = trading_calendar.session_range(day1, day2)
+    nanos = grid.bars(start, end)
+    k = np.arange(len(nanos))
+    df = pd.DataFrame({'open':10000+k, 'high':10000+k, 'low':10000+k,
+                       'close':10000+k, 'volume':np.ones(len(k))},
+                      index=pd.to_datetime(nanos)).astype(np.int32)
+    
+    meta_data = {BColzWriter.SCALE_KEY:100, 
+                 BColzWriter.NOSCALE_KEY:['volume']}
+    schema = BcolzSchema(root, prefixes=['minute'])
+    writer = BColzWriter(len(OHLCV_FIELDS), list(OHLCV_FIELDS),
+                         meta_data, schema=schema)
+    writer.write_dataframe(asset.sid, df)
+
+def nano(day, hour, minute):
+    return pd.Timestamp(day.replace(hour=hour, minute=minute), tz=tz).value
+
+class TestDBDataPortal(unittest.TestCase):
+    
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        write_store(self.root)
+        self.portal = DBDataPortal(name="test", root=self.root,
+                                   trading_calendar=trading_calendar)
+        
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        
+    def test_current(self):
+        portal = self.portal
+        
+        # at the open, the first bar
+        portal.set_timestamp(nano(day1, 9, 15))
+        self.assertAlmostEqual(portal.current(asset, 'close'), 100)
+        self.assertEqual(portal.current(asset, 'volume'), 1)
+        
+        # at and after the last bar of the session
+        portal.set_timestamp(nano(day1, 15, 29))
+        self.assertAlmostEqual(portal.current(asset, 'close'), 103.74)
+        portal.set_timestamp(nano(day1, 15, 45))
+        self.assertAlmostEqual(portal.current(asset, 'last'), 103.74)
+        
+        # before the open, carried forward with no volume
+        portal.set_timestamp(nano(day2, 9, 0))
+        current = portal.current(asset, ['close', 'volume'])
+        self.assertAlmostEqual(current['close'], 103.74)
+        self.assertEqual(current['volume'], 0)
+        
+        portal.set_timestamp(nano(day2, 9, 15))
+        self.assertAlmostEqual(portal.current(asset, 'close'), 103.75)
+        
+    def test_current_missing(self):
+        self.portal.set_timestamp(nano(day1, 10, 0))
+        self.assertTrue(np.isnan(self.portal.current(missing, 'close')))
+        
+        current = self.portal.current([asset, missing], 'close')
+        self.assertAlmostEqual(current[asset], 100.45)
+        self.assertTrue(np.isnan(current[missing]))
+        
+    def test_history(self):
+        portal = self.portal
+        
+        # across the session boundary
+        portal.set_timestamp(nano(day2, 9, 16))
+        df = portal.history(asset, ['close', 'volume'], 3, '1m')
+        self.assertEqual(list(df.index), 
+                         [pd.Timestamp(day1.replace(hour=15, minute=29), 
+                                       tz=tz),
+                          pd.Timestamp(day2.replace(hour=9, minute=15), 
+                                       tz=tz),
+                          pd.Timestamp(day2.replace(hour=9, minute=16), 
+                                       tz=tz)])
+        self.assertTrue(np.allclose(df['close'].values, 
+                                    [103.74, 103.75, 103.76]))
+        
+        # before the open, only till the last close
+        portal.set_timestamp(nano(day2, 9, 0))
+        close = portal.history(asset, 'close', 2, '1m')
+        self.assertTrue(np.allclose(close.values, [103.73, 103.74]))
+        
+    def test_history_daily(self):
+        portal = self.portal
+        portal.set_timestamp(nano(day2, 10, 0))
+        df = portal.history(asset, ['open', 'close', 'volume'], 2, '1d')
+        
+        self.assertEqual(len(df), 2)
+        self.assertTrue(np.allclose(df['open'].values, [100, 103.75]))
+        self.assertTrue(np.allclose(df['close'].values, [103.74, 104.20]))
+        self.assertTrue(np.allclose(df['volume'].values, [375, 46]))
+        
+    def test_history_missing(self):
+        self.portal.set_timestamp(nano(day1, 10, 0))
+        df = self.portal.history(missing, ['close', 'volume'], 5, '1m')
+        self.assertEqual(len(df), 0)
+        self.assertEqual(list(df.columns), ['close', 'volume'])
+        
+        df = self.portal.history([asset, missing], 'close', 5, '1m')
+        self.assertEqual(len(df), 5)
+        self.assertTrue(df[missing].isnull().all())
+        
+        df = self.portal.history([asset, missing], ['close'], 5, '1d')
+        self.assertEqual(len(df.loc[asset]), 1)
+        
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Dec  5 16:02:11 2018
+
+@author: prodipta
+"""
+import os
+import tempfile
+import shutil
+import numpy as np
+import pandas as pd
+import unittest
+
+from blueshift.data.ingestors.ingestor import (OHLCVCSVtoBColzIngestor,
+                                               DataTransform)
+from blueshift.data.interfaces.bcolzio import BcolzSchema, BColzReader
+from blueshift.utils.exceptions import ValidationError
+
+nrows = 2000
+sid_map = {'A':1, 'B':2, 'C':3}
+
+def identity(col):
+    return DataTransform(lambda x:x, [col], True)
+
+transformation = {'timestamp':DataTransform(pd.to_datetime, ['dt'], True),
+                  'symbol':identity('symbol'),
+                  'open':identity('o'),
+                  'high':identity('h'),
+                  'low':identity('l'),
+                  'close':identity('c'),
+                  'volume':identity('v'),
+                  'adj_ratio':DataTransform(lambda x:np.ones(len(x)), 
+                                            ['o'], True)}
+
+def write_csv(path, shuffle=False):
+    dts = pd.date_range('2019-01-01 09:15:00', periods=nrows, freq='min')
+    frames = []
+    for sym in sid_map:
+        frames.append(pd.DataFrame({'symbol':sym, 'dt':dts, 
+                                    'o':100.0, 'h':101.0, 'l':99.0, 
+                                    'c':np.arange(nrows)/100 + 100,
+                                    'v':10}))
+    df = pd.concat(frames, ignore_index=True)
+    if shuffle:
+        df = df.sample(frac=1, random_state=7)
+    df.to_csv(path, index=False)
+
+class TestIngestor(unittest.TestCase):
+    
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.dest = os.path.join(self.root, 'data')
+        self.src = os.path.join(self.root, 'data.csv')
+        
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        
+    def make_ingestor(self, **kwargs):
+        return OHLCVCSVtoBColzIngestor(frequency='1m', 
+                                       transformation=transformation,
+                                       index_col='timestamp', 
+                                       sid_map=sid_map, dest=self.dest, 
+                                       tz='Asia/Calcutta', **kwargs)
+        
+    def read(self, sid):
+        reader = BColzReader(BcolzSchema(self.dest, prefixes=['minute']))
+        return reader.read_dataframe(sid)
+        
+    def test_sorted(self):
+        write_csv(self.src)
+        ingestor = self.make_ingestor(flush_size=700, chunksize=500)
+        self.assertEqual(ingestor.ingest(self.src), 
+                         {sid:nrows for sid in sid_map.values()})
+        
+        df = self.read(1)
+        self.assertEqual(len(df), nrows)
+        self.assertTrue(df.index.is_monotonic_increasing)
+        # naive source timestamps are in the source timezone
+        self.assertEqual(df.index[0], pd.Timestamp('2019-01-01 03:45:00'))
+        self.assertAlmostEqual(df['close'].iloc[-1], 119.99)
+        
+        # re-ingesting the same file appends nothing
+        self.assertEqual(ingestor.ingest(self.src), 
+                         {sid:0 for sid in sid_map.values()})
+        
+    def test_unsorted_single_batch(self):
+        # unsorted input is fine if each sid is written in one batch
+        write_csv(self.src, shuffle=True)
+        ingestor = self.make_ingestor(chunksize=500)
+        self.assertEqual(ingestor.ingest(self.src), 
+                         {sid:nrows for sid in sid_map.values()})
+        self.assertTrue(self.read(2).index.is_monotonic_increasing)
+        
+    def test_unsorted(self):
+        write_csv(self.src, shuffle=True)
+        ingestor = self.make_ingestor(flush_size=700, chunksize=500)
+        self.assertRaises(ValidationError, ingestor.ingest, self.src)
+        
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Feb 18 10:12:41 2019
+
+@author: prodipta
+"""
+import pandas as pd
+import unittest
+
+from blueshift.execution.backtester import BackTester, BackTesterAPI
+from blueshift.trades._order import Order
+from blueshift.trades._order_types import OrderSide
+from blueshift.assets._assets import Equity, EquityFutures
+from blueshift.trades._order_types import OrderStatus
+from blueshift.utils.calendars.trading_calendar import TradingCalendar
+from blueshift.utils.types import BrokerType
+
+trading_calendar = TradingCalendar('NSE_EQ',tz="Asia/Calcutta",
+                                   opens=(9,15,0), closes=(15,30,0),
+                                   weekends=[5,6])
+capital = 1000000
+asset = Equity(1, "AAA")
+ORDER_IDS = ['oid', 'hashed_oid', 'broker_order_id', 'exchange_order_id']
+
+class FlatPriceData(object):
+    '''
+        minimal data portal, every field at the set price.
+    '''
+    def __init__(self, price):
+        self.price = price
+        
+    def current(self, assets, fields):
+        if isinstance(fields, str):
+            return pd.Series(self.price, index=assets)
+        data = {f:[1e6 if f=='volume' else self.price]*len(assets) \
+                for f in fields}
+        return pd.DataFrame(data, index=assets)
+
+def round_trip(**kwargs):
+    data = FlatPriceData(100)
+    broker = BackTester("test", trading_calendar, capital, 
+                        data_portal=data, **kwargs)
+    ts = pd.Timestamp("2019-02-18 09:30:00", tz="Asia/Calcutta")
+    
+    broker.place_order(Order(100, OrderSide.BUY, asset))
+    broker.trading_bar(ts)
+    
+    data.price = 105
+    broker.trading_bar(ts + pd.Timedelta(minutes=1))
+    mid = broker._account.to_dict()
+    
+    broker.place_order(Order(100, OrderSide.SELL, asset))
+    data.price = 110
+    broker.trading_bar(ts + pd.Timedelta(minutes=2))
+    broker.after_trading_hours(ts + pd.Timedelta(hours=6))
+    
+    return mid, broker._account.to_dict()
+
+def api_round_trip(direct_call):
+    data = FlatPriceData(100)
+    api = BackTesterAPI("test", BrokerType.BACKTESTER, trading_calendar,
+                        capital, data_portal=data, direct_call=direct_call)
+    ts = pd.Timestamp("2019-02-18 09:30:00", tz="Asia/Calcutta")
+    
+    api.algo_start(ts)
+    api.before_trading_start(ts)
+    order_id = api.place_order(Order(100, OrderSide.BUY, asset))
+    api.trading_bar(ts)
+    data.price = 105
+    api.trading_bar(ts + pd.Timedelta(minutes=1))
+    api.heart_beat(ts + pd.Timedelta(minutes=1))
+    
+    # the order ids are random
+    order = {k:v for k,v in api.order(order_id).to_dict().items() \
+             if k not in ORDER_IDS}
+    
+    return (order, api.open_orders, 
+            {a:p.to_dict() for a,p in api.positions.items()},
+            api.account)
+
+class TestBackTester(unittest.TestCase):
+    
+    def test_spot_round_trip(self):
+        for kwargs in [{}, {'mark_to_market':False}]:
+            mid, end = round_trip(**kwargs)
+            if kwargs.get('mark_to_market', True):
+                self.assertAlmostEqual(mid['net'], capital + 500, 
+                                       delta=1)
+                self.assertAlmostEqual(mid['mtm'], 500, delta=1)
+            self.assertAlmostEqual(mid['liquid_value'], capital, 
+                                   delta=1)
+            self.assertAlmostEqual(end['net'], capital + 1000, delta=1)
+            self.assertAlmostEqual(end['cash'], capital + 1000, delta=1)
+            self.assertAlmostEqual(end['holdings'], 0, delta=1)
+            
+    def test_rejection_margins(self):
+        # the sell releases margin only if the earlier buy fills, once
+        # the buy is rejected it blocks margin and must be rejected too.
+        futures = EquityFutures(2, symbol="AAA-I")
+        broker = BackTester("test", trading_calendar, 1000, 
+                            data_portal=FlatPriceData(100))
+        ts = pd.Timestamp("2019-02-18 09:30:00", tz="Asia/Calcutta")
+        
+        buy = broker.place_order(Order(150, OrderSide.BUY, futures))
+        sell = broker.place_order(Order(140, OrderSide.SELL, futures))
+        broker.trading_bar(ts)
+        
+        for response in [buy, sell]:
+            order = broker._closed_orders[response['data']]
+            self.assertEqual(order.status, OrderStatus.REJECTED)
+        self.assertEqual(broker._open_positions, {})
+        self.assertAlmostEqual(broker._account.cash, 1000, delta=1e-6)
+        
+    def test_fills_match_reconcile(self):
+        # the per fill update from the book matches a full rescan
+        data = FlatPriceData(100)
+        broker = BackTester("test", trading_calendar, capital, 
+                            data_portal=data, mark_to_market=False)
+        ts = pd.Timestamp("2019-02-18 09:30:00", tz="Asia/Calcutta")
+        futures = EquityFutures(2, symbol="AAA-I")
+        
+        trades = [(asset, OrderSide.BUY, 100), (futures, OrderSide.SELL, 50),
+                  (asset, OrderSide.SELL, 40), (futures, OrderSide.BUY, 50),
+                  (asset, OrderSide.BUY, 10)]
+        for i, (traded, side, qty) in enumerate(trades):
+            data.price = 100 + 5*i
+            broker.place_order(Order(qty, side, traded))
+            broker.trading_bar(ts + pd.Timedelta(minutes=i))
+            incremental = broker._account.to_dict()
+            broker.reconcile()
+            for key, value in broker._account.to_dict().items():
+                if isinstance(value, float):
+                    self.assertAlmostEqual(incremental[key], value, 
+                                           delta=1e-2)
+        
+        self.assertNotIn(futures, broker._open_positions)
+        self.assertEqual(broker._open_positions[asset].quantity, 70)
+        
+class TestBackTesterAPI(unittest.TestCase):
+    
+    def test_direct_call(self):
+        # the in-process dispatch must match the generator protocol
+        direct = api_round_trip(True)
+        sent = api_round_trip(False)
+        
+        order, open_orders, positions, account = direct
+        self.assertEqual(order['filled'], 100)
+        self.assertEqual(open_orders, {})
+        self.assertAlmostEqual(account['mtm'], 500, delta=1)
+        for x, y in zip(direct, sent):
+            self.assertEqual(x, y)
+            
+if __name__ == '__main__':
+    unittest.main()
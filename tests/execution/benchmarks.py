@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Feb 18 14:20:05 2019
+
+@author: prodipta
+
+per-call overhead of the backtest broker API, with the in-process
+(direct) dispatch and with the generator protocol. Run as a script:
+
+    python tests/execution/benchmarks.py [number of calls]
+
+"""
+import sys
+import timeit
+import pandas as pd
+
+from blueshift.execution.backtester import BackTesterAPI
+from blueshift.trades._order import Order
+from blueshift.trades._order_types import OrderSide
+from blueshift.assets._assets import Equity
+from blueshift.utils.calendars.trading_calendar import TradingCalendar
+from blueshift.utils.types import BrokerType
+
+trading_calendar = TradingCalendar('NSE_EQ',tz="Asia/Calcutta",
+                                   opens=(9,15,0), closes=(15,30,0),
+                                   weekends=[5,6])
+capital = 1000000
+ts = pd.Timestamp("2019-02-18 09:30:00", tz="Asia/Calcutta")
+
+class FlatPriceData(object):
+    '''
+        minimal data portal, every field at the set price.
+    '''
+    def __init__(self, price):
+        self.price = price
+    
+    def current(self, assets, fields):
+        if isinstance(fields, str):
+            return pd.Series(self.price, index=assets)
+        data = {f:[1e6 if f=='volume' else self.price]*len(assets) \
+                for f in fields}
+        return pd.DataFrame(data, index=assets)
+
+def make_api(direct_call, n_assets=10):
+    '''
+        A backtest broker with a position in each of the assets.
+    '''
+    api = BackTesterAPI("bench", BrokerType.BACKTESTER, trading_calendar,
+                        capital, data_portal=FlatPriceData(100),
+                        direct_call=direct_call)
+    for i in range(n_assets):
+        api.place_order(Order(10, OrderSide.BUY, Equity(i+1, f"A{i}")))
+    api.trading_bar(ts)
+    return api
+
+def bench_calls(direct_call, number):
+    '''
+        Microseconds per call for the queries and events hit on
+        every bar.
+    '''
+    api = make_api(direct_call)
+    calls = {'positions':lambda:api.positions,
+             'open_orders':lambda:api.open_orders,
+             'account':lambda:api.account,
+             'heart_beat':lambda:api.heart_beat(ts)}
+    
+    return {name:1e6*min(timeit.repeat(func, number=number, repeat=3))\
+                /number for name, func in calls.items()}
+
+def bench_execution(n_orders, number=20):
+    '''
+        Milliseconds per trading bar matching `n_orders` new orders.
+    '''
+    api = make_api(True, 0)
+    assets = [Equity(i+1, f"A{i}") for i in range(n_orders)]
+    
+    def bar():
+        for asset in assets:
+            api.place_order(Order(1, OrderSide.BUY, asset))
+        api.trading_bar(ts)
+    
+    return 1e3*min(timeit.repeat(bar, number=number, repeat=3))/number
+
+def run(number=100000):
+    results = pd.DataFrame({'direct':bench_calls(True, number),
+                            'generator':bench_calls(False, number)})
+    results['speedup'] = results['generator']/results['direct']
+    return results
+
+if __name__ == '__main__':
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print(f"microseconds per call ({number} calls):")
+    print(run(number).round(2).to_string())
+    for n_orders in [10, 100, 1000]:
+        print(f"{n_orders} orders per bar: "
+              f"{bench_execution(n_orders):.2f} ms")
@@ -8,7 +8,13 @@ import pandas as pd
 import numpy as np
 from datetime import time
 import unittest
+from unittest import mock
+import tempfile
+import shutil
+from os import path as os_path
+from blueshift.utils.calendars import trading_calendar
 from blueshift.utils.calendars.trading_calendar import TradingCalendar
+from blueshift.utils.exceptions import SessionOutofRange
 
 start_dt = pd.Timestamp('2018-01-01')
 end_dt = pd.Timestamp('2018-12-31')
@@ -17,6 +23,11 @@ dts = [start_dt + pd.Timedelta(days=i) for i in range(time_delta.days+1)]
 utc_cal = TradingCalendar('UTC')
 ist_cal = TradingCalendar('IST',tz='Asia/Calcutta',closes=(15,30,0))
 dts_cal = TradingCalendar('DATES', tz='Asia/Calcutta', bizdays=dts)
+nse_cal = TradingCalendar('NSE',tz='Asia/Calcutta',opens=(9,15,0),
+                          closes=(15,30,0))
+
+def ist_nano(dt):
+    return pd.Timestamp(dt, tz='Asia/Calcutta').value
 
 class TestTradingCalendar(unittest.TestCase):
     def setUp(self):
@@ -85,5 +96,176 @@ class TestTradingCalendar(unittest.TestCase):
         self.assertFalse(ist_cal.is_holiday(dt1))
         self.assertFalse(ist_cal.is_holiday(dt2))
         
+class TestSessionNanos(unittest.TestCase):
+    def test_is_session_nano(self):
+        self.assertTrue(nse_cal.is_session_nano(ist_nano('2018-09-24')))
+        self.assertTrue(nse_cal.is_session_nano(
+                ist_nano('2018-09-24 20:00:00')))
+        self.assertFalse(nse_cal.is_session_nano(ist_nano('2018-09-24')-1))
+        self.assertFalse(nse_cal.is_session_nano(
+                ist_nano('2018-09-22 10:00:00')))
+        self.assertFalse(nse_cal.is_session_nano(
+                int(nse_cal._bizdays[0]) - 1))
+        
+    def test_next_session_nano(self):
+        monday = ist_nano('2018-09-24')
+        self.assertEqual(nse_cal.next_session_nano(
+                ist_nano('2018-09-21 10:00:00')), monday)
+        self.assertEqual(nse_cal.next_session_nano(
+                ist_nano('2018-09-22 10:00:00')), monday)
+        self.assertEqual(nse_cal.next_session_nano(monday - 1), monday)
+        self.assertEqual(nse_cal.next_session_nano(monday),
+                         ist_nano('2018-09-25'))
+        self.assertRaises(SessionOutofRange, nse_cal.next_session_nano,
+                          int(nse_cal._bizdays[-1]))
+        
+    def test_previous_session_nano(self):
+        friday = ist_nano('2018-09-21')
+        self.assertEqual(nse_cal.previous_session_nano(
+                ist_nano('2018-09-24 10:00:00')), friday)
+        self.assertEqual(nse_cal.previous_session_nano(
+                ist_nano('2018-09-24')), friday)
+        self.assertEqual(nse_cal.previous_session_nano(
+                ist_nano('2018-09-23 10:00:00')), friday)
+        self.assertEqual(nse_cal.previous_session_nano(
+                ist_nano('2018-09-22')), friday)
+        self.assertRaises(SessionOutofRange, nse_cal.previous_session_nano,
+                          int(nse_cal._bizdays[0]) + 1)
+        
+class TestBizdaysCache(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cache_file = os_path.join(self.root, 'bizdays.npy')
+        # a calendar definition no other test uses
+        self.weekends = [3]
+        self.expected = self.load(None)
+        
+    def tearDown(self):
+        trading_calendar._BIZDAYS_CACHE.clear()
+        shutil.rmtree(self.root)
+        
+    def load(self, cache_file):
+        trading_calendar._BIZDAYS_CACHE.clear()
+        with mock.patch.object(trading_calendar, '_bizdays_cache_file',
+                               return_value=cache_file):
+            return trading_calendar.default_bizdays('Asia/Calcutta', 
+                                                    self.weekends)
+        
+    def test_no_cache(self):
+        days = pd.to_datetime(self.expected).tz_localize('Etc/UTC').\
+                    tz_convert('Asia/Calcutta')
+        self.assertFalse((days.weekday == 3).any())
+        self.assertEqual(days[0].time(), time(0,0,0))
+        
+    def test_cache(self):
+        bizdays = self.load(self.cache_file)
+        self.assertTrue(os_path.exists(self.cache_file))
+        self.assertTrue(np.all(bizdays == self.expected))
+        
+        # read back from the disk
+        np.save(self.cache_file, self.expected[:5])
+        self.assertTrue(np.all(self.load(self.cache_file) == 
+                               self.expected[:5]))
+        
+    def test_corrupt_cache(self):
+        with open(self.cache_file, 'wb') as fp:
+            fp.write(b'not a numpy file')
+        bizdays = self.load(self.cache_file)
+        self.assertTrue(np.all(bizdays == self.expected))
+        # and rewritten
+        self.assertTrue(np.all(np.load(self.cache_file) == self.expected))
+        
+class TestMinuteGrid(unittest.TestCase):
+    def setUp(self):
+        self.grid = nse_cal.minute_grid(1)
+        self.session = int(np.searchsorted(nse_cal._bizdays, 
+                                           ist_nano('2018-09-24')))
+        
+    def test_shared(self):
+        self.assertIs(nse_cal.minute_grid(1), self.grid)
+        self.assertEqual(self.grid.bars_per_session, 375)
+        self.assertEqual(nse_cal.minute_grid(5).bars_per_session, 75)
+        self.assertEqual(len(self.grid), 375*len(nse_cal._bizdays))
+        
+    def test_session_index(self):
+        grid = self.grid
+        idx = self.session
+        self.assertEqual(grid.session_index(ist_nano('2018-09-24')), idx)
+        self.assertEqual(grid.session_index(
+                ist_nano('2018-09-24 23:59:59')), idx)
+        self.assertEqual(grid.session_index(
+                ist_nano('2018-09-24 00:00:00') - 1), idx - 1)
+        # weekend nanos map to the last session
+        self.assertEqual(grid.session_index(
+                ist_nano('2018-09-23 10:00:00')), idx - 1)
+        self.assertEqual(grid.session_index(
+                int(nse_cal._bizdays[0]) - 1), -1)
+        
+    def test_bar_index(self):
+        grid = self.grid
+        idx = self.session
+        bar = lambda dt:grid.bar_index(ist_nano('2018-09-24 '+dt), idx)
+        self.assertEqual(bar('09:14:59'), -1)
+        self.assertEqual(bar('09:15:00'), 0)
+        self.assertEqual(bar('09:15:59'), 0)
+        self.assertEqual(bar('09:16:00'), 1)
+        self.assertEqual(bar('15:29:00'), 374)
+        # at and after the close, the last bar
+        self.assertEqual(bar('15:30:00'), 374)
+        self.assertEqual(bar('18:00:00'), 374)
+        self.assertEqual(nse_cal.minute_grid(5).bar_index(
+                ist_nano('2018-09-24 09:24:00'), idx), 1)
+        
+    def test_locate(self):
+        grid = self.grid
+        idx = self.session
+        nano = ist_nano('2018-09-24 09:16:00')
+        pos = grid.locate(nano)
+        self.assertEqual(pos, idx*375 + 1)
+        self.assertEqual(grid[pos], nano)
+        self.assertEqual(grid.position(nano + 30*10**9), pos)
+        
+        # not a bar
+        self.assertEqual(grid.locate(nano + 30*10**9), -1)
+        self.assertEqual(grid.locate(ist_nano('2018-09-24 15:30:00')), -1)
+        self.assertEqual(grid.locate(ist_nano('2018-09-22 10:00:00')), -1)
+        self.assertEqual(grid.locate(int(nse_cal._bizdays[0]) - 1), -1)
+        # before the open, the last bar of the previous session
+        self.assertEqual(grid.position(ist_nano('2018-09-24 09:00:00')),
+                         idx*375 - 1)
+        
+    def test_positions(self):
+        grid = self.grid
+        nanos = [int(nse_cal._bizdays[0]) - 1,
+                 ist_nano('2018-09-21 15:29:00'),
+                 ist_nano('2018-09-22 10:00:00'),
+                 ist_nano('2018-09-24 09:00:00'),
+                 ist_nano('2018-09-24 09:15:00'),
+                 ist_nano('2018-09-24 09:15:30'),
+                 ist_nano('2018-09-24 15:30:00'),
+                 ist_nano('2018-09-24 20:00:00')]
+        self.assertEqual(list(grid.positions(nanos)), 
+                         [grid.position(nano) for nano in nanos])
+        
+    def test_bars(self):
+        grid = self.grid
+        idx = self.session
+        bars = grid.bars(idx, idx+2)
+        self.assertEqual(len(bars), 750)
+        self.assertTrue(np.all(bars == grid[idx*375:(idx+2)*375]))
+        
+        minutes = nse_cal.minutes(pd.Timestamp('2018-09-24'),
+                                  pd.Timestamp('2018-09-25'))
+        self.assertEqual(len(minutes), 750)
+        self.assertEqual(minutes[0], 
+                         pd.Timestamp('2018-09-24 09:15:00', 
+                                      tz='Asia/Calcutta'))
+        self.assertEqual(minutes[374], 
+                         pd.Timestamp('2018-09-24 15:29:00', 
+                                      tz='Asia/Calcutta'))
+        self.assertEqual(minutes[375], 
+                         pd.Timestamp('2018-09-25 09:15:00', 
+                                      tz='Asia/Calcutta'))
+        
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
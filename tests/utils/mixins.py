@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Feb 20 15:12:37 2019
+
+@author: prodipta
+"""
+from threading import Thread
+from time import monotonic, sleep
+import unittest
+
+from blueshift.utils.mixins import TokenBucket
+
+# allowance for the scheduler and sleep granularity, in seconds
+SLACK = 0.02
+
+class TestTokenBucket(unittest.TestCase):
+    
+    def test_spacing(self):
+        bucket = TokenBucket(20)
+        self.assertEqual(bucket.rate, 20)
+        self.assertEqual(bucket.period, 1)
+        
+        start = monotonic()
+        waits = [bucket.acquire() for i in range(6)]
+        elapsed = monotonic() - start
+        
+        # the first is free, the rest are spaced at the rate
+        self.assertEqual(waits[0], 0)
+        for wait in waits[1:]:
+            self.assertGreater(wait, 0.05 - SLACK)
+        self.assertGreater(elapsed, 0.25 - SLACK)
+        self.assertLess(elapsed, 0.25 + 5*SLACK)
+    
+    def test_period(self):
+        # 2 calls per 0.1 second
+        bucket = TokenBucket(2, 0.1)
+        start = monotonic()
+        for i in range(5):
+            bucket.acquire()
+        self.assertGreater(monotonic() - start, 0.2 - SLACK)
+    
+    def test_capacity(self):
+        bucket = TokenBucket(10, capacity=3)
+        self.assertEqual([bucket.acquire() for i in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(bucket.acquire(), 0.1, delta=SLACK)
+        
+        # refills while idle, but not beyond the capacity
+        sleep(0.5)
+        self.assertEqual([bucket.acquire() for i in range(3)], [0, 0, 0])
+        self.assertGreater(bucket.acquire(), 0.1 - SLACK)
+    
+    def test_tokens(self):
+        bucket = TokenBucket(10)
+        bucket.acquire()
+        self.assertAlmostEqual(bucket.acquire(3), 0.3, delta=SLACK)
+    
+    def test_update(self):
+        bucket = TokenBucket(1)
+        bucket.acquire()
+        bucket.update(50)
+        self.assertEqual(bucket.rate, 50)
+        self.assertLess(bucket.acquire(), 0.02 + SLACK)
+        
+        bucket.update(5, period=0.5, capacity=2)
+        self.assertEqual(bucket.period, 0.5)
+        sleep(0.5)
+        self.assertEqual([bucket.acquire() for i in range(2)], [0, 0])
+        self.assertAlmostEqual(bucket.acquire(), 0.1, delta=SLACK)
+    
+    def test_threads(self):
+        # no more than the rate across all the threads, and each
+        # caller waits only for its own turn
+        bucket = TokenBucket(25)
+        times = []
+        def worker():
+            bucket.acquire()
+            times.append(monotonic())
+        
+        start = monotonic()
+        threads = [Thread(target=worker) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        times = sorted(times)
+        self.assertEqual(len(times), 8)
+        self.assertLess(times[0] - start, SLACK)
+        for i, t in enumerate(times):
+            self.assertGreater(t - times[0], i*0.04 - SLACK)
+        self.assertLess(times[-1] - start, 7*0.04 + 5*SLACK)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,55 +1,184 @@
 import pandas as pd
+import unittest
 
 from blueshift.utils.calendars.trading_calendar import TradingCalendar
 from blueshift.utils.scheduler import (TimeRule, TimeEvent, Scheduler,
                                        date_rules, time_rules)
+from blueshift.utils.exceptions import ScheduleFunctionError
 
 start_dt = pd.Timestamp('2017-01-01')
 end_dt = pd.Timestamp('2017-01-28')
 trading_calendar = TradingCalendar('NSE_EQ',tz="Asia/Calcutta",
                                    opens=(9,15,0), closes=(15,30,0),
                                    weekends=[5,6])
+tz = trading_calendar.tz
+# with a holiday on Friday, 13th January
+holidays = [pd.Timestamp('2017-01-13')]
+bizdays = [dt for dt in pd.date_range('2016-12-01', '2017-02-28') \
+           if dt not in holidays]
+holiday_calendar = TradingCalendar('HOLIDAYS',tz="Asia/Calcutta",
+                                   opens=(9,15,0), closes=(15,30,0),
+                                   bizdays=bizdays, weekends=[5,6])
 
-rule1 = TimeRule(date_rules.month_start(1), 
-                time_rules.market_open(minutes=10), 
-                start_dt= start_dt, end_dt = end_dt, 
-                trading_calendar = trading_calendar)
-
-rule2 = TimeRule(date_rules.every_day(), 
-                time_rules.every_nth_hour(hours=2), 
-                start_dt= start_dt, end_dt = end_dt, 
-                trading_calendar = trading_calendar)
-
-rule3 = TimeRule(date_rules.month_end(3), 
-                time_rules.BeforeClose(minutes=10), 
-                start_dt= start_dt, end_dt = end_dt, 
-                trading_calendar = trading_calendar)
+def days(*dts):
+    return [pd.Timestamp(dt, tz=tz).value for dt in dts]
 
-def f1(context, data):
-    pass
-    
-def f2(context, data):
-    pass
-    
-def f3(context, data):
-    pass
+def dt_nano(dt):
+    return pd.Timestamp(dt, tz=tz).value
 
 def clock():
     start = start_dt.value
     end = end_dt.value
     val = start
     while val < end:
-        yield val 
+        yield val
         val = val + 60000000000
 
-e1 = TimeEvent(rule1, f1)
-e2 = TimeEvent(rule2, f2)
-e3 = TimeEvent(rule3, f3)
-scheduler = Scheduler()
-scheduler.add_event(e1)
-scheduler.add_event(e2)
-scheduler.add_event(e3)
+class TestDateRules(unittest.TestCase):
+    
+    def setUp(self):
+        self.sessions = trading_calendar.sessions(
+                pd.Timestamp('2017-01-01', tz=tz),
+                pd.Timestamp('2017-01-31', tz=tz))
+        self.holiday_sessions = holiday_calendar.sessions(
+                pd.Timestamp('2017-01-01', tz=tz),
+                pd.Timestamp('2017-01-31', tz=tz))
+    
+    def test_every_day(self):
+        dts = date_rules.every_day()(self.sessions)
+        self.assertEqual(len(dts), 22)
+        self.assertEqual(list(dts[:2]), days('2017-01-02', '2017-01-03'))
+    
+    def test_week_start(self):
+        self.assertEqual(list(date_rules.week_start()(self.sessions)),
+                         days('2017-01-02', '2017-01-09', '2017-01-16',
+                              '2017-01-23', '2017-01-30'))
+        self.assertEqual(list(date_rules.week_start(1)(self.sessions)),
+                         days('2017-01-03', '2017-01-10', '2017-01-17',
+                              '2017-01-24', '2017-01-31'))
+        # the last week has only two sessions
+        self.assertEqual(list(date_rules.week_start(2)(self.sessions)),
+                         days('2017-01-04', '2017-01-11', '2017-01-18',
+                              '2017-01-25'))
+    
+    def test_week_end(self):
+        # the partial last week ends on the last session
+        self.assertEqual(list(date_rules.week_end()(self.sessions)),
+                         days('2017-01-06', '2017-01-13', '2017-01-20',
+                              '2017-01-27', '2017-01-31'))
+        self.assertEqual(list(date_rules.week_end(1)(self.sessions)),
+                         days('2017-01-05', '2017-01-12', '2017-01-19',
+                              '2017-01-26', '2017-01-30'))
+        
+        # groups by the week, not the month, across holidays
+        self.assertEqual(list(date_rules.week_end()(
+                self.holiday_sessions))[:2],
+                days('2017-01-06', '2017-01-12'))
+        self.assertEqual(list(date_rules.week_end(2)(
+                self.holiday_sessions))[:2],
+                days('2017-01-04', '2017-01-10'))
+    
+    def test_month_start(self):
+        self.assertEqual(list(date_rules.month_start()(self.sessions)),
+                         days('2017-01-02'))
+        self.assertEqual(list(date_rules.month_start(9)(self.sessions)),
+                         days('2017-01-13'))
+        self.assertEqual(list(date_rules.month_start(9)(
+                self.holiday_sessions)), days('2017-01-16'))
+    
+    def test_month_end(self):
+        self.assertEqual(list(date_rules.month_end()(self.sessions)),
+                         days('2017-01-31'))
+        self.assertEqual(list(date_rules.month_end(3)(self.sessions)),
+                         days('2017-01-26'))
+        self.assertEqual(list(date_rules.month_end(12)(
+                self.holiday_sessions)), days('2017-01-12'))
+    
+    def test_invalid_offsets(self):
+        self.assertRaises(ScheduleFunctionError, date_rules.week_start, 3)
+        self.assertRaises(ScheduleFunctionError, date_rules.week_end, 3)
+        self.assertRaises(ScheduleFunctionError, date_rules.month_start, 16)
+        self.assertRaises(ScheduleFunctionError, date_rules.month_end, 16)
+
+class TestTimeRule(unittest.TestCase):
+    
+    def test_triggers(self):
+        rule = TimeRule(date_rules.month_start(1),
+                        time_rules.market_open(minutes=10),
+                        start_dt= start_dt, end_dt = end_dt,
+                        trading_calendar = trading_calendar)
+        self.assertEqual(next(rule), dt_nano('2017-01-03 09:25:00'))
+        
+        rule = TimeRule(date_rules.month_end(3),
+                        time_rules.BeforeClose(minutes=10),
+                        start_dt= start_dt, end_dt = end_dt,
+                        trading_calendar = trading_calendar)
+        self.assertEqual(next(rule), dt_nano('2017-01-26 15:20:00'))
+        
+        rule = TimeRule(date_rules.every_day(),
+                        time_rules.every_nth_hour(hours=2),
+                        start_dt= start_dt, end_dt = end_dt,
+                        trading_calendar = trading_calendar)
+        self.assertEqual([next(rule) for i in range(4)],
+                         [dt_nano('2017-01-02 09:15:00'),
+                          dt_nano('2017-01-02 11:15:00'),
+                          dt_nano('2017-01-02 13:15:00'),
+                          dt_nano('2017-01-02 15:15:00')])
+        self.assertEqual(next(rule), dt_nano('2017-01-03 09:15:00'))
 
+class TestScheduler(unittest.TestCase):
+    
+    def make_event(self, name, calls, date_rule=None, time_rule=None):
+        rule = TimeRule(date_rule or date_rules.every_day(),
+                        time_rule or time_rules.market_open(minutes=30),
+                        start_dt= start_dt, end_dt = end_dt,
+                        trading_calendar = trading_calendar)
+        return TimeEvent(rule, lambda context, data: calls.append(name))
+    
+    def test_same_nano_order(self):
+        # events due at the same nano run in the order they were added
+        calls = []
+        scheduler = Scheduler()
+        for name in ['c', 'a', 'b']:
+            scheduler.add_event(self.make_event(name, calls))
+        
+        first = dt_nano('2017-01-02 09:45:00')
+        self.assertEqual(scheduler.next_trigger, first)
+        scheduler.trigger_events(None, None, first - 1)
+        self.assertEqual(calls, [])
+        
+        scheduler.trigger_events(None, None, first)
+        self.assertEqual(calls, ['c', 'a', 'b'])
+        scheduler.trigger_events(None, None, first)
+        self.assertEqual(calls, ['c', 'a', 'b'])
+        
+        second = dt_nano('2017-01-03 09:45:00')
+        self.assertEqual(scheduler.next_trigger, second)
+        scheduler.trigger_events(None, None, second)
+        self.assertEqual(calls, ['c', 'a', 'b']*2)
+    
+    def test_run(self):
+        calls = []
+        scheduler = Scheduler()
+        scheduler.add_event(self.make_event('month_end', calls,
+                                            date_rules.month_end(3),
+                                            time_rules.BeforeClose(10)))
+        scheduler.add_event(self.make_event('hourly', calls,
+                                            date_rules.every_day(),
+                                            time_rules.every_nth_hour(2)))
+        scheduler.add_event(self.make_event('month_start', calls,
+                                            date_rules.month_start(1),
+                                            time_rules.market_open(10)))
+        
+        for dt in clock():
+            scheduler.trigger_events(None, None, dt)
+        
+        # 20 sessions, 4 triggers each
+        self.assertEqual(calls.count('hourly'), 80)
+        self.assertEqual(calls.count('month_start'), 1)
+        self.assertEqual(calls.count('month_end'), 1)
+        self.assertEqual(calls[:6], ['hourly']*4 + ['hourly',
+                                                    'month_start'])
 
-for dt in clock():
-    scheduler.trigger_events(None, None, dt)
\ No newline at end of file
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Feb 16 11:05:42 2019
+
+@author: prodipta
+"""
+import pandas as pd
+import unittest
+
+from blueshift.utils.sweep import (parse_param_grid, parse_date_ranges,
+                                   make_jobs, run_sweep, SweepResults)
+from blueshift.utils.exceptions import ValidationError
+from blueshift.utils.types import BacktestJob
+
+def make_perf(values):
+    idx = pd.date_range('2019-01-01', periods=len(values))
+    return pd.DataFrame({'net':values}, index=idx)
+
+class TestParsers(unittest.TestCase):
+    
+    def test_param_grid(self):
+        grid = parse_param_grid(["lookback=10, 20,30", "ratio = 0.5",
+                                 "name=abc,'x y'", "flag=True"])
+        self.assertEqual(grid, {'lookback':[10,20,30], 'ratio':[0.5],
+                                'name':['abc','x y'], 'flag':[True]})
+        
+        # only the first '=' separates the name
+        self.assertEqual(parse_param_grid(["expr=a=b"]), {'expr':['a=b']})
+        self.assertEqual(parse_param_grid([]), {})
+        self.assertRaises(ValidationError, parse_param_grid, ["lookback"])
+    
+    def test_date_ranges(self):
+        ranges = parse_date_ranges(["2019-01-01:2019-06-30",
+                                    " 2019-07-01 : 2019-12-31 "])
+        self.assertEqual(ranges, [(pd.Timestamp('2019-01-01'),
+                                   pd.Timestamp('2019-06-30')),
+                                  (pd.Timestamp('2019-07-01'),
+                                   pd.Timestamp('2019-12-31'))])
+        
+        self.assertRaises(ValidationError, parse_date_ranges,
+                          ["2019-01-01"])
+        self.assertRaises(ValidationError, parse_date_ranges,
+                          ["2019-01-01:2019-06-30:2019-12-31"])
+        self.assertRaises(ValidationError, parse_date_ranges,
+                          ["2019-01-01:notadate"])
+
+class TestMakeJobs(unittest.TestCase):
+    
+    def test_no_params(self):
+        jobs = make_jobs("/algos/momentum.py")
+        self.assertEqual(jobs, [BacktestJob("momentum_0",
+                                            "/algos/momentum.py",
+                                            {}, None, None)])
+    
+    def test_grid(self):
+        dates = [(pd.Timestamp('2019-01-01'), pd.Timestamp('2019-06-30')),
+                 (pd.Timestamp('2019-07-01'), pd.Timestamp('2019-12-31'))]
+        jobs = make_jobs("momentum.py", {'a':[1,2], 'b':['x','y','z']},
+                         dates, name="run")
+        
+        self.assertEqual(len(jobs), 12)
+        self.assertEqual([job.name for job in jobs],
+                         [f"run_{i}" for i in range(12)])
+        self.assertEqual(jobs[0].params, {'a':1, 'b':'x'})
+        self.assertEqual((jobs[0].start_date, jobs[0].end_date), dates[0])
+        self.assertEqual(jobs[1].params, {'a':1, 'b':'x'})
+        self.assertEqual((jobs[1].start_date, jobs[1].end_date), dates[1])
+        self.assertEqual(jobs[-1].params, {'a':2, 'b':'z'})
+        
+        params = [job.params for job in jobs[::2]]
+        self.assertEqual(params, [{'a':a, 'b':b} for a in [1,2] \
+                                  for b in ['x','y','z']])
+    
+    def test_scalar_params(self):
+        jobs = make_jobs("momentum.py", {'a':[1,2], 'b':5})
+        self.assertEqual([job.params for job in jobs],
+                         [{'a':1, 'b':5}, {'a':2, 'b':5}])
+    
+    def test_duplicate_names(self):
+        jobs = make_jobs("momentum.py", {'a':[1,2]})
+        jobs = jobs + jobs[:1]
+        self.assertRaises(ValidationError, run_sweep, jobs)
+
+class TestSweepResults(unittest.TestCase):
+    
+    def setUp(self):
+        self.jobs = make_jobs("momentum.py", {'a':[1,2,3]})
+        self.results = SweepResults(self.jobs)
+    
+    def test_empty(self):
+        self.assertEqual(len(self.results), 0)
+        self.assertEqual(self.results.names, [])
+        self.assertEqual(len(self.results.jobs), 3)
+        self.assertTrue(self.results.to_frame().empty)
+        self.assertTrue(self.results.summary().empty)
+    
+    def test_add(self):
+        # results arrive out of order, with one failed job
+        self.results.add(self.jobs[2], make_perf([1.0, 3.0]))
+        self.results.add(self.jobs[1], None, "failed")
+        self.results.add(self.jobs[0], make_perf([1.0, 2.0]))
+        
+        self.assertEqual(len(self.results), 2)
+        self.assertEqual(self.results.names, ["momentum_0", "momentum_2"])
+        self.assertEqual(self.results.errors, {"momentum_1":"failed"})
+        self.assertIn("momentum_0", self.results)
+        self.assertNotIn("momentum_1", self.results)
+        pd.testing.assert_frame_equal(self.results["momentum_2"],
+                                      make_perf([1.0, 3.0]))
+        self.assertEqual(str(self.results),
+                         "Blueshift Sweep Results [jobs:3, errors:1]")
+    
+    def test_to_frame(self):
+        self.results.add(self.jobs[2], make_perf([1.0, 3.0]))
+        self.results.add(self.jobs[0], make_perf([1.0, 2.0]))
+        
+        df = self.results.to_frame()
+        self.assertEqual(df.index.names, ['job', None])
+        self.assertEqual(list(df.index.get_level_values(0)),
+                         ["momentum_0"]*2 + ["momentum_2"]*2)
+        self.assertEqual(list(df['net']), [1.0, 2.0, 1.0, 3.0])
+        pd.testing.assert_frame_equal(df.loc["momentum_2"],
+                                      make_perf([1.0, 3.0]),
+                                      check_freq=False)
+    
+    def test_summary(self):
+        self.results.add(self.jobs[2], make_perf([1.0, 3.0]))
+        self.results.add(self.jobs[1], None, "failed")
+        self.results.add(self.jobs[0], make_perf([]))
+        
+        summary = self.results.summary()
+        self.assertEqual(list(summary.index), ["momentum_0", "momentum_2"])
+        self.assertEqual(list(summary['a']), [1, 3])
+        self.assertTrue(pd.isnull(summary.loc["momentum_0", "net"]))
+        self.assertEqual(summary.loc["momentum_2", "net"], 3.0)
+
+if __name__ == '__main__':
+    unittest.main()
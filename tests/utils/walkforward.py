@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Feb 19 10:42:18 2019
+
+@author: prodipta
+"""
+import numpy as np
+import pandas as pd
+import unittest
+from unittest import mock
+
+from blueshift.utils import walkforward
+from blueshift.utils.walkforward import (make_shards, stitch_performance,
+                                         walk_forward)
+from blueshift.utils.sweep import SweepResults
+from blueshift.utils.exceptions import ValidationError
+
+def make_perf(dates, net, commissions, exposure=0):
+    net = np.asarray(net, dtype=float)
+    return pd.DataFrame({'net':net, 'cash':net - exposure,
+                         'liquid_value':net,
+                         'commissions':np.asarray(commissions, dtype=float),
+                         'gross_exposure':float(exposure),
+                         'net_exposure':-float(exposure),
+                         'gross_leverage':0.0, 'net_leverage':0.0},
+                        index=pd.DatetimeIndex(dates))
+
+class TestMakeShards(unittest.TestCase):
+    
+    def setUp(self):
+        # 23 weekdays
+        self.sessions = pd.bdate_range('2019-01-01', '2019-01-31')
+    
+    def test_boundaries(self):
+        jobs = make_shards("/algos/momentum.py", '2019-01-01',
+                           '2019-01-31', 3)
+        self.assertEqual([job.name for job in jobs],
+                         [f"momentum_shard_{i}" for i in range(3)])
+        
+        # contiguous, non-overlapping and covering all sessions
+        self.assertEqual([(job.start_date, job.end_date) for job in jobs],
+                         [(self.sessions[0], self.sessions[7]),
+                          (self.sessions[8], self.sessions[15]),
+                          (self.sessions[16], self.sessions[22])])
+        self.assertEqual([job.record_start for job in jobs],
+                         [None, self.sessions[8], self.sessions[16]])
+        
+        jobs = make_shards("momentum.py", '2019-01-01', '2019-01-31', 1,
+                           params={'a':1}, name="run")
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual(jobs[0].name, "run_shard_0")
+        self.assertEqual(jobs[0].params, {'a':1})
+        self.assertEqual((jobs[0].start_date, jobs[0].end_date),
+                         (self.sessions[0], self.sessions[-1]))
+        self.assertIsNone(jobs[0].record_start)
+    
+    def test_warmup(self):
+        jobs = make_shards("momentum.py", '2019-01-01', '2019-01-31', 3,
+                           warmup=5)
+        # the first shard has no room to warm up
+        self.assertEqual([job.start_date for job in jobs],
+                         [self.sessions[0], self.sessions[3],
+                          self.sessions[11]])
+        self.assertEqual([job.record_start for job in jobs],
+                         [None, self.sessions[8], self.sessions[16]])
+        self.assertEqual([job.end_date for job in jobs],
+                         [self.sessions[7], self.sessions[15],
+                          self.sessions[22]])
+        
+        # warm-up longer than the preceding sessions is clipped
+        jobs = make_shards("momentum.py", '2019-01-01', '2019-01-31', 3,
+                           warmup=20)
+        self.assertEqual([job.start_date for job in jobs],
+                         [self.sessions[0]]*3)
+    
+    def test_invalid(self):
+        self.assertRaises(ValidationError, make_shards, "momentum.py",
+                          '2019-01-01', '2019-01-31', 0)
+        self.assertRaises(ValidationError, make_shards, "momentum.py",
+                          '2019-01-01', '2019-01-31', 2, -1)
+        self.assertRaises(ValidationError, make_shards, "momentum.py",
+                          '2019-01-01', '2019-01-04', 5)
+
+class TestStitchPerformance(unittest.TestCase):
+    
+    def test_stitch(self):
+        first = make_perf(['2019-01-01', '2019-01-02', '2019-01-03'],
+                          [1000, 1010, 1020], [0, 1, 2], 500)
+        # the warm-up row is dropped and sets the base of the run
+        second = make_perf(['2019-01-03', '2019-01-04', '2019-01-07'],
+                           [1005, 1015, 1025], [0.5, 1.5, 2.5], 500)
+        
+        perf = stitch_performance([first, second],
+                                  [None, pd.Timestamp('2019-01-04')],
+                                  1000)
+        self.assertEqual(list(perf.index),
+                         list(pd.DatetimeIndex(['2019-01-01',
+                                                '2019-01-02',
+                                                '2019-01-03',
+                                                '2019-01-04',
+                                                '2019-01-07'])))
+        np.testing.assert_almost_equal(perf['net'].values,
+                                       [1000, 1010, 1020, 1030, 1040])
+        np.testing.assert_almost_equal(perf['liquid_value'].values,
+                                       [1000, 1010, 1020, 1030, 1040])
+        np.testing.assert_almost_equal(perf['cash'].values,
+                                       [500, 510, 520, 530, 540])
+        np.testing.assert_almost_equal(perf['commissions'].values,
+                                       [0, 1, 2, 3, 4])
+        np.testing.assert_almost_equal(perf['gross_leverage'].values,
+                                       500/perf['net'].values)
+        np.testing.assert_almost_equal(perf['net_leverage'].values,
+                                       -500/perf['net'].values)
+    
+    def test_no_warmup(self):
+        # without a warm-up row, a run is re-based on the capital
+        first = make_perf(['2019-01-01', '2019-01-02'], [1000, 950],
+                          [0, 1])
+        second = make_perf(['2019-01-03', '2019-01-04'], [990, 1000],
+                           [1, 2])
+        perf = stitch_performance([first, second],
+                                  [None, pd.Timestamp('2019-01-03')],
+                                  1000)
+        np.testing.assert_almost_equal(perf['net'].values,
+                                       [1000, 950, 940, 950])
+        np.testing.assert_almost_equal(perf['commissions'].values,
+                                       [0, 1, 2, 3])
+        np.testing.assert_almost_equal(perf['gross_leverage'].values,
+                                       [0, 0, 0, 0])
+    
+    def test_tz_and_empty(self):
+        first = make_perf(['2019-01-01', '2019-01-02'], [1000, 1010],
+                          [0, 1])
+        first.index = first.index.tz_localize('Asia/Calcutta')
+        # nothing left after the record start
+        second = make_perf(['2019-01-02'], [1000], [0])
+        second.index = second.index.tz_localize('Asia/Calcutta')
+        
+        perf = stitch_performance([first, second],
+                                  [pd.Timestamp('2019-01-02'),
+                                   pd.Timestamp('2019-01-03')], 1000)
+        self.assertEqual(len(perf), 1)
+        np.testing.assert_almost_equal(perf['net'].values, [1010])
+        np.testing.assert_almost_equal(perf['commissions'].values, [1])
+        
+        self.assertTrue(stitch_performance([], [], 1000).empty)
+
+def fake_sweep(jobs, processes=None, initial_capital=10000, **kwargs):
+    '''
+        completes every job with a flat performance. The in-sample
+        score is the parameter value, except in the first window,
+        where all scores are missing.
+    '''
+    results = SweepResults(jobs)
+    for job in jobs:
+        dates = pd.bdate_range(job.start_date, job.end_date)
+        perf = make_perf(dates, [initial_capital]*len(dates),
+                         [0]*len(dates))
+        missing = "_train_0_" in job.name
+        perf['score'] = np.nan if missing else job.params['a']
+        results.add(job, perf)
+    return results
+
+class TestWalkForward(unittest.TestCase):
+    
+    def test_all_scores_missing(self):
+        with mock.patch.object(walkforward, 'run_sweep',
+                               side_effect=fake_sweep):
+            perf, selection = walk_forward(
+                    "momentum.py", '2019-01-01', '2019-01-31', 10, 5,
+                    params={'a':[1,3,2]}, objective='score',
+                    initial_capital=1000)
+        
+        # the first combination is kept where nothing can be scored
+        self.assertEqual(list(selection['a']), [1, 3, 3])
+        self.assertTrue(np.isnan(selection['score'].iloc[0]))
+        self.assertEqual(list(selection['score'].iloc[1:]), [3, 3])
+        self.assertEqual(perf.index[0], pd.Timestamp('2019-01-15'))
+        self.assertEqual(perf.index[-1], pd.Timestamp('2019-01-31'))
+        np.testing.assert_almost_equal(perf['net'].values, 1000)
+
+if __name__ == '__main__':
+    unittest.main()